@@ -3,8 +3,8 @@
 
 import zipfile
 
-version = "0.0.4"
+version = "0.0.5"
 
-psf_format_revision = 0
+psf_format_revision = 2
 
 compress_type = zipfile.ZIP_DEFLATED
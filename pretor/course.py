@@ -2,8 +2,11 @@
 # Distributed under the GNU AGPLv3 License (https://www.gnu.org/licenses/agpl.txt)
 
 import argparse
+import collections.abc
+import hashlib
 import logging
 import pathlib
+import re
 import sys
 import tabulate
 import toml
@@ -84,36 +87,250 @@ modifying pretor course definitions."""
 def load_courses(pathlist, glob="**/*.toml"):
     """load_courses
 
-    Load course definitions from a list of files or directories
+    Load course definitions from a list of files or directories, returning a
+    CourseRegistry. Definitions are only parsed when they are looked up.
 
     :param pathlist:
     """
 
-    # load all courses in the coursepath
-    courses = {}
-    for p in pathlist:
-        p = pathlib.Path(p)
-        if p.is_file():
-            logging.debug("loading course from file {}".format(p))
+    return CourseRegistry(pathlist, glob)
+
+
+# matches the name key of the [course] table of a course definition, without
+# parsing the TOML; this is only used to decide which file to parse
+course_name_pattern = re.compile(
+    r"""^\s*\[\s*course\s*\]\s*$"""
+    + r"""(?:(?!^\s*\[).)*?"""
+    + r"""^\s*name\s*=\s*(["'])(.*?)\1""",
+    re.MULTILINE | re.DOTALL,
+)
+
+
+class CourseRegistry(collections.abc.Mapping):
+    """CourseRegistry
+
+    Read-only mapping of course names to Course objects for the course
+    definitions found in a list of files or directories (the coursepath).
+
+    Rather than parsing every TOML file in the coursepath, the registry keeps
+    an index of course name to (path, mtime, digest), built by scanning each
+    file for the name in its [course] table. A definition is parsed the first
+    time it is looked up, through load_embedded_course(), so identical
+    definitions share one Course. Files are only read again if their mtime
+    changes, and a lookup of a file which changed since it was indexed
+    refreshes the index first.
+
+    If more than one file defines the same course, the last one found wins.
+    """
+
+    def __init__(this, pathlist, glob="**/*.toml"):
+        """__init__
+
+        :param this:
+        :param pathlist: list of course definition files, or directories to
+        search for them using glob
+        :param glob:
+        """
+
+        this.pathlist = [pathlib.Path(p) for p in pathlist]
+        this.glob = glob
+
+        # course name -> (path, mtime_ns, digest)
+        this.index = {}
+
+        # path -> (mtime_ns, course name or None, digest)
+        this.scanned = {}
+
+        this.refresh()
+
+    def __str__(this):
+        return "<CourseRegistry {} courses: {}>".format(
+            len(this.index), ", ".join(sorted(this.index))
+        )
+
+    def files(this):
+        """files
+
+        Generate the path of every candidate course definition file in the
+        coursepath.
+
+        :param this:
+        """
+
+        for p in this.pathlist:
+            if p.is_file():
+                yield p
+            elif p.is_dir():
+                for fp in sorted(p.glob(this.glob)):
+                    if fp.is_file():
+                        yield fp
+
+    def refresh(this):
+        """refresh
+
+        Rebuild the index from the coursepath, reading only the files which
+        are new or whose mtime has changed since they were last scanned.
+
+        Returns the list of course names whose definition changed, was added,
+        or was removed.
+
+        :param this:
+        """
+
+        old_index = this.index
+        scanned = {}
+        index = {}
+
+        for fp in this.files():
             try:
-                c = load_course_definition(p)
-                courses[c.name] = c
-                logging.debug("loaded course successfully")
-            except Exception as e:
+                mtime_ns = fp.stat().st_mtime_ns
+            except OSError as e:
                 util.log_exception(e)
-                logging.warning("failed to load course from '{}'".format(p))
-        else:
-            for fp in p.glob(glob):
-                logging.debug("loading course from file {}".format(fp))
-                try:
-                    c = load_course_definition(fp)
-                    courses[c.name] = c
-                    logging.debug("loaded course successfully")
-                except Exception as e:
-                    util.log_exception(e)
-                    logging.warning("failed to load course from '{}'".format(fp))
+                continue
+
+            if fp in this.scanned and this.scanned[fp][0] == mtime_ns:
+                scanned[fp] = this.scanned[fp]
+            else:
+                logging.debug("scanning course file {}".format(fp))
+                scanned[fp] = (mtime_ns,) + this.scan(fp)
+
+            name = scanned[fp][1]
+            if name is None:
+                continue
+
+            if name in index:
+                logging.debug(
+                    "course '{}' in {} overrides {}".format(name, fp, index[name][0])
+                )
+            index[name] = (fp, mtime_ns, scanned[fp][2])
+
+        this.scanned = scanned
+        this.index = index
 
-    return courses
+        return sorted(
+            name
+            for name in set(old_index) | set(index)
+            if old_index.get(name) != index.get(name)
+        )
+
+    def reload(this):
+        """reload
+
+        Rebuild the index from the coursepath, reading every file again even
+        if its mtime has not changed. Returns the same as refresh().
+
+        :param this:
+        """
+
+        this.scanned = {}
+        return this.refresh()
+
+    def scan(this, fp):
+        """scan
+
+        Read a file and return a tuple of the course name it defines (or None
+        if it does not look like a course definition), and the SHA-256 hex
+        digest of its contents.
+
+        :param this:
+        :param fp:
+        """
+
+        try:
+            with open(str(fp), "rb") as f:
+                data = f.read()
+        except OSError as e:
+            util.log_exception(e)
+            return None, None
+
+        match = course_name_pattern.search(data.decode("utf-8", errors="replace"))
+        if match is None:
+            return None, None
+
+        return match.group(2), hashlib.sha256(data).hexdigest()
+
+    def __getitem__(this, name):
+        if name not in this.index:
+            raise KeyError(name)
+
+        fp, mtime_ns, digest = this.index[name]
+        try:
+            stale = fp.stat().st_mtime_ns != mtime_ns
+        except OSError:
+            stale = True
+
+        if stale:
+            logging.debug("course file {} changed, refreshing".format(fp))
+            this.refresh()
+            if name not in this.index:
+                raise KeyError(name)
+            fp, mtime_ns, digest = this.index[name]
+
+        if digest in course_cache:
+            return course_cache[digest]
+
+        logging.debug("loading course '{}' from file {}".format(name, fp))
+        try:
+            with open(str(fp), "rb") as f:
+                course_obj = load_embedded_course(f.read())
+        except Exception as e:
+            util.log_exception(e)
+            raise exceptions.InvalidFile(
+                "failed to load course '{}' from '{}'".format(name, fp)
+            )
+
+        if course_obj.name != name:
+            raise exceptions.InvalidFile(
+                "course file '{}' defines '{}', not '{}'".format(
+                    fp, course_obj.name, name
+                )
+            )
+
+        return course_obj
+
+    def __contains__(this, name):
+        return name in this.index
+
+    def __iter__(this):
+        return iter(this.index)
+
+    def __len__(this):
+        return len(this.index)
+
+
+# table of SHA-256 hex digests of course definition TOML to Course objects
+course_cache = {}
+
+
+def load_embedded_course(data):
+    """load_embedded_course
+
+    Load a course definition from the contents of a TOML file, such as the
+    course.toml embedded in a PSF.
+
+    Definitions are cached process-wide by the SHA-256 hash of their
+    contents, so identical definitions are parsed once and share a single
+    Course object. Callers must therefore treat the returned Course and its
+    Assignments as read-only.
+
+    :param data: bytes or str containing the TOML course definition
+    """
+
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    digest = hashlib.sha256(data).hexdigest()
+    if digest not in course_cache:
+        logging.debug("parsing course definition {}".format(digest))
+        text = data.decode("utf-8")
+        course_obj = load_course_definition(util.toml_loads(text))
+
+        # re-serializing the course keeps the definition it was loaded from
+        course_obj.serialized = text
+        course_obj.serialized_digest = digest
+        course_cache[digest] = course_obj
+
+    return course_cache[digest]
 
 
 def load_course_definition(origin):
@@ -238,6 +455,10 @@ class Course:
         this.name = name
         this.description = description
 
+        # cached by dump_string() and digest()
+        this.serialized = None
+        this.serialized_digest = None
+
     def __str__(this):
         return "<Course name='{}', {} assignments>".format(
             this.name, len(this.assignments)
@@ -263,9 +484,15 @@ class Course:
         Generate a serialized representation of this object that can be loaded
         via load_course_definition().
 
+        The result is cached, since a course is not modified once it has been
+        loaded, and is serialized every time a grade on it is saved.
+
         :param this:
         """
 
+        if this.serialized is not None:
+            return this.serialized
+
         data = {}
 
         data["course"] = {"name": this.name, "description": this.description}
@@ -279,7 +506,24 @@ class Course:
             for key in assignment.categories:
                 data[assignment_name][key] = assignment.categories[key]
 
-        return toml.dumps(data)
+        this.serialized = toml.dumps(data)
+        return this.serialized
+
+    def digest(this):
+        """digest
+
+        Return the SHA-256 hash of dump_string() as a hexadecimal string. This
+        identifies the course definition within a PSF.
+
+        :param this:
+        """
+
+        if this.serialized_digest is None:
+            this.serialized_digest = hashlib.sha256(
+                this.dump_string().encode("utf-8")
+            ).hexdigest()
+
+        return this.serialized_digest
 
 
 class Assignment:
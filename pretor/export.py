@@ -4,12 +4,19 @@
 import argparse
 import csv
 import io
+import json
 import logging
+import os
 import pathlib
+import re
 import sys
 import tabulate
+import toml
 
 from . import constants
+from . import course
+from . import exceptions
+from . import gradebook
 from . import util
 from . import psf
 
@@ -39,7 +46,11 @@ def format_moodle(psf_obj):
 
         SEMESTER,COURSE,SECTION,GROUP,SCORE,FEEDBACK
 
-    :param psf_obj:
+    or, for a summary expanded to a single student by Roster.expand():
+
+        SEMESTER,COURSE,SECTION,GROUP,STUDENT,SCORE,FEEDBACK
+
+    :param psf_obj: PSF object or summary from psf.load_summary()
     """
 
     record = get_record(psf_obj)
@@ -53,20 +64,19 @@ def get_record(psf_obj):
 
         SEMESTER,COURSE,SECTION,GROUP,SCORE,FEEDBACK
 
-    In that order from the given PSF.
+    In that order from the given PSF. If the summary has been expanded to a
+    single student by Roster.expand(), the STUDENT field follows GROUP.
 
-    :param psf_obj:
+    :param psf_obj: PSF object or summary from psf.load_summary()
     """
 
     data = get_fields(psf_obj)
-    record = [
-        data["semester"],
-        data["course"],
-        data["section"],
-        data["group"],
-        data["score"],
-        data["feedback"],
-    ]
+    record = [data["semester"], data["course"], data["section"], data["group"]]
+
+    if "student" in data:
+        record.append(data["student"])
+
+    record += [data["score"], data["feedback"]]
 
     return record
 
@@ -78,37 +88,42 @@ def get_fields(psf_obj):
     values if they are missing for the specified PSF. Score is normalized
     to a 100% scale, so a value of 100.00 means full credit.
 
-    :param psf_obj:
+    :param psf_obj: PSF object or summary from psf.load_summary()
     """
 
+    summary = psf_obj
+    if isinstance(psf_obj, psf.PSF):
+        summary = psf_obj.summarize()
+
+    metadata = summary["metadata"]
+
     semester = "UNSPECIFIED"
-    if "semester" in psf_obj.metadata:
-        semester = psf_obj.metadata["semester"]
+    if "semester" in metadata:
+        semester = metadata["semester"]
 
     course = "UNSPECIFIED"
-    if "course" in psf_obj.metadata:
-        course = psf_obj.metadata["course"]
+    if "course" in metadata:
+        course = metadata["course"]
 
     section = "UNSPECIFIED"
-    if "section" in psf_obj.metadata:
-        section = psf_obj.metadata["section"]
+    if "section" in metadata:
+        section = metadata["section"]
 
     group = "UNSPECIFIED"
-    if "group" in psf_obj.metadata:
-        group = psf_obj.metadata["group"]
+    if "group" in metadata:
+        group = metadata["group"]
 
     feedback = ""
 
     score = 0
-    if psf_obj.is_graded():
-        grade_obj = psf_obj.get_grade_rev().grade
-        score = grade_obj.get_score() * 100.0
-        feedback = grade_obj.feedback
+    if summary["grade"] is not None:
+        score = summary["grade"]["score"] * 100.0
+        feedback = summary["grade"]["feedback"]
 
     else:
         feedback += "\nNo grade has been recorded for this assignment."
 
-    return {
+    fields = {
         "semester": semester,
         "course": course,
         "section": section,
@@ -117,8 +132,404 @@ def get_fields(psf_obj):
         "score": score,
     }
 
+    if "student" in summary:
+        fields["student"] = summary["student"]
+
+    return fields
+
+
+def get_key(fields):
+    """get_key
+
+    Return the (semester, course, section, group) tuple identifying the
+    group a set of fields from get_fields() belongs to. Values are converted
+    to strings, so that they compare equal to those read from a CSV file.
+
+    :param fields:
+    """
+
+    return tuple(str(fields[k]) for k in ["semester", "course", "section", "group"])
+
+
+class Roster:
+    """Roster
+
+    Maps groups to the students in them, so that exports can be written with
+    one row per student rather than one per group.
+
+    The roster is loaded from a CSV file with a header row containing (in
+    any order, and any case) the columns SEMESTER, COURSE, SECTION, GROUP
+    and STUDENT, and is indexed by (semester, course, section, group). Each
+    summary is then joined against the index as it is exported, and the
+    roster keeps track of the groups and students which did not match.
+    """
+
+    columns = ["semester", "course", "section", "group", "student"]
+
+    def __init__(this):
+        this.index = {}
+        this.matched = set()
+        this.unmatched_groups = []
+
+    def load(this, path):
+        """load
+
+        Add every student in the roster CSV at path to the index.
+
+        :param this:
+        :param path:
+        """
+
+        logging.debug("loading roster from '{}'".format(path))
+
+        with open(str(path), newline="") as f:
+            reader = csv.reader(f)
+            header = [h.strip().lower() for h in next(reader, [])]
+            for column in this.columns:
+                if column not in header:
+                    raise exceptions.InvalidFile(
+                        "roster '{}' has no {} column".format(path, column.upper())
+                    )
+
+            positions = [header.index(column) for column in this.columns]
+            for lineno, row in enumerate(reader, start=2):
+                if len(row) == 0:
+                    continue
+
+                if len(row) < len(header):
+                    raise exceptions.InvalidFile(
+                        "roster '{}' line {} is missing fields".format(path, lineno)
+                    )
+
+                values = [row[i].strip() for i in positions]
+                this.index.setdefault(tuple(values[:-1]), []).append(values[-1])
+
+    def expand(this, summary):
+        """expand
+
+        Return one copy of summary per student in its group, each with an
+        added "student" key. If the group is not in the roster, it is
+        recorded in unmatched_groups and an empty list is returned.
+
+        :param this:
+        :param summary: summary from psf.load_summary()
+        """
+
+        key = this.match(summary)
+        if key is None:
+            return []
+
+        return [dict(summary, student=student) for student in this.index[key]]
+
+    def match(this, summary):
+        """match
+
+        Look up the group of a summary in the index, marking it as matched.
+        Returns the index key, or None if the group is not in the roster.
+
+        :param this:
+        :param summary: summary from psf.load_summary()
+        """
+
+        key = get_key(get_fields(summary))
+        if key not in this.index:
+            this.unmatched_groups.append((key, summary["path"]))
+            return None
+
+        this.matched.add(key)
+        return key
+
+    def unmatched_students(this):
+        """unmatched_students
+
+        Return a list of (key, student) tuples for every student in the
+        roster whose group did not match any summary.
+
+        :param this:
+        """
+
+        return [
+            (key, student)
+            for key in this.index
+            if key not in this.matched
+            for student in this.index[key]
+        ]
+
+    def report(this):
+        """report
+
+        Log a warning for each unmatched group and student.
+
+        :param this:
+        """
+
+        for key, path in this.unmatched_groups:
+            logging.warning("group {} ({}) is not in the roster".format(key, path))
+
+        for key, student in this.unmatched_students():
+            logging.warning("student {} in group {} has no PSF".format(student, key))
+
+
+class Writer:
+    """Writer
+
+    Base class for export writers. A writer receives each PSF summary in turn
+    via write(), and streams its output to the file it was created with.
+    Writers are registered by format name in WRITERS.
+    """
+
+    def __init__(this, path):
+        """__init__
+
+        :param this:
+        :param path: output path, or "-" for standard out
+        """
+
+        this.path = path
+        this.fp = None
+
+    def open(this, path, newline=None):
+        """open
+
+        Open an output file, treating "-" as standard out.
+
+        :param this:
+        :param path:
+        :param newline: passed to open()
+        """
+
+        if str(path) == "-":
+            return sys.stdout
+
+        return open(str(path), "w", newline=newline)
+
+    def write(this, summary):
+        """write
+
+        Write one PSF summary.
+
+        :param this:
+        :param summary: summary from psf.load_summary()
+        """
+
+        raise NotImplementedError()
+
+    def close(this):
+        """close
+
+        Finish writing output and close any open files.
+
+        :param this:
+        """
+
+        if this.fp is not None and this.fp is not sys.stdout:
+            this.fp.close()
+        this.fp = None
+
+
+class MoodleWriter(Writer):
+    """MoodleWriter
+
+    Write Moodle-compatible CSV, as generated by format_moodle().
+    """
+
+    def write(this, summary):
+        if this.fp is None:
+            this.fp = this.open(this.path)
+        this.fp.write(format_moodle(summary))
+
+
+class TableWriter(Writer):
+    """TableWriter
+
+    Write a human-readable plain text table. The column widths depend on
+    every row, so records are collected and the table is written on close().
+    """
+
+    def __init__(this, path):
+        super().__init__(path)
+        this.records = []
+
+    def write(this, summary):
+        this.records.append(get_record(summary))
 
-def export_cli():
+    def close(this):
+        this.fp = this.open(this.path)
+        this.fp.write(tabulate.tabulate(this.records, tablefmt="plain"))
+        this.fp.write("\n")
+        this.records = []
+        super().close()
+
+
+class JSONLinesWriter(Writer):
+    """JSONLinesWriter
+
+    Write one JSON object per line, containing the fields from get_fields(),
+    as well as the PSF ID, assignment, path, and canonical grade revision ID.
+    """
+
+    def write(this, summary):
+        if this.fp is None:
+            this.fp = this.open(this.path)
+
+        record = get_fields(summary)
+        record["assignment"] = summary["metadata"].get("assignment")
+        record["ID"] = summary["ID"]
+        record["path"] = summary["path"]
+        record["grade_rev"] = summary["grade_rev"]
+        this.fp.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+class SectionWriter(Writer):
+    """SectionWriter
+
+    Write Moodle-compatible CSV, sharded into one file per section. The path
+    is a directory, in which a file named SEMESTER-COURSE-SECTION.csv is
+    created for each section. Characters other than letters, digits, ".", "_"
+    and "-" in the metadata are replaced with "_", so that the files are
+    always created directly in the directory.
+    """
+
+    def __init__(this, path):
+        super().__init__(path)
+        this.shards = {}
+
+    def write(this, summary):
+        fields = get_fields(summary)
+        name = "{}-{}-{}.csv".format(
+            safe_name(fields["semester"]),
+            safe_name(fields["course"]),
+            safe_name(fields["section"]),
+        )
+
+        if name not in this.shards:
+            directory = pathlib.Path(this.path)
+            if not directory.exists():
+                directory.mkdir(parents=True)
+            this.shards[name] = this.open(directory / name)
+
+        this.shards[name].write(format_moodle(summary))
+
+    def close(this):
+        for name in this.shards:
+            this.shards[name].close()
+        this.shards = {}
+
+
+def safe_name(value):
+    """safe_name
+
+    Return value as a string which is safe to use in a file name, by
+    replacing every character other than letters, digits, ".", "_" and "-"
+    with "_".
+
+    :param value:
+    """
+
+    return re.sub(r"[^A-Za-z0-9._-]", "_", str(value))
+
+
+WRITERS = {
+    "moodle": MoodleWriter,
+    "table": TableWriter,
+    "jsonl": JSONLinesWriter,
+    "sections": SectionWriter,
+}
+
+
+def make_writer(spec):
+    """make_writer
+
+    Instantiate a writer from a FORMAT:PATH specification, where FORMAT is a
+    key in WRITERS. If PATH is omitted, standard out is used.
+
+    :param spec:
+    """
+
+    fmt, _, path = spec.partition(":")
+    if fmt not in WRITERS:
+        raise KeyError(
+            "unknown export format '{}', choose from: {}".format(
+                fmt, ", ".join(WRITERS)
+            )
+        )
+
+    if path == "":
+        path = "-"
+
+    return WRITERS[fmt](path)
+
+
+def grade_mark(summary):
+    """grade_mark
+
+    Return the watermark entry recorded for a PSF summary: a table containing
+    the resolved path of the PSF, and its canonical grade revision ID and
+    score, or an empty grade_rev if the PSF is not graded.
+
+    :param summary: summary from psf.load_summary()
+    """
+
+    mark = {"path": os.path.realpath(str(summary["path"])), "grade_rev": ""}
+    if summary["grade"] is not None:
+        mark["grade_rev"] = summary["grade_rev"]
+        mark["score"] = summary["grade"]["score"]
+
+    return mark
+
+
+def watermark_key(summary):
+    """watermark_key
+
+    Return the key of the watermark entry for a PSF summary. Entries are
+    keyed on both the resolved path and the ID of the PSF, so that copies of
+    the same PSF are tracked separately.
+
+    :param summary: summary from psf.load_summary()
+    """
+
+    return "{}:{}".format(os.path.realpath(str(summary["path"])), summary["ID"])
+
+
+def load_watermark(path):
+    """load_watermark
+
+    Load a watermark state file written by save_watermark(), returning a
+    table of watermark_key() keys to grade_mark() entries. A missing file is
+    treated as an empty watermark, so that everything is exported.
+
+    :param path:
+    """
+
+    path = pathlib.Path(path)
+    if not path.exists():
+        logging.info("watermark '{}' does not exist, exporting all".format(path))
+        return {}
+
+    data = toml.load(str(path))
+    if "psf" not in data:
+        return {}
+
+    return data["psf"]
+
+
+def save_watermark(path, marks):
+    """save_watermark
+
+    Atomically replace the watermark state file at path.
+
+    :param path:
+    :param marks: table of watermark_key() keys to grade_mark() entries
+    """
+
+    path = pathlib.Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(str(tmp), "w") as f:
+        f.write(toml.dumps({"psf": marks}))
+    os.replace(str(tmp), str(path))
+
+
+def export_cli(argv=None):
     parser = argparse.ArgumentParser(
         """
 A tool for exporting Pretor grades into various formats.
@@ -143,49 +554,187 @@ A tool for exporting Pretor grades into various formats.
         + " (default: **/*.psf)",
     )
 
-    format = parser.add_mutually_exclusive_group(required=True)
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        default=None,
+        type=int,
+        help="Number of PSFs to load in parallel. (default: one per CPU)",
+    )
 
-    format.add_argument(
+    parser.add_argument(
         "--moodle",
         "-m",
         default=False,
         action="store_true",
-        help="Export to Moodle-compatible CSV",
+        help="Export to Moodle-compatible CSV on standard out. "
+        + "Equivalent to --output moodle:-",
     )
 
-    format.add_argument(
+    parser.add_argument(
         "--table",
         "-t",
         default=False,
         action="store_true",
-        help="Export to human-readable plain text table",
+        help="Export to human-readable plain text table on standard out. "
+        + "Equivalent to --output table:-",
     )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--output",
+        "-o",
+        default=[],
+        action="append",
+        help="Export to FORMAT:PATH, where FORMAT is one of "
+        + "{} and PATH is a file, or '-' for ".format(", ".join(WRITERS))
+        + "standard out. For the sections format, PATH is a directory "
+        + "which will receive one CSV file per section. May be given "
+        + "several times; every output is written in a single pass over "
+        + "the PSFs.",
+    )
+
+    parser.add_argument(
+        "--since",
+        "-s",
+        default=None,
+        help="Path to a watermark state file. Only PSFs whose canonical "
+        + "grade revision or score differs from the one recorded in the "
+        + "file are exported, and the file is updated once the export "
+        + "completes. If the file does not exist, every PSF is exported.",
+    )
+
+    parser.add_argument(
+        "--gradebook",
+        "-g",
+        default=None,
+        type=pathlib.Path,
+        help="Write a gradebook for the course defined in the specified "
+        + "course definition file to standard out as CSV. The gradebook "
+        + "has one row per student or group, with their score on each "
+        + "assignment, their weighted course total, and a letter grade.",
+    )
+
+    parser.add_argument(
+        "--missing",
+        default="zero",
+        choices=["zero", "drop"],
+        help="How the gradebook treats assignments with no grade: 'zero' "
+        + "counts them as 0, 'drop' leaves them (and their weight) out of "
+        + "the course total. (default: zero)",
+    )
+
+    parser.add_argument(
+        "--cutoffs",
+        default=None,
+        help="Letter grade cutoffs for the gradebook, as a comma-delimited "
+        + "list of LETTER=MINIMUM with scores in 0..1. "
+        + "(default: A=0.9,B=0.8,C=0.7,D=0.6,F=0)",
+    )
+
+    parser.add_argument(
+        "--roster",
+        "-r",
+        default=None,
+        type=pathlib.Path,
+        help="Path to a roster CSV with the columns SEMESTER, COURSE, "
+        + "SECTION, GROUP and STUDENT. Outputs are written with one row per "
+        + "student instead of one per group, and groups or students which "
+        + "do not appear on both sides are reported.",
+    )
+
+    args = None
+    if argv is not None:
+        args = parser.parse_args(argv)
+    else:
+        args = parser.parse_args()
 
     if args.debug:
         util.setup_logging(logging.DEBUG)
     else:
         util.setup_logging()
 
-    PSFs = []
-    try:
-        for path in pathlib.Path().glob(args.input):
-            if path.is_file():
-                PSFs.append(psf.PSF())
-                PSFs[-1].load_from_archive(path)
+    specs = list(args.output)
+    if args.moodle:
+        specs.append("moodle:-")
+    if args.table:
+        specs.append("table:-")
 
-        logging.debug("loaded {} PSFs".format(len(PSFs)))
+    if len(specs) == 0 and args.gradebook is None:
+        parser.error("one of --moodle, --table, --output or --gradebook is required")
 
-        if args.moodle:
-            for p in PSFs:
-                sys.stdout.write(format_moodle(p))
-
-        elif args.table:
-            sys.stdout.write(
-                tabulate.tabulate([get_record(p) for p in PSFs], tablefmt="plain")
+    try:
+        writers = [make_writer(spec) for spec in specs]
+
+        book = None
+        cutoffs = gradebook.default_cutoffs
+        if args.gradebook is not None:
+            book = gradebook.Gradebook(course.load_course_definition(args.gradebook))
+            if args.cutoffs is not None:
+                cutoffs = gradebook.parse_cutoffs(args.cutoffs)
+
+        roster = None
+        if args.roster is not None:
+            roster = Roster()
+            roster.load(args.roster)
+
+        # sorted so that the output order does not depend on the filesystem
+        paths = sorted(p for p in pathlib.Path().glob(args.input) if p.is_file())
+        logging.debug("exporting {} PSFs".format(len(paths)))
+
+        summaries = psf.load_summaries(paths, args.jobs)
+
+        marks = {}
+        if args.since is not None:
+            marks = load_watermark(args.since)
+
+        exported = 0
+        for summary in summaries:
+            if book is not None:
+                book.add_summary(summary)
+
+            # matched before the watermark check, so that students whose
+            # group is unchanged are not reported as missing
+            records = [summary]
+            if roster is not None:
+                records = roster.expand(summary)
+
+            if args.since is not None:
+                key = watermark_key(summary)
+                mark = grade_mark(summary)
+                if marks.get(key) == mark:
+                    continue
+                marks[key] = mark
+
+            for record in records:
+                for writer in writers:
+                    writer.write(record)
+            exported += 1
+
+        for writer in writers:
+            writer.close()
+
+        if roster is not None:
+            roster.report()
+
+        if book is not None:
+            writer = csv.writer(sys.stdout)
+            writer.writerow(book.header())
+            writer.writerows(book.records(args.missing, cutoffs))
+
+        logging.debug("exported {} of {} PSFs".format(exported, len(paths)))
+
+        # only advance the watermark once every writer has succeeded. PSFs
+        # outside of --input are kept, but those which no longer exist are
+        # dropped so that the watermark does not grow without bound
+        if args.since is not None:
+            save_watermark(
+                args.since,
+                {
+                    key: mark
+                    for key, mark in marks.items()
+                    if os.path.exists(mark.get("path", ""))
+                },
             )
-            sys.stdout.write("\n")
 
     except Exception as e:
         util.log_exception(e)
@@ -1,8 +1,10 @@
 # Copyright 2019 Charles A Daniels
 # Distributed under the GNU AGPLv3 License (https://www.gnu.org/licenses/agpl.txt)
 
+import array
 import copy
 import logging
+import math
 import os
 import pathlib
 import sys
@@ -15,6 +17,11 @@ from . import constants
 from . import course
 from . import util
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def grade_dbg_cli():
 
@@ -127,6 +134,8 @@ class Grade:
 
     override: override final score (0..1)
 
+    curve_score: score adjustment applied by pretor-rescore --curve (0..1)
+
     See the documentation for get_score() for information on how scores are
     calculated.
 
@@ -153,6 +162,8 @@ class Grade:
         this.penalty_marks = 0
         this.penalty_score = 0.0
 
+        this.curve_score = 0.0
+
         this.categories = copy.deepcopy(this.assignment.categories)
 
     def __str__(this):
@@ -177,7 +188,8 @@ class Grade:
         than 0 or greater than 1 is allowed.
 
         If the override field is ``None``, then the assignment grade is
-        calculated as g = ((m + b_m - p_m)/ M) * (1.0 + b - p) + B - P, where:
+        calculated as g = ((m + b_m - p_m)/ M) * (1.0 + b - p) + B - P + C,
+        where:
 
         g is the final percent score in 0..1 (scores of higher than 1 may be
         possible with bonus)
@@ -200,6 +212,8 @@ class Grade:
 
         P is the score penalty
 
+        C is the curve adjustment
+
         :param this:
         """
 
@@ -214,6 +228,8 @@ class Grade:
 
         marks += this.bonus_score - this.penalty_score
 
+        marks += this.curve_score
+
         return marks
 
     def get_marks(this):
@@ -257,6 +273,9 @@ class Grade:
         if this.override is not None:
             data["override"] = this.override
 
+        if this.curve_score != 0:
+            data["curve_score"] = this.curve_score
+
         # this is required because the PSF archive loader stores the entire
         # course definition, and we need to know which specific assignment
         # to load
@@ -278,12 +297,14 @@ class Grade:
         :param this:
         """
 
-        s = "SCORECARD FOR {}: {}\n\n".format(
-            this.assignment.course.name, this.assignment.name
-        )
+        lines = [
+            "SCORECARD FOR {}: {}\n\n".format(
+                this.assignment.course.name, this.assignment.name
+            )
+        ]
 
         if this.feedback != "":
-            s += this.feedback + "\n\n"
+            lines.append(this.feedback + "\n\n")
 
         table_data = [["CATEGORY", "MARKS", "MAX MARKS", "PERCENT SCORE"]]
 
@@ -303,59 +324,71 @@ class Grade:
         if this.penalty_marks != 0:
             table_data.append(["PENALTY MARKS", this.penalty_marks, "--", "--"])
 
-        s += tabulate.tabulate(table_data, tablefmt="plain")
-
-        s += "\n\n"
+        lines.append(tabulate.tabulate(table_data, tablefmt="plain"))
+        lines.append("\n\n")
 
-        raw_score = this.get_marks() / this.assignment.max_marks()
-        raw_score_net = (
-            this.get_marks() + this.bonus_marks + this.penalty_marks
-        ) / this.assignment.max_marks()
+        marks = this.get_marks()
+        max_marks = this.assignment.max_marks()
+        raw_score = marks / max_marks
+        raw_score_net = (marks + this.bonus_marks + this.penalty_marks) / max_marks
 
-        s += "OVERALL MARKS: {}\n".format(this.get_marks())
-        s += "MAXIMUM OVERALL MARKS: {}\n".format(this.assignment.max_marks())
-        s += "RAW SCORE: {:3.2f}%\n".format(raw_score * 100)
+        lines.append("OVERALL MARKS: {}\n".format(marks))
+        lines.append("MAXIMUM OVERALL MARKS: {}\n".format(max_marks))
+        lines.append("RAW SCORE: {:3.2f}%\n".format(raw_score * 100))
 
         if this.bonus_marks != 0 or this.penalty_marks != 0:
-            s += "RAW SCORE NET OF BONUS/PENALTY MARKS: {:3.2f}%\n".format(
-                raw_score_net * 100
+            lines.append(
+                "RAW SCORE NET OF BONUS/PENALTY MARKS: {:3.2f}%\n".format(
+                    raw_score_net * 100
+                )
             )
 
-        s += "\n"
+        lines.append("\n")
 
         score_multiplier = raw_score_net * (
             1.0 + this.bonus_multiplier - this.penalty_multiplier
         )
 
         if this.bonus_multiplier != 0:
-            s += "BONUS MULTIPLIER: {:3.2f}\n".format(this.bonus_multiplier)
+            lines.append("BONUS MULTIPLIER: {:3.2f}\n".format(this.bonus_multiplier))
 
         if this.penalty_multiplier != 0:
-            s += "PENALTY MULTIPLIER: {:3.2f}\n".format(this.penalty_multiplier)
+            lines.append(
+                "PENALTY MULTIPLIER: {:3.2f}\n".format(this.penalty_multiplier)
+            )
 
         if this.penalty_multiplier != 0 or this.bonus_multiplier != 0:
-            s += "SCORE NET OF BONUS/PENALTY MULTIPLIER: {:3.2f}%\n\n".format(
-                score_multiplier * 100
+            lines.append(
+                "SCORE NET OF BONUS/PENALTY MULTIPLIER: {:3.2f}%\n\n".format(
+                    score_multiplier * 100
+                )
             )
 
         score_bonus = score_multiplier + this.bonus_score - this.penalty_score
         if this.bonus_score != 0:
-            s += "BONUS SCORE: {:3.2f}%\n".format(this.bonus_score * 100)
+            lines.append("BONUS SCORE: {:3.2f}%\n".format(this.bonus_score * 100))
 
         if this.penalty_score != 0:
-            s += "PENALTY SCORE: {:3.2f}%\n".format(this.penalty_score * 100)
+            lines.append("PENALTY SCORE: {:3.2f}%\n".format(this.penalty_score * 100))
 
         if this.penalty_score != 0 or this.bonus_score != 0:
-            s += "SCORE NET OF BONUS/PENALTY SCORE: {:3.2f}%\n\n".format(
-                score_bonus * 100
+            lines.append(
+                "SCORE NET OF BONUS/PENALTY SCORE: {:3.2f}%\n\n".format(
+                    score_bonus * 100
+                )
+            )
+
+        if this.curve_score != 0:
+            lines.append(
+                "CURVE ADJUSTMENT: {:+3.2f}%\n\n".format(this.curve_score * 100)
             )
 
         if this.override is not None:
-            s += "SCORE HAS BEEN OVERRIDDEN BY GRADER\n\n"
+            lines.append("SCORE HAS BEEN OVERRIDDEN BY GRADER\n\n")
 
-        s += "OVERALL SCORE: {:3.2f}%\n".format(this.get_score() * 100)
+        lines.append("OVERALL SCORE: {:3.2f}%\n".format(this.get_score() * 100))
 
-        return s
+        return "".join(lines)
 
     def get_category_percent(this, category):
         """get_category_percent
@@ -381,7 +414,7 @@ class Grade:
         Additionally, a grade file may contain the following optional keys, as
         specified in the description of this object: feedback,
         bonus_multiplier, bonus_marks, bonus_score, penalty_multiplier,
-        penalty_marks, penalty_score.
+        penalty_marks, penalty_score, curve_score.
 
         :param this:
         :param path:
@@ -432,6 +465,9 @@ class Grade:
             if "penalty_score" in grade_data:
                 this.penalty_score = float(grade_data["penalty_score"])
 
+            if "curve_score" in grade_data:
+                this.curve_score = float(grade_data["curve_score"])
+
         except Exception as e:
             util.log_exception(e)
             raise exceptions.InvalidFile(
@@ -468,3 +504,223 @@ class Grade:
                 )
 
             this.categories[category] = marks
+
+
+class GradeTable:
+    """GradeTable
+
+    Columnar representation of many grades on a single assignment, used for
+    batch scoring. Each category of the assignment, and each of the bonus,
+    penalty, curve and override fields of Grade, is stored as an array of
+    floats with one element per grade. Overrides are stored as NaN where a
+    grade has none, and feedback is stored as a list of strings.
+
+    The maximum marks of the assignment are computed once, and scores() then
+    computes the score of every grade at once, following the same formula as
+    Grade.get_score(). NumPy is used to do so if it is available.
+    """
+
+    fields = [
+        "bonus_multiplier",
+        "bonus_marks",
+        "bonus_score",
+        "penalty_multiplier",
+        "penalty_marks",
+        "penalty_score",
+        "curve_score",
+        "override",
+    ]
+
+    def __init__(this, assignment: course.Assignment):
+        """__init__
+
+        :param this:
+        :param assignment:
+        :type assignment: course.Assignment
+        """
+
+        this.assignment = assignment
+        this.max_marks = assignment.max_marks()
+        this.categories = {name: array.array("d") for name in assignment.categories}
+        this.columns = {name: array.array("d") for name in this.fields}
+        this.feedback = []
+
+    def __len__(this):
+        return len(this.feedback)
+
+    @classmethod
+    def from_grades(cls, assignment, grades):
+        """from_grades
+
+        Create a GradeTable from a list of Grade objects on assignment.
+
+        :param cls:
+        :param assignment:
+        :param grades:
+        """
+
+        table = cls(assignment)
+        for grade_obj in grades:
+            table.add_grade(grade_obj)
+        return table
+
+    def add_grade(this, grade_obj):
+        """add_grade
+
+        Append a Grade object to the table, returning its row index.
+
+        :param this:
+        :param grade_obj:
+        """
+
+        return this.add_data(
+            grade_obj.categories,
+            feedback=grade_obj.feedback,
+            **{name: getattr(grade_obj, name) for name in this.fields}
+        )
+
+    def add_data(this, categories, feedback="", **fields):
+        """add_data
+
+        Append a grade given as plain values, such as the "grade" table of a
+        PSF summary, returning its row index.
+
+        Categories of the assignment which are missing from categories are
+        given full marks, as they are by Grade, and categories which are not
+        in the assignment are ignored.
+
+        :param this:
+        :param categories: table of category names to marks
+        :param feedback:
+        :param fields: any of the fields in GradeTable.fields, which default
+        to the same values as in a new Grade
+        """
+
+        for name in this.categories:
+            this.categories[name].append(
+                categories.get(name, this.assignment.categories[name])
+            )
+
+        for name in this.fields:
+            value = fields.get(name)
+            if value is None:
+                value = math.nan if name == "override" else 0.0
+            this.columns[name].append(value)
+
+        this.feedback.append(feedback)
+
+        return len(this.feedback) - 1
+
+    def get_grade(this, row):
+        """get_grade
+
+        Return a new Grade object for a single row of the table.
+
+        :param this:
+        :param row:
+        """
+
+        grade_obj = Grade(this.assignment)
+        grade_obj.feedback = this.feedback[row]
+
+        for name in this.categories:
+            grade_obj.categories[name] = int(this.categories[name][row])
+
+        for name in ["bonus_marks", "penalty_marks"]:
+            setattr(grade_obj, name, int(this.columns[name][row]))
+
+        for name in [
+            "bonus_multiplier",
+            "bonus_score",
+            "penalty_multiplier",
+            "penalty_score",
+            "curve_score",
+        ]:
+            setattr(grade_obj, name, this.columns[name][row])
+
+        override = this.columns["override"][row]
+        if not math.isnan(override):
+            grade_obj.override = override
+
+        return grade_obj
+
+    def to_grades(this):
+        """to_grades
+
+        Return a list of Grade objects, one per row of the table.
+
+        :param this:
+        """
+
+        return [this.get_grade(row) for row in range(len(this))]
+
+    def marks(this):
+        """marks
+
+        Return the total earned marks (the sum of the category columns) of
+        every grade as an array.
+
+        :param this:
+        """
+
+        marks = array.array("d", bytes(8 * len(this)))
+        for column in this.categories.values():
+            for row in range(len(column)):
+                marks[row] += column[row]
+        return marks
+
+    def scores(this):
+        """scores
+
+        Compute the score of every grade as an array of floats in 0..1, in
+        row order. See Grade.get_score().
+
+        :param this:
+        """
+
+        if len(this) == 0:
+            return array.array("d")
+
+        if numpy is not None:
+            return this.scores_numpy()
+
+        marks = this.marks()
+        c = this.columns
+        scores = array.array("d", bytes(8 * len(this)))
+        for row in range(len(this)):
+            if not math.isnan(c["override"][row]):
+                scores[row] = c["override"][row]
+                continue
+
+            scores[row] = (
+                marks[row] + c["bonus_marks"][row] - c["penalty_marks"][row]
+            ) / this.max_marks
+            scores[row] *= (
+                1.0 + c["bonus_multiplier"][row] - c["penalty_multiplier"][row]
+            )
+            scores[row] += c["bonus_score"][row] - c["penalty_score"][row]
+            scores[row] += c["curve_score"][row]
+
+        return scores
+
+    def scores_numpy(this):
+        """scores_numpy
+
+        Implementation of scores() using NumPy.
+
+        :param this:
+        """
+
+        def column(data):
+            return numpy.frombuffer(data, dtype=numpy.float64)
+
+        c = {name: column(this.columns[name]) for name in this.fields}
+        marks = sum(column(data) for data in this.categories.values())
+
+        scores = (marks + c["bonus_marks"] - c["penalty_marks"]) / this.max_marks
+        scores *= 1.0 + c["bonus_multiplier"] - c["penalty_multiplier"]
+        scores += c["bonus_score"] - c["penalty_score"]
+        scores += c["curve_score"]
+        scores = numpy.where(numpy.isnan(c["override"]), scores, c["override"])
+
+        return array.array("d", scores.astype(numpy.float64).tobytes())
@@ -0,0 +1,234 @@
+# Copyright 2019 Charles A Daniels
+# Distributed under the GNU AGPLv3 License (https://www.gnu.org/licenses/agpl.txt)
+
+import array
+import logging
+
+from . import exceptions
+
+"""
+This module implements the course gradebook, which rolls canonical grades on
+each assignment of a course up into weighted course totals and letter grades.
+"""
+
+default_cutoffs = [("A", 0.9), ("B", 0.8), ("C", 0.7), ("D", 0.6), ("F", 0.0)]
+
+
+def parse_cutoffs(spec):
+    """parse_cutoffs
+
+    Parse a letter grade cutoff specification of the form "A=0.9,B=0.8,F=0"
+    into a list of (letter, minimum score) tuples, sorted from highest to
+    lowest minimum score.
+
+    :param spec:
+    """
+
+    cutoffs = []
+    for item in spec.split(","):
+        if "=" not in item:
+            raise exceptions.InvalidFile("malformed cutoff '{}'".format(item))
+
+        letter, minimum = item.split("=", 1)
+        cutoffs.append((letter.strip(), float(minimum)))
+
+    return sorted(cutoffs, key=lambda c: c[1], reverse=True)
+
+
+class Gradebook:
+    """Gradebook
+
+    Columnar gradebook for a single course. Each student (or group) is a row,
+    identified by a (semester, course, section, group) tuple, and each
+    assignment of the course is a column. Scores are stored in a single flat
+    array in row-major order, alongside a mask recording which cells have a
+    canonical grade, so that course totals can be computed in one pass over
+    the arrays.
+    """
+
+    def __init__(this, course_obj):
+        """__init__
+
+        :param this:
+        :param course_obj: the course.Course to build the gradebook for
+        """
+
+        this.course = course_obj
+        this.assignments = list(course_obj.assignments.keys())
+        this.columns = {name: i for i, name in enumerate(this.assignments)}
+        this.weights = array.array(
+            "d", [course_obj.assignments[a].weight for a in this.assignments]
+        )
+
+        this.students = []
+        this.rows = {}
+        this.scores = array.array("d")
+        this.present = bytearray()
+
+    def add_row(this, key):
+        """add_row
+
+        Return the row index for the student identified by key, adding an
+        empty row if there is not one already.
+
+        :param this:
+        :param key: (semester, course, section, group) tuple
+        """
+
+        if key not in this.rows:
+            this.rows[key] = len(this.students)
+            this.students.append(key)
+            this.scores.extend([0.0] * len(this.assignments))
+            this.present.extend(bytes(len(this.assignments)))
+
+        return this.rows[key]
+
+    def add_summary(this, summary):
+        """add_summary
+
+        Add the canonical grade of a PSF summary (as produced by
+        psf.load_summary()) to the gradebook. Summaries for other courses are
+        ignored, and ungraded summaries only add an empty row for the student.
+
+        Returns True if the summary was added.
+
+        :param this:
+        :param summary:
+        """
+
+        metadata = summary["metadata"]
+        grade = summary["grade"]
+
+        course_name = metadata.get("course")
+        if grade is not None:
+            course_name = grade["course"]
+
+        if course_name != this.course.name:
+            return False
+
+        key = tuple(
+            metadata.get(k, "UNSPECIFIED")
+            for k in ["semester", "course", "section", "group"]
+        )
+        row = this.add_row(key)
+
+        if grade is None:
+            return True
+
+        if grade["assignment"] not in this.columns:
+            logging.warning(
+                "{} has a grade for unknown assignment '{}', ignoring it".format(
+                    summary["path"], grade["assignment"]
+                )
+            )
+            return False
+
+        cell = row * len(this.assignments) + this.columns[grade["assignment"]]
+        if this.present[cell]:
+            logging.warning(
+                "{} has more than one grade for '{}', using {}".format(
+                    key, grade["assignment"], summary["path"]
+                )
+            )
+
+        this.scores[cell] = grade["score"]
+        this.present[cell] = 1
+
+        return True
+
+    def totals(this, missing="zero"):
+        """totals
+
+        Compute the weighted course total in 0..1 for every row, returning an
+        array in row order.
+
+        Totals are normalized by the sum of the weights considered, so a
+        course whose weights do not sum to 1 still yields a total in 0..1.
+
+        :param this:
+        :param missing: how to handle assignments with no canonical grade;
+        "zero" counts them as a score of 0, and "drop" excludes them (and
+        their weight) from the total.
+        """
+
+        if missing not in ["zero", "drop"]:
+            raise ValueError("invalid missing policy '{}'".format(missing))
+
+        width = len(this.assignments)
+        weights = this.weights
+        total_weight = sum(weights)
+        totals = array.array("d", bytes(8 * len(this.students)))
+
+        for row in range(len(this.students)):
+            base = row * width
+            earned = 0.0
+            weight = 0.0
+            for col in range(width):
+                if this.present[base + col]:
+                    earned += weights[col] * this.scores[base + col]
+                    weight += weights[col]
+
+            if missing == "zero":
+                weight = total_weight
+
+            if weight > 0:
+                totals[row] = earned / weight
+
+        return totals
+
+    def letters(this, totals, cutoffs=default_cutoffs):
+        """letters
+
+        Assign a letter grade to each total.
+
+        :param this:
+        :param totals: as returned by totals()
+        :param cutoffs: list of (letter, minimum score) tuples, sorted from
+        highest to lowest minimum, as returned by parse_cutoffs(). Totals
+        below every minimum are assigned the last letter.
+        """
+
+        return [
+            next(
+                (letter for letter, minimum in cutoffs if t >= minimum), cutoffs[-1][0]
+            )
+            for t in totals
+        ]
+
+    def records(this, missing="zero", cutoffs=default_cutoffs):
+        """records
+
+        Generate one record per row, containing the row key, the score on each
+        assignment as a percentage (or None if missing), the course total as a
+        percentage, and the letter grade.
+
+        :param this:
+        :param missing: see totals()
+        :param cutoffs: see letters()
+        """
+
+        totals = this.totals(missing)
+        letters = this.letters(totals, cutoffs)
+        width = len(this.assignments)
+
+        for row, key in enumerate(this.students):
+            base = row * width
+            cells = [
+                this.scores[base + col] * 100.0 if this.present[base + col] else None
+                for col in range(width)
+            ]
+            yield list(key) + cells + [totals[row] * 100.0, letters[row]]
+
+    def header(this):
+        """header
+
+        Return the column names for records().
+
+        :param this:
+        """
+
+        return (
+            ["SEMESTER", "COURSE", "SECTION", "GROUP"]
+            + this.assignments
+            + ["TOTAL", "LETTER"]
+        )
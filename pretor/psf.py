@@ -6,11 +6,15 @@ import copy
 import datetime
 import difflib
 import getpass
+import hashlib
+import glob as globlib
 import io
+import json
 import logging
 import os
 import pathlib
 import re
+import shutil
 import socket
 import subprocess
 import sys
@@ -28,6 +32,30 @@ from . import course
 from . import grade
 
 
+# read-only actions which pretor-psf can apply to many PSFs at once, and how
+# much of each PSF they need to be loaded
+batch_actions = {
+    "summarize": "lazy",
+    "metadata": "header",
+    "manifest": "lazy",
+    "forensic": "header",
+    "lsrev": "header",
+    "diff": "full",
+    "extract": "full",
+    "scorecard": "header",
+}
+
+# codecs for PSF metadata members, by file extension, as (loads, dumps). loads
+# is given the member as bytes, which json.loads() only accepts since 3.6
+member_codecs = {
+    ".toml": (util.toml_loads, toml.dumps),
+    ".json": (
+        lambda data: json.loads(data.decode("utf-8")),
+        lambda obj: json.dumps(obj, separators=(",", ":")),
+    ),
+}
+
+
 def psf_cli(argv=None):
     parser = argparse.ArgumentParser(
         """Generate, inspect, and extract PSF
@@ -49,9 +77,11 @@ def psf_cli(argv=None):
         "-D",
         default=None,
         help="Specify destination directory for"
-        + " output file. Only used when combined with --create or"
-        + " --extract. (default: ../ when used with --create, or"
-        + "the name value when used with --extract)",
+        + " output file. Only used when combined with --create,"
+        + " --extract, or --scorecard on many PSFs. When extracting many"
+        + " PSFs, each is extracted into a directory named after it within"
+        + " the destination. (default: ../ when used with --create, or"
+        + " the name value when used with --extract)",
     )
 
     parser.add_argument(
@@ -76,8 +106,22 @@ def psf_cli(argv=None):
         "--input",
         "-i",
         default=None,
+        nargs="+",
         help="Input file when using --extract, --manifest, --metadata "
-        + "or --summarize.",
+        + "or --summarize. Except with --interact, several inputs may be "
+        + "given, each of which may also be a directory to search for PSFs, "
+        + "or a glob pattern, in which case the action is applied to every "
+        + "PSF in parallel, and the output for each is labelled with its "
+        + "path.",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        default=None,
+        type=int,
+        help="Number of PSFs to process in parallel when --input names "
+        + "many PSFs. (default: one per CPU)",
     )
 
     parser.add_argument(
@@ -170,6 +214,16 @@ def psf_cli(argv=None):
         + "file to be overwritten even if it already exists.",
     )
 
+    parser.add_argument(
+        "--sidecars",
+        default=False,
+        action="store_true",
+        help="Write JSON sidecars for metadata members, which are faster to "
+        + "load, using PSF format revision 2. PSFs which already have "
+        + "sidecars keep them when modified. Only used when combined with "
+        + "--create, --interact, or --modifymetadata.",
+    )
+
     parser.add_argument(
         "--coursepath",
         "-P",
@@ -255,6 +309,17 @@ def psf_cli(argv=None):
         + "will be used and appended to the end of the revision chain.",
     )
 
+    action.add_argument(
+        "--verify",
+        default=False,
+        action="store_true",
+        help="Check the integrity of the input archives, including the CRC "
+        + "of every member, the consistency of the revision data, that "
+        + "grades and course definitions can be loaded, the hashes of "
+        + "course definitions, and the summary in pretor_data.toml. A report "
+        + "is written to standard output as one JSON object per PSF.",
+    )
+
     action.add_argument(
         "--lsrev",
         "-L",
@@ -370,6 +435,7 @@ def psf_cli(argv=None):
         logging.info("reading data from {}".format(args.source))
         psf = PSF()
         psf.load_from_dir(args.source, args.revid, excludelist)
+        psf.sidecars = args.sidecars
 
         # flag use of --no_meta_check
         if args.no_meta_check:
@@ -440,6 +506,66 @@ def psf_cli(argv=None):
         logging.error("No input file specified.")
         sys.exit(1)
 
+    if args.verify:
+        try:
+            paths = []
+            for pattern in args.input:
+                paths += expand_inputs(pattern)
+
+            failed = 0
+            for report in util.parallel_map(verify_archive, paths, args.jobs):
+                sys.stdout.write(json.dumps(report) + "\n")
+                if not report["ok"]:
+                    failed += 1
+        except Exception as e:
+            util.log_exception(e)
+            sys.exit(1)
+
+        if failed > 0:
+            logging.error(
+                "{} of {} PSFs failed verification".format(failed, len(paths))
+            )
+            sys.exit(1)
+
+        sys.exit(0)
+
+    action = None
+    for name in batch_actions:
+        if getattr(args, name) not in [False, None]:
+            action = name
+
+    if action is not None and (
+        len(args.input) > 1 or not pathlib.Path(args.input[0]).is_file()
+    ):
+        try:
+            paths = []
+            for pattern in args.input:
+                paths += expand_inputs(pattern)
+
+            options = {
+                "revid": args.revid,
+                "diff": args.diff,
+                "destination": args.destination,
+            }
+            failed = run_batch(paths, action, options, args.jobs)
+        except Exception as e:
+            util.log_exception(e)
+            sys.exit(1)
+
+        if failed > 0:
+            logging.error(
+                "{} failed for {} of {} PSFs".format(action, failed, len(paths))
+            )
+            sys.exit(1)
+
+        sys.exit(0)
+
+    if len(args.input) > 1:
+        logging.error("Only one input file may be specified with this action.")
+        sys.exit(1)
+
+    args.input = args.input[0]
+
     psf = PSF()
     try:
         psf.load_from_archive(args.input)
@@ -448,6 +574,9 @@ def psf_cli(argv=None):
         logging.error("failed to load PSF")
         sys.exit(1)
 
+    if args.sidecars:
+        psf.sidecars = True
+
     if args.summarize:
         sys.stdout.write(psf.generate_tree())
 
@@ -516,25 +645,7 @@ def psf_cli(argv=None):
 
         courses = {}
         if args.coursepath is not None:
-            for p in args.coursepath.split(":"):
-                p = pathlib.Path(p)
-                if p.is_file():
-                    try:
-                        c = course.load_course_definition(p)
-                        courses[c.name] = c
-                    except Exception as e:
-                        util.log_exception(e)
-                        logging.warning("failed to load course from '{}'".format(p))
-                else:
-                    for fp in p.glob("**/*.toml"):
-                        try:
-                            c = course.load_course_definition(fp)
-                            courses[c.name] = c
-                        except Exception as e:
-                            util.log_exception(e)
-                            logging.warning(
-                                "failed to load course from '{}'".format(fp)
-                            )
+            courses = course.load_courses(args.coursepath.split(":"))
 
         psf.interact(rev.ID, courses=courses)
         logging.info("updating '{}' in place".format(args.input))
@@ -563,6 +674,94 @@ def psf_cli(argv=None):
         psf.save_to_archive(args.input)
 
 
+def read_format_revision(f):
+    """read_format_revision
+
+    Return the format revision of the PSF in an open ZipFile, raising
+    PSFInvalid if it is newer than this version of Pretor supports.
+
+    :param f: the ZipFile object
+    """
+
+    # try to load version information
+    psf_format_revision = 0
+    try:
+        f.getinfo("psf_format_revision")
+        psf_format_revision = int(f.read("psf_format_revision").decode("utf-8"))
+    except KeyError:
+        logging.warning(
+            "psf_format_revision unspecified, using {}".format(psf_format_revision)
+        )
+
+    # refuse to work with newer revisions
+    if psf_format_revision > constants.psf_format_revision:
+        logging.error(
+            "psf_format_revision '{}' invalid or unknown, ".format(psf_format_revision)
+            + "this PSF may have been generated by a newer "
+            + "version of pretor."
+        )
+        raise PSFInvalid("invalid psf_format_revision")
+
+    return psf_format_revision
+
+
+def read_member(f, name, psf_format_revision=constants.psf_format_revision):
+    """read_member
+
+    Read and decode a metadata member of a PSF, using the codec for its file
+    extension from member_codecs. Since format revision 2, a JSON sidecar
+    with the same name but a .json extension is read instead, if present.
+
+    Raises KeyError if the member does not exist.
+
+    :param f: the ZipFile object
+    :param name: name of the member, e.g. "pretor_data.toml"
+    :param psf_format_revision: format revision of the PSF
+    """
+
+    if psf_format_revision >= 2:
+        sidecar = str(pathlib.PurePosixPath(name).with_suffix(".json"))
+        if sidecar in f.NameToInfo:
+            name = sidecar
+
+    loads = member_codecs[pathlib.PurePosixPath(name).suffix][0]
+    return loads(f.read(name))
+
+
+def write_member(f, name, data, sidecar=False):
+    """write_member
+
+    Encode and write a metadata member of a PSF, using the codec for its file
+    extension from member_codecs.
+
+    :param f: the ZipFile object
+    :param name: name of the member, e.g. "pretor_data.toml"
+    :param data: dict to encode
+    :param sidecar: if True, also write a JSON sidecar for the member, see
+    read_member(). The sidecar is skipped if data cannot be represented in
+    JSON (for example, if it contains TOML dates), as readers fall back to
+    the member itself.
+    """
+
+    dumps = member_codecs[pathlib.PurePosixPath(name).suffix][1]
+    f.writestr(name, dumps(data), compress_type=constants.compress_type)
+
+    if not sidecar:
+        return
+
+    try:
+        encoded = member_codecs[".json"][1](data)
+    except (TypeError, ValueError) as e:
+        logging.debug("not writing JSON sidecar for {}: {}".format(name, e))
+        return
+
+    f.writestr(
+        str(pathlib.PurePosixPath(name).with_suffix(".json")),
+        encoded,
+        compress_type=constants.compress_type,
+    )
+
+
 def load_pretor_toml(source):
     """load_pretor_toml
 
@@ -609,7 +808,258 @@ def load_pretor_toml(source):
     return metadata, exclude, valid
 
 
-def load_collection(pathlist, glob="**/*.psf"):
+def expand_inputs(pattern, glob="**/*.psf"):
+    """expand_inputs
+
+    Expand an input specification into a sorted list of PSF paths. The
+    pattern may be the path to a single PSF, a directory to be searched
+    using the glob pattern, or a glob pattern itself.
+
+    :param pattern:
+    :param glob: override glob pattern used for directories
+    """
+
+    path = pathlib.Path(pattern)
+    if path.is_dir():
+        paths = [p for p in path.glob(glob) if p.is_file()]
+
+    elif path.exists():
+        paths = [path]
+
+    else:
+        paths = [
+            pathlib.Path(p)
+            for p in globlib.glob(str(pattern), recursive=True)
+            if os.path.isfile(p)
+        ]
+
+    if len(paths) == 0:
+        raise exceptions.MissingFile("no PSFs match '{}'".format(pattern))
+
+    return sorted(paths)
+
+
+def run_action(job):
+    """run_action
+
+    Load a PSF and apply one of the read-only actions in batch_actions to it.
+    This is used as the worker function for run_batch(), and so never raises;
+    failures are reported in the return value.
+
+    Returns a tuple (path, output, error). The output is None if the PSF
+    could not be loaded or the action failed, in which case error is a
+    description of the failure. Both are None if the action is "scorecard",
+    revid is "submission", and the PSF has not been graded.
+
+    :param job: tuple (path, action, options, name), where action is a key of
+    batch_actions, options is a table containing the revid, diff and
+    destination arguments of pretor-psf, and name is the name given to the
+    PSF by output_names(), or None if the action does not write files
+    """
+
+    path, action, options, name = job
+
+    try:
+        psf_obj = PSF()
+        psf_obj.load_from_archive(
+            path,
+            header_only=batch_actions[action] == "header",
+            lazy=batch_actions[action] == "lazy",
+        )
+        return path, render_action(psf_obj, path, action, options, name), None
+
+    except Exception as e:
+        return path, None, describe_exception(e)
+
+
+def describe_exception(e):
+    """describe_exception
+
+    Return a one-line description of an exception for reports.
+
+    :param e:
+    """
+
+    # these already describe themselves
+    if isinstance(e, (PSFInvalid, PSFRevisionError, PSFRevisionNoSuchFile)):
+        return str(e)
+
+    return "{}: {}".format(type(e).__name__, e)
+
+
+def render_action(psf_obj, path, action, options, name=None):
+    """render_action
+
+    Apply one of the read-only actions in batch_actions to a loaded PSF, and
+    return its output as a string, formatted as pretor-psf would print it for
+    a single PSF. --extract writes files instead, into the directory
+    destination/<name>, and has no output.
+
+    Returns None if the action is "scorecard", revid is "submission", and the
+    PSF has not been graded.
+
+    :param psf_obj: the PSF object
+    :param path: the path psf_obj was loaded from
+    :param action: see run_action()
+    :param options: see run_action()
+    :param name: see run_action(), defaults to the name of the PSF without
+    its extension
+    """
+
+    revID = options["revid"]
+
+    if action == "summarize":
+        return psf_obj.generate_tree()
+
+    elif action == "metadata":
+        return psf_obj.format_metadata() + "\n"
+
+    elif action == "manifest":
+        return "".join(p + "\n" for p in psf_obj.get_revision(revID).contents)
+
+    elif action == "forensic":
+        return psf_obj.format_forensic() + "\n"
+
+    elif action == "lsrev":
+        return "".join(r + "\n" for r in psf_obj.revisions)
+
+    elif action == "diff":
+        return psf_obj.diff(options["diff"][0], options["diff"][1]) + "\n"
+
+    elif action == "extract":
+        destination = pathlib.Path(options["destination"] or ".")
+        if name is None:
+            name = output_names([path])[path]
+        (destination / name).parent.mkdir(parents=True, exist_ok=True)
+        psf_obj.get_revision(revID).write_files(destination / name)
+        return ""
+
+    elif action == "scorecard":
+        if revID == "submission":
+            rev = psf_obj.get_grade_rev()
+            if rev is None:
+                return None
+
+        else:
+            rev = psf_obj.get_revision(revID)
+            if rev.grade is None:
+                raise PSFRevisionError("revision {} has no grade".format(revID))
+
+        return rev.grade.generate_scorecard()
+
+    raise ValueError("unknown action '{}'".format(action))
+
+
+def output_names(paths):
+    """output_names
+
+    Return a table mapping each of paths to a name to write its output under,
+    which is its path relative to the deepest directory containing all of
+    paths, without the .psf extension. This is just the name of the PSF when
+    all of paths are in the same directory, and stays unique when PSFs in
+    different directories share a name.
+
+    Raises ValueError if two paths would still be given the same name.
+
+    :param paths: list of paths to PSF archives
+    """
+
+    if len(paths) == 0:
+        return {}
+
+    absolute = {path: pathlib.Path(os.path.abspath(str(path))) for path in paths}
+    root = os.path.commonpath([str(p.parent) for p in absolute.values()])
+
+    names = {}
+    owners = {}
+    for path, p in absolute.items():
+        name = p.relative_to(root)
+        if name.suffix == ".psf":
+            name = name.with_suffix("")
+
+        if owners.get(name, p) != p:
+            raise ValueError(
+                "'{}' and '{}' would both be written as '{}'".format(
+                    owners[name], p, name
+                )
+            )
+
+        owners[name] = p
+        names[path] = name
+
+    return names
+
+
+def run_batch(paths, action, options, workers=None):
+    """run_batch
+
+    Apply one of the read-only actions in batch_actions to many PSFs in
+    parallel. Output is written to standard output in the order of paths,
+    each preceded by a line naming its PSF. --scorecard with a destination
+    instead writes each scorecard to destination/<name>.txt, and --extract
+    writes the files of each PSF to destination/<name>, where <name> is given
+    by output_names().
+
+    Ungraded PSFs are skipped by --scorecard. Returns the number of PSFs for
+    which the action failed for any other reason.
+
+    :param paths: list of paths to PSF archives
+    :param action: see run_action()
+    :param options: see run_action()
+    :param workers: see util.parallel_map()
+    """
+
+    destination = None
+    if options["destination"] is not None and action in ["scorecard", "extract"]:
+        destination = pathlib.Path(options["destination"])
+        destination.mkdir(parents=True, exist_ok=True)
+
+    names = {}
+    if action == "extract" or (action == "scorecard" and destination is not None):
+        names = output_names(paths)
+
+    failed = 0
+    jobs = ((path, action, options, names.get(path)) for path in paths)
+    for path, output, error in util.parallel_map(run_action, jobs, workers):
+        if error is not None:
+            logging.error("{}: {}".format(path, error))
+            failed += 1
+
+        elif output is None:
+            logging.warning("{} has not been graded, skipping it".format(path))
+
+        elif action == "scorecard" and destination is not None:
+            output_path = destination / (str(names[path]) + ".txt")
+            logging.debug("writing scorecard for {} to {}".format(path, output_path))
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(str(output_path), "w") as f:
+                f.write(output)
+
+        elif output != "":
+            sys.stdout.write("==> {} <==\n".format(path))
+            sys.stdout.write(output)
+            sys.stdout.write("\n")
+
+    return failed
+
+
+def write_scorecards(paths, revID="submission", destination=None, workers=None):
+    """write_scorecards
+
+    Render scorecards for many PSFs in parallel, see run_batch().
+
+    :param paths: list of paths to PSF archives
+    :param revID: revision to render the grade of, or "submission" for the
+    canonical grade revision
+    :param destination: output directory, or None
+    :param workers: see util.parallel_map()
+    """
+
+    options = {"revid": revID, "diff": None, "destination": destination}
+    return run_batch(paths, "scorecard", options, workers)
+
+
+def load_collection(pathlist, glob="**/*.psf", lazy=False):
     """load_collection
 
     Load many PSFs from a list of paths. Each element in the list may be either
@@ -620,7 +1070,8 @@ def load_collection(pathlist, glob="**/*.psf"):
     path from which it was loaded.
 
     :param pathlist: list of paths to load
-   :param glob: override glob pattern
+    :param glob: override glob pattern
+    :param lazy: see PSF.load_from_archive()
     """
 
     psfs = []
@@ -633,19 +1084,318 @@ def load_collection(pathlist, glob="**/*.psf"):
         elif path.is_dir():
             for child in path.glob(glob):
                 psf_obj = PSF()
-                psf_obj.load_from_archive(child)
-                psf_obj.loaded_from = path
+                psf_obj.load_from_archive(child, lazy=lazy)
+                psf_obj.loaded_from = child
                 psfs.append(psf_obj)
 
         else:
             psf_obj = PSF()
-            psf_obj.load_from_archive(path)
+            psf_obj.load_from_archive(path, lazy=lazy)
             psf_obj.loaded_from = path
             psfs.append(psf_obj)
 
     return psfs
 
 
+def load_summary(archive_path):
+    """load_summary
+
+    Return the summary of the PSF archive at the given path, as generated by
+    PSF.summarize(). If the archive's pretor_data.toml contains a summary
+    block, only that member is read, otherwise the header of the archive is
+    loaded.
+
+    :param archive_path:
+    """
+
+    with zipfile.ZipFile(str(archive_path), "r") as f:
+        psf_format_revision = read_format_revision(f)
+        try:
+            pretor_data = read_member(f, "pretor_data.toml", psf_format_revision)
+            return summary_from_block(pretor_data, archive_path)
+        except Exception as e:
+            logging.debug(
+                "no usable summary block in {}: {}".format(archive_path, repr(e))
+            )
+
+        psf_obj = PSF()
+        psf_obj.load_from_zipfile(f, archive_path, header_only=True)
+        return psf_obj.summarize()
+
+
+def validate_summary(archive_path):
+    """validate_summary
+
+    Check the summary block in the pretor_data.toml of the PSF archive at the
+    given path against a summary generated from the header of the archive.
+
+    Returns None if the archive has no summary block, otherwise a list of the
+    keys of the summary (with grade fields given as "grade.<field>") which
+    disagree, which is empty if the summary block is valid.
+
+    :param archive_path:
+    """
+
+    with zipfile.ZipFile(str(archive_path), "r") as f:
+        psf_format_revision = read_format_revision(f)
+        pretor_data = read_member(f, "pretor_data.toml", psf_format_revision)
+        if "summary" not in pretor_data:
+            return None
+
+        psf_obj = PSF()
+        psf_obj.load_from_zipfile(f, archive_path, header_only=True)
+
+    return compare_summary(pretor_data, psf_obj.summarize(), archive_path)
+
+
+def compare_summary(pretor_data, expected, archive_path=None):
+    """compare_summary
+
+    Compare the summary block in pretor_data.toml against a summary
+    generated by PSF.summarize(), see validate_summary().
+
+    :param pretor_data: the contents of pretor_data.toml
+    :param expected: the summary generated by PSF.summarize()
+    :param archive_path: the path the PSF was loaded from, if any
+    """
+
+    try:
+        actual = summary_from_block(pretor_data, archive_path)
+    except Exception as e:
+        logging.debug("invalid summary block in {}: {}".format(archive_path, repr(e)))
+        return ["summary"]
+
+    mismatched = []
+    for key in expected:
+        if key == "grade" and None not in [expected[key], actual[key]]:
+            for field in expected[key]:
+                if expected[key][field] != actual[key].get(field):
+                    mismatched.append("grade.{}".format(field))
+
+        elif expected[key] != actual[key]:
+            mismatched.append(key)
+
+    return mismatched
+
+
+def verify_archive(archive_path):
+    """verify_archive
+
+    Check the integrity of the PSF archive at the given path. This is used as
+    the worker function for pretor-psf --verify, and so never raises. The
+    following are checked:
+
+    * that every member of the archive can be decompressed, and matches its
+      CRC
+
+    * that the archive can be loaded, including its grades and course
+      definitions, and every file listed by each revision is present
+
+    * that each rev_data.toml has the ID of its revision, and that parent
+      revisions exist
+
+    * that each course definition matches the SHA-256 hash it is named by
+
+    * that JSON sidecars, if any, match the member they accompany
+
+    * that the summary in pretor_data.toml, if any, is valid
+
+    Members which are not referred to by any revision are reported as
+    warnings.
+
+    Returns a table containing the path, "ok" (True if there were no
+    errors), and lists of "errors" and "warnings".
+
+    :param archive_path:
+    """
+
+    report = {"path": str(archive_path), "ok": True, "errors": [], "warnings": []}
+    errors = report["errors"]
+    warnings = report["warnings"]
+
+    try:
+        with zipfile.ZipFile(str(archive_path), "r") as f:
+            # like ZipFile.testzip(), but reporting every bad member, and
+            # corrupt compressed data as well as bad CRCs
+            for info in f.infolist():
+                try:
+                    with f.open(info) as member:
+                        while member.read(1 << 20):
+                            pass
+                except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+                    errors.append(
+                        "member {}: {}".format(info.filename, describe_exception(e))
+                    )
+
+            psf_format_revision = read_format_revision(f)
+            psf_obj = PSF()
+            psf_obj.load_from_zipfile(f, archive_path, header_only=True)
+
+            # members which are expected in the archive, anything else is
+            # reported as unreferenced
+            expected = set(
+                ["pretor_data.toml", "pretor_version", "psf_format_revision"]
+            )
+
+            for revID, rev in psf_obj.revisions.items():
+                rev_member = "revisions/{}/rev_data.toml".format(revID)
+                rev_data = read_member(f, rev_member, psf_format_revision)
+                expected.add(rev_member)
+
+                if rev_data["ID"] != revID:
+                    errors.append(
+                        "{} has ID {}".format(rev_member, repr(rev_data["ID"]))
+                    )
+
+                if rev.parentID is not None and rev.parentID not in psf_obj.revisions:
+                    errors.append(
+                        "revision {} has nonexistent parent {}".format(
+                            revID, rev.parentID
+                        )
+                    )
+
+                for path in rev_data["contents"]:
+                    expected.add("revisions/{}/contents/{}".format(revID, path))
+
+                if rev.grade is not None:
+                    expected.add("revisions/{}/grade.toml".format(revID))
+                    if psf_format_revision >= 1 and "course" in rev_data:
+                        expected.add("courses/{}.toml".format(rev_data["course"]))
+                    else:
+                        expected.add("revisions/{}/course.toml".format(revID))
+
+            for name in f.namelist():
+                member = pathlib.PurePosixPath(name)
+
+                if name.startswith("courses/") and member.suffix == ".toml":
+                    digest = hashlib.sha256(f.read(name)).hexdigest()
+                    if digest != member.stem:
+                        errors.append("{} has SHA-256 hash {}".format(name, digest))
+
+                toml_name = str(member.with_suffix(".toml"))
+                if member.suffix == ".json" and toml_name in expected:
+                    sidecar = member_codecs[".json"][0](f.read(name))
+                    if sidecar != member_codecs[".toml"][0](f.read(toml_name)):
+                        errors.append("{} does not match {}".format(name, toml_name))
+                    continue
+
+                if name not in expected and not name.endswith("/"):
+                    warnings.append("unreferenced member {}".format(name))
+
+            pretor_data = read_member(f, "pretor_data.toml", psf_format_revision)
+            if "summary" in pretor_data:
+                mismatched = compare_summary(
+                    pretor_data, psf_obj.summarize(), archive_path
+                )
+                if len(mismatched) > 0:
+                    errors.append(
+                        "summary disagrees on {}".format(", ".join(mismatched))
+                    )
+            else:
+                warnings.append("no summary in pretor_data.toml")
+
+    except Exception as e:
+        errors.append(describe_exception(e))
+
+    report["ok"] = len(errors) == 0
+    return report
+
+
+def summary_to_block(summary):
+    """summary_to_block
+
+    Convert a summary generated by PSF.summarize() into the summary block
+    stored in pretor_data.toml. Keys which are stored elsewhere in
+    pretor_data.toml are dropped, and since TOML has no null value, so are
+    any keys whose value is None.
+
+    :param summary:
+    """
+
+    block = {"revisions": {}}
+    for revID, parentID in summary["revisions"].items():
+        block["revisions"][revID] = dict(summary["files"][revID])
+        if parentID is not None:
+            block["revisions"][revID]["parentID"] = parentID
+
+    if summary["grade"] is not None:
+        block["grade_rev"] = summary["grade_rev"]
+        block["grade"] = {k: v for k, v in summary["grade"].items() if v is not None}
+
+    return block
+
+
+def summary_from_block(pretor_data, archive_path=None):
+    """summary_from_block
+
+    Reconstruct the summary of a PSF, as generated by PSF.summarize(), from
+    the summary block in its pretor_data.toml. Raises KeyError if there is
+    no summary block, and PSFInvalid if it does not describe the revisions
+    listed in pretor_data.toml.
+
+    :param pretor_data: the contents of pretor_data.toml
+    :param archive_path: the path the PSF was loaded from, if any
+    """
+
+    block = pretor_data["summary"]
+    if list(block["revisions"].keys()) != list(pretor_data["revisions"]):
+        raise PSFInvalid("summary block does not match revision list")
+
+    metadata = dict(pretor_data.get("metadata", {}))
+    path = None
+    if archive_path is not None:
+        path = str(archive_path)
+        metadata["archive_name"] = path
+
+    summary = {
+        "path": path,
+        "ID": pretor_data["ID"],
+        "metadata": metadata,
+        "revisions": {},
+        "files": {},
+        "grade_rev": None,
+        "grade": None,
+    }
+
+    for revID, rev in block["revisions"].items():
+        summary["revisions"][revID] = rev.get("parentID")
+        summary["files"][revID] = {"count": rev["count"], "size": rev["size"]}
+
+    if "grade" in block:
+        summary["grade_rev"] = block["grade_rev"]
+        summary["grade"] = dict(block["grade"])
+        summary["grade"].setdefault("override", None)
+
+    return summary
+
+
+def close_sources(sources):
+    """close_sources
+
+    Close every archive opened by PSF.get_source_info().
+
+    :param sources: see PSF.save_revision_to_archive()
+    """
+
+    for source in sources.values():
+        if source is not None:
+            source.close()
+
+
+def load_summaries(paths, workers=None):
+    """load_summaries
+
+    Load the summaries of many PSFs in parallel. Summaries are yielded in
+    the same order as paths, and only a bounded number are held in memory at
+    once.
+
+    :param paths: iterable of paths to PSF archives
+    :param workers: number of worker processes (default: one per CPU)
+    """
+
+    return util.parallel_map(load_summary, paths, workers)
+
+
 class PSF:
     """PSF
 
@@ -671,6 +1421,7 @@ class PSF:
         this.ID = None
         this.metadata = {}
         this.forensic = {}
+        this.sidecars = False
 
     def __str__(this):
         if this.ID is None:
@@ -764,226 +1515,275 @@ class PSF:
             with open(str(child), "rb") as f:
                 rev.put_file(child.relative_to(path), f.read())
 
-    def load_from_archive(this, archive_path: pathlib.Path):
+    def load_from_archive(
+        this, archive_path: pathlib.Path, header_only=False, lazy=False
+    ):
+        """load_from_archive
+
+        Populate this PSF object from a PSF archive on disk.
+
+        :param this:
+        :param archive_path:
+        :type archive_path: pathlib.Path
+        :param header_only: if True, only metadata, revision and grade data are
+        loaded, and the contents of each revision are left empty.
+        :param lazy: if True, the contents of each revision are not read until
+        they are needed. Contents which are never read are copied into the
+        archive without being decompressed when the PSF is saved.
+        """
+
         logging.debug("loading PSF archive {}".format(archive_path))
 
         archive_path = pathlib.Path(archive_path)
 
         with zipfile.ZipFile(str(archive_path), "r") as f:
+            this.load_from_zipfile(f, archive_path, header_only, lazy)
 
-            # try to load version information
-            psf_format_revision = 0
-            try:
-                f.getinfo("psf_format_revision")
-                psf_format_revision = int(f.read("psf_format_revision").decode("utf-8"))
-            except KeyError:
-                logging.warning(
-                    "psf_format_revision unspecified, using {}".format(
-                        psf_format_revision
-                    )
+    def load_from_zipfile(this, f, archive_path, header_only=False, lazy=False):
+        """load_from_zipfile
+
+        Populate this PSF object from an already open ZipFile. This is used by
+        load_from_archive(), and by callers which keep archive handles open
+        between loads.
+
+        :param this:
+        :param f: the ZipFile object
+        :param archive_path: the path f was opened from
+        :param header_only: see load_from_archive()
+        :param lazy: see load_from_archive()
+        """
+
+        archive_path = pathlib.Path(archive_path)
+
+        psf_format_revision = read_format_revision(f)
+
+        # load forensic data from PSF
+        try:
+            this.forensic = util.toml_loads(zlib.decompress(f.comment))
+        except Exception as e:
+            util.log_exception(e)
+            logging.warning(
+                "archive {} has missing or invalid forensic data".format(archive_path)
+            )
+
+            logging.debug("forensic data: {}".format(f.comment))
+
+        # metadata members may have JSON sidecars since format revision 2,
+        # keep writing them if so
+        this.sidecars = psf_format_revision >= 2
+
+        # load the pretor data file for the PSF
+        try:
+            f.getinfo("pretor_data.toml")
+        except KeyError:
+            raise PSFInvalid(
+                "Invalid archive {}, no pretor_data.toml".format(archive_path)
+            )
+
+        pretor_data = None
+        try:
+            pretor_data = read_member(f, "pretor_data.toml", psf_format_revision)
+        except Exception as e:
+            util.log_exception(e)
+            raise PSFInvalid(
+                "Invalid archive {}, could not load pretor_data.toml".format(
+                    archive_path
                 )
+            )
 
-            # refuse to work with old revisions
-            if psf_format_revision > constants.psf_format_revision:
-                logging.error(
-                    "psf_format_revision '{}' invalid or unknown, "
-                    + "this PSF may have been generated by a newer "
-                    + "version of pretor."
+        # ensure pretor_data contains all required keys
+        for key in ["pretor_version", "ID", "revisions"]:
+            if key not in pretor_data:
+                raise PSFInvalid(
+                    "Invalid archive {}, pretor_data.toml missing key {}".format(
+                        archive_path, key
+                    )
                 )
-                raise PSFInvalid("invalid psf_format_revision")
 
-            # load forensic data from PSF
-            try:
-                this.forensic = toml.loads(zlib.decompress(f.comment).decode("utf-8"))
-            except Exception as e:
-                util.log_exception(e)
-                logging.warning(
-                    "archive {} has missing or invalid forensic data".format(
-                        archive_path
+        logging.debug("pretor_data.toml is valid")
+
+        this.ID = pretor_data["ID"]
+
+        if "metadata" in pretor_data:
+            this.metadata = pretor_data["metadata"]
+
+        # XXX: maybe this loop body should be it's own function?
+        for revID in pretor_data["revisions"]:
+            logging.debug("processing revision {}".format(revID))
+
+            if ".." in revID or "~" in revID:
+                raise PSFInvalid(
+                    "Archive {} contains maliciously constructed revID {}".format(
+                        archive_path, revID
                     )
                 )
 
-                logging.debug(zlib.decompress(f.comment).decode("utf-8"))
+            rev_data = None
 
-            # load the pretor data file for the PSF
+            # load the revision data from the archive
             try:
-                f.getinfo("pretor_data.toml")
+                rev_data = read_member(
+                    f, "revisions/{}/rev_data.toml".format(revID), psf_format_revision
+                )
+                logging.debug("loaded revision data successfully")
             except KeyError:
                 raise PSFInvalid(
-                    "Invalid archive {}, no pretor_data.toml".format(archive_path)
+                    "Invalid archive {}, pretor_data.toml specifies nonexistant revID {}".format(
+                        archive_path, revID
+                    )
                 )
-
-            pretor_data = None
-            try:
-                pretor_data = toml.loads(f.read("pretor_data.toml").decode("utf-8"))
             except Exception as e:
                 util.log_exception(e)
                 raise PSFInvalid(
-                    "Invalid archive {}, could not load pretor_data.toml".format(
-                        archive_path
+                    "Invalid archive {}, could not load rev_data.toml for revID {}".format(
+                        archive_path, revID
                     )
                 )
 
-            # ensure pretor_data contains all required keys
-            for key in ["pretor_version", "ID", "revisions"]:
-                if key not in pretor_data:
-                    raise PSFInvalid(
-                        "Invalid archive {}, pretor_data.toml missing key {}".format(
-                            archive_path, key
-                        )
-                    )
-
-            logging.debug("pretor_data.toml is valid")
-
-            this.ID = pretor_data["ID"]
-
-            if "metadata" in pretor_data:
-                this.metadata = pretor_data["metadata"]
-
-            # XXX: maybe this loop body should be it's own function?
-            for revID in pretor_data["revisions"]:
-                logging.debug("processing revision {}".format(revID))
-
-                if ".." in revID or "~" in revID:
-                    raise PSFInvalid(
-                        "Archive {} contains maliciously constructed revID {}".format(
-                            archive_path, revID
-                        )
+            # load grade data from archive
+            grade_data = None
+            course_data = None
+            try:
+                grade_data = read_member(
+                    f, "revisions/{}/grade.toml".format(revID), psf_format_revision
+                )
+                logging.debug("loaded grade data successfully")
+            except KeyError as e:
+                # no grade specified
+                logging.debug("no grade.toml: {}".format(e))
+                pass
+            except Exception as e:
+                util.log_exception(e)
+                raise PSFInvalid(
+                    "Invalid archive {}, invalid grade.toml for revID {}".format(
+                        archive_path, revID
                     )
+                )
 
-                rev_data = None
+            # identical course definitions are shared between revisions and
+            # PSFs by the course cache. Since format revision 1, courses are
+            # stored once per PSF and referenced by digest, so they only
+            # need to be read if they are not already cached.
+            course_obj = None
+            try:
+                if psf_format_revision >= 1 and "course" in rev_data:
+                    course_obj = course.course_cache.get(rev_data["course"])
+                    course_member = "courses/{}.toml".format(rev_data["course"])
+                else:
+                    course_member = "revisions/{}/course.toml".format(revID)
 
-                # load the revision data from the archive
-                try:
-                    rev_data = f.getinfo("revisions/{}/rev_data.toml".format(revID))
-                    rev_data = f.read(rev_data)
-                    rev_data = toml.loads(rev_data.decode("utf-8"))
-                    logging.debug("loaded revision data successfully")
-                except KeyError:
-                    raise PSFInvalid(
-                        "Invalid archive {}, pretor_data.toml specifies nonexistant revID {}".format(
-                            archive_path, revID
-                        )
-                    )
-                except Exception as e:
-                    util.log_exception(e)
+                if course_obj is None:
+                    course_data = f.getinfo(course_member)
+                    course_data = f.read(course_data)
+                    course_obj = course.load_embedded_course(course_data)
+                logging.debug("loaded course data successfully")
+            except KeyError:
+                # no grade specified
+                logging.debug("no course data specified")
+                if grade_data is not None:
                     raise PSFInvalid(
-                        "Invalid archive {}, could not load rev_data.toml for revID {}".format(
+                        "Invalid archive {}, grade specified without course for revID {}".format(
                             archive_path, revID
                         )
                     )
-
-                # load grade data from archive
-                grade_data = None
-                course_data = None
-                try:
-                    grade_data = f.getinfo("revisions/{}/grade.toml".format(revID))
-                    grade_data = f.read(grade_data)
-                    grade_data = toml.loads(grade_data.decode("utf-8"))
-                    logging.debug("loaded grade data successfully")
-                except KeyError as e:
-                    # no grade specified
-                    logging.debug("no grade.toml: {}".format(e))
-                    pass
-                except Exception as e:
-                    util.log_exception(e)
-                    raise PSFInvalid(
-                        "Invalid archive {}, invalid grade.toml for revID {}".format(
-                            archive_path, revID
-                        )
+            except Exception as e:
+                util.log_exception(e)
+                raise PSFInvalid(
+                    "Invalid archive {}, invalid course data for revID {}".format(
+                        archive_path, revID
                     )
+                )
 
-                try:
-                    course_data = f.getinfo("revisions/{}/course.toml".format(revID))
-                    course_data = f.read(course_data)
-                    course_data = toml.loads(course_data.decode("utf-8"))
-                    logging.debug("loaded course data successfully")
-                except KeyError:
-                    # no grade specified
-                    logging.debug("no course data specified")
-                    if grade_data is not None:
-                        raise PSFInvalid(
-                            "Invalid archive {}, grade specified without course for revID {}".format(
-                                archive_path, revID
-                            )
-                        )
-                except Exception as e:
-                    util.log_exception(e)
-                    raise PSFInvalid(
-                        "Invalid archive {}, invalid course.toml for revID {}".format(
-                            archive_path, revID
-                        )
+            # validate that we will be able to correctly de-serialize the
+            # course and grade data
+            try:
+                if grade_data is not None:
+                    assert course_obj is not None
+                    assert "assignment_name" in grade_data
+                    assert grade_data["assignment_name"] in course_obj.assignments
+            except Exception as e:
+                raise PSFInvalid(
+                    "Invalid archive {}, mangled course/grade data for revID {}".format(
+                        archive_path, revID
                     )
+                )
 
-                course_obj = None
-                if course_data is not None:
-                    course_obj = course.load_course_definition(course_data)
+            grade_obj = None
+            if grade_data is not None:
+                grade_obj = grade.Grade(
+                    course_obj.assignments[grade_data["assignment_name"]]
+                )
+                grade_obj.load_data(grade_data)
+                logging.debug("generated grade object: {}".format(grade_obj))
 
-                # validate that we will be able to correctly de-serialize the
-                # course and grade data
-                try:
-                    if grade_data is not None:
-                        assert course_data is not None
-                        assert "assignment_name" in grade_data
-                        assert grade_data["assignment_name"] in course_data
-                except Exception as e:
+            # validate the revision data
+            for key in ["ID", "contents"]:
+                if key not in rev_data:
                     raise PSFInvalid(
-                        "Invalid archive {}, mangled course/grade data for revID {}".format(
-                            archive_path, revID
+                        "Invalid archive {}, rev_data.toml for revID {} missing key {}".format(
+                            archive_path, revID, key
                         )
                     )
 
-                grade_obj = None
-                if grade_data is not None:
-                    grade_obj = grade.Grade(
-                        course_obj.assignments[grade_data["assignment_name"]]
-                    )
-                    grade_obj.load_data(grade_data)
-                    logging.debug("generated grade object: {}".format(grade_obj))
-
-                # validate the revision data
-                for key in ["ID", "contents"]:
-                    if key not in rev_data:
-                        raise PSFInvalid(
-                            "Invalid archive {}, rev_data.toml for revID {} missing key {}".format(
-                                archive_path, revID, key
-                            )
-                        )
+            # initialize revision object and install into revisions
+            rev = Revision(this, revID)
+            if "parentID" in rev_data:
+                rev.parentID = rev_data["parentID"]
+            this.revisions[revID] = rev
 
-                # initialize revision object and install into revisions
-                rev = Revision(this, revID)
-                if "parentID" in rev_data:
-                    rev.parentID = rev_data["parentID"]
-                this.revisions[revID] = rev
+            logging.debug("generated revision object: {}".format(rev))
 
-                logging.debug("generated revision object: {}".format(rev))
+            rev.grade = grade_obj
 
-                rev.grade = grade_obj
+            if header_only:
+                rev.file_stats = (len(rev_data["contents"]), 0)
 
-                # load revision files from archive
-                for path in rev_data["contents"]:
-                    if ".." in path or "~" in path:
-                        raise PSFInvalid(
-                            "Archive {} contains maliciously constructed path {}".format(
-                                archive_path, path
-                            )
+            # load revision files from archive
+            for path in rev_data["contents"]:
+                if ".." in path or "~" in path:
+                    raise PSFInvalid(
+                        "Archive {} contains maliciously constructed path {}".format(
+                            archive_path, path
                         )
+                    )
 
-                    logging.debug("loading file {}".format(path))
-
-                    full_path = "revisions/{}/contents/{}".format(revID, path)
+                full_path = "revisions/{}/contents/{}".format(revID, path)
 
+                if header_only:
+                    # sizes are known from the zip directory without reading
+                    # the file
                     try:
-                        rev.put_file(path, f.read(full_path))
-                    except Exception as e:
-                        util.log_exception(e)
+                        size = f.getinfo(full_path).file_size
+                    except KeyError:
                         raise PSFInvalid(
-                            "Invalid archive {}, could not load {} from revision {}".format(
+                            "Invalid archive {}, {} is missing from revision {}".format(
                                 archive_path, path, revID
                             )
                         )
+                    rev.file_stats = (rev.file_stats[0], rev.file_stats[1] + size)
+                    continue
 
-        this.metadata["archive_name"] = archive_path
+                logging.debug("loading file {}".format(path))
+
+                try:
+                    data = None
+                    if lazy:
+                        f.getinfo(full_path)
+                    else:
+                        data = f.read(full_path)
+
+                    rev.put_file(
+                        path, FileData(rev, "", "", data, (archive_path, full_path))
+                    )
+                except Exception as e:
+                    util.log_exception(e)
+                    raise PSFInvalid(
+                        "Invalid archive {}, could not load {} from revision {}".format(
+                            archive_path, path, revID
+                        )
+                    )
+
+        this.metadata["archive_name"] = str(archive_path)
 
     def save_to_archive(this, path: pathlib.Path):
         """save_to_archive
@@ -997,20 +1797,56 @@ class PSF:
 
         logging.debug("saving PSF {} to {}".format(this, path))
 
-        path = str(pathlib.Path(path))
-        with zipfile.ZipFile(str(path), "w") as f:
+        # write to a temporary file in the same directory and move it into
+        # place, so that the archive is never left partially written
+        path = pathlib.Path(path)
+        tmp = path.with_name(".{}.{}.tmp".format(path.name, os.getpid()))
+        try:
+            with zipfile.ZipFile(str(tmp), "w") as f:
+                this.save_to_zipfile(f)
+            # keep the permissions of the archive being replaced
+            if path.exists():
+                shutil.copymode(str(path), str(tmp))
+            os.replace(str(tmp), str(path))
+
+        except BaseException:
+            if tmp.exists():
+                tmp.unlink()
+            raise
+
+        # point every file at its member in the new archive, both because the
+        # members lazily loaded files were read from have moved, and so that
+        # unchanged files can be copied as-is the next time this PSF is saved
+        for revID in this.revisions:
+            contents = this.revisions[revID].contents
+            for fpath in contents:
+                contents[fpath].source = (
+                    path,
+                    "revisions/{}/contents/{}".format(revID, fpath),
+                )
+
+    def save_to_zipfile(this, f):
+        """save_to_zipfile
 
-            # write pretor_data.toml
+        Write this PSF object to an already open ZipFile.
+
+        :param this:
+        :param f: the ZipFile object
+        """
+
+        # archives that files are copied from, kept open until every
+        # revision has been written
+        sources = {}
+        try:
+            # write pretor_data.toml, including a summary of the PSF so that
+            # it can be summarized without loading anything else
             pretor_data = {}
             pretor_data["ID"] = this.ID
             pretor_data["pretor_version"] = constants.version
             pretor_data["revisions"] = list(this.revisions.keys())
             pretor_data["metadata"] = this.metadata
-            f.writestr(
-                "pretor_data.toml",
-                toml.dumps(pretor_data),
-                compress_type=constants.compress_type,
-            )
+            pretor_data["summary"] = summary_to_block(this.summarize(sources))
+            write_member(f, "pretor_data.toml", pretor_data, this.sidecars)
 
             # write version information
             f.writestr(
@@ -1018,20 +1854,49 @@ class PSF:
                 str(constants.version),
                 compress_type=constants.compress_type,
             )
+            # PSFs are written with the oldest format revision which can
+            # represent them, so that older versions of Pretor can read them:
+            # revision 1 is only needed to store course definitions, and
+            # revision 2 to store sidecars
+            psf_format_revision = 0
+            if this.sidecars:
+                psf_format_revision = 2
+            elif any(rev.grade is not None for rev in this.revisions.values()):
+                psf_format_revision = 1
             f.writestr(
                 "psf_format_revision",
-                str(constants.psf_format_revision),
+                str(psf_format_revision),
                 compress_type=constants.compress_type,
             )
 
             # write forensic data
             f.comment = zlib.compress(toml.dumps(this.forensic).encode("utf-8"))
 
+            # write each distinct course definition once, revisions refer to
+            # them by digest
+            written = set()
+            for revID in this.revisions:
+                grade_obj = this.revisions[revID].grade
+                if grade_obj is None:
+                    continue
+
+                course_obj = grade_obj.assignment.course
+                if course_obj.digest() not in written:
+                    written.add(course_obj.digest())
+                    f.writestr(
+                        "courses/{}.toml".format(course_obj.digest()),
+                        course_obj.dump_string(),
+                        compress_type=constants.compress_type,
+                    )
+
             # write each revision file
             for revID in this.revisions:
-                this.save_revision_to_archive(f, revID)
+                this.save_revision_to_archive(f, revID, sources)
 
-    def save_revision_to_archive(this, f, revID):
+        finally:
+            close_sources(sources)
+
+    def save_revision_to_archive(this, f, revID, sources=None):
         """save_revision_to_archive
 
         Save a revision to the already open ZipFile
@@ -1039,8 +1904,20 @@ class PSF:
         :param this:
         :param f: the ZipFile object
         :param revID:
+        :param sources: table of archive paths to open ZipFile objects (or
+        None if the archive could not be opened), used to copy files from the
+        archives they were loaded from, and updated with any archives opened.
+        If None, any archives opened are closed before returning.
         """
 
+        if sources is None:
+            sources = {}
+            try:
+                this.save_revision_to_archive(f, revID, sources)
+            finally:
+                close_sources(sources)
+            return
+
         rev = this.revisions[revID]
 
         logging.debug("saving revision {}".format(rev))
@@ -1048,14 +1925,16 @@ class PSF:
         # write rev_data.toml
         rev_data = {}
         rev_data["ID"] = revID
-        rev_data["parentID"] = rev.parentID
+        if rev.parentID is not None:
+            rev_data["parentID"] = rev.parentID
         rev_data["contents"] = list(rev.contents.keys())
-        f.writestr(
-            "revisions/{}/rev_data.toml".format(revID),
-            toml.dumps(rev_data),
-            compress_type=constants.compress_type,
+        if rev.grade is not None:
+            rev_data["course"] = rev.grade.assignment.course.digest()
+        write_member(
+            f, "revisions/{}/rev_data.toml".format(revID), rev_data, this.sidecars
         )
 
+        # the course definition is written by save_to_zipfile()
         if rev.grade is not None:
             f.writestr(
                 "revisions/{}/grade.toml".format(revID),
@@ -1063,22 +1942,98 @@ class PSF:
                 compress_type=constants.compress_type,
             )
 
-            f.writestr(
-                "revisions/{}/course.toml".format(revID),
-                rev.grade.assignment.course.dump_string(),
-                compress_type=constants.compress_type,
-            )
-
         # add each file to the archive
         for path in rev.contents:
-            logging.debug("saving {}".format(rev.contents[path]))
+            fdata = rev.contents[path]
+            logging.debug("saving {}".format(fdata))
 
-            data = rev.contents[path].get_data()
-            f.writestr(
-                "revisions/{}/contents/{}".format(revID, path),
-                data,
-                compress_type=constants.compress_type,
-            )
+            arcname = "revisions/{}/contents/{}".format(revID, path)
+
+            # files which still match the archive member they were loaded
+            # from are copied as-is, rather than being compressed again
+            info = this.get_source_info(fdata, sources)
+            if info is not None and (fdata.data is None or fdata.matches(info)):
+                util.copy_zip_member(sources[fdata.source[0]], info, f, arcname)
+                continue
+
+            if fdata.data is None:
+                raise PSFInvalid(
+                    "cannot save {}, source member {} is missing".format(
+                        fdata, fdata.source
+                    )
+                )
+
+            f.writestr(arcname, fdata.get_data(), compress_type=constants.compress_type)
+
+    def get_source_info(this, fdata, sources):
+        """get_source_info
+
+        Return the ZipInfo of the archive member a FileData was loaded from,
+        or None if it has no source, or the source can no longer be read.
+
+        :param this:
+        :param fdata: FileData object
+        :param sources: see save_revision_to_archive()
+        """
+
+        if fdata.source is None:
+            return None
+
+        source_path, member = fdata.source
+        if source_path not in sources:
+            try:
+                sources[source_path] = zipfile.ZipFile(str(source_path), "r")
+            except (OSError, zipfile.BadZipFile) as e:
+                logging.debug("cannot open source archive: {}".format(e))
+                sources[source_path] = None
+
+        if sources[source_path] is None:
+            return None
+
+        try:
+            return sources[source_path].getinfo(member)
+        except KeyError:
+            return None
+
+    def get_file_stats(this, revID, sources=None):
+        """get_file_stats
+
+        Return a tuple (count, size) of the number of files in a revision and
+        their total size in bytes.
+
+        :param this:
+        :param revID:
+        :param sources: see save_revision_to_archive()
+        """
+
+        rev = this.revisions[revID]
+        if rev.file_stats is not None:
+            return rev.file_stats
+
+        if sources is None:
+            sources = {}
+            try:
+                return this.get_file_stats(revID, sources)
+            finally:
+                close_sources(sources)
+
+        size = 0
+        for path in rev.contents:
+            fdata = rev.contents[path]
+            if fdata.data is not None:
+                size += fdata.get_size()
+                continue
+
+            info = this.get_source_info(fdata, sources)
+            if info is None:
+                raise PSFInvalid(
+                    "cannot summarize {}, source member {} is missing".format(
+                        fdata, fdata.source
+                    )
+                )
+            size += info.file_size
+
+        return len(rev.contents), size
 
     def create_revision(this, revID, baseRevID=None):
         """create_revision
@@ -1186,11 +2141,11 @@ class PSF:
 
         newRev = this.create_revision(newRevID, baseRevID)
 
-        # XXX: this is a deep copy, which means that newRev.grade.assignment is
-        # a duplicate of baseRev.grade.assignment. At time of writing, this is
-        # fine since the Assignment object is only ever read, never written. If
-        # this assumption changes in the future, this will break.
-        newRev.grade = copy.deepcopy(baseRev.grade)
+        # the Assignment is shared with the parent (and possibly other PSFs,
+        # see course.load_embedded_course()), since it is only ever read, but
+        # the category scores are copied so the new grade can be modified
+        newRev.grade = copy.copy(baseRev.grade)
+        newRev.grade.categories = dict(baseRev.grade.categories)
 
         return newRev
 
@@ -1223,6 +2178,82 @@ class PSF:
 
         return this.get_grade_rev() is not None
 
+    def summarize(this, sources=None):
+        """summarize
+
+        Return a summary of this PSF as a dictionary of plain values, suitable
+        for passing between processes. The summary only depends on data which
+        is available after a header-only load. It contains the keys:
+
+        path - the path the PSF was loaded from, if any
+
+        ID - the PSF ID
+
+        metadata - the metadata table
+
+        revisions - table of revision IDs to parent revision IDs
+
+        files - table of revision IDs to tables containing the count and
+        total size in bytes of the files in that revision
+
+        grade_rev - the ID of the canonical grade revision, or None
+
+        grade - None if the PSF is not graded, otherwise a table containing
+        the score (in 0..1), course, assignment, weight, categories, and
+        max_categories of the canonical grade, as well as each of the fields
+        written by Grade.dump_string().
+
+        :param this:
+        :param sources: see save_revision_to_archive()
+        """
+
+        metadata = {k: this.metadata[k] for k in this.metadata}
+        path = None
+        if "archive_name" in metadata:
+            path = str(metadata["archive_name"])
+            metadata["archive_name"] = path
+
+        summary = {
+            "path": path,
+            "ID": this.ID,
+            "metadata": metadata,
+            "revisions": {r: this.revisions[r].parentID for r in this.revisions},
+            "files": {},
+            "grade_rev": None,
+            "grade": None,
+        }
+
+        for revID in this.revisions:
+            count, size = this.get_file_stats(revID, sources)
+            summary["files"][revID] = {"count": count, "size": size}
+
+        grade_rev = this.get_grade_rev()
+        if grade_rev is None:
+            return summary
+
+        grade_obj = grade_rev.grade
+        assignment = grade_obj.assignment
+        summary["grade_rev"] = grade_rev.ID
+        summary["grade"] = {
+            "score": grade_obj.get_score(),
+            "course": assignment.course.name,
+            "assignment": assignment.name,
+            "weight": assignment.weight,
+            "categories": dict(grade_obj.categories),
+            "max_categories": dict(assignment.categories),
+            "feedback": grade_obj.feedback,
+            "override": grade_obj.override,
+            "bonus_multiplier": grade_obj.bonus_multiplier,
+            "bonus_marks": grade_obj.bonus_marks,
+            "bonus_score": grade_obj.bonus_score,
+            "penalty_multiplier": grade_obj.penalty_multiplier,
+            "penalty_marks": grade_obj.penalty_marks,
+            "penalty_score": grade_obj.penalty_score,
+            "curve_score": grade_obj.curve_score,
+        }
+
+        return summary
+
     def interact(this, revID, workdir=None, courses={}):
 
         # TODO: make this configurable, maybe, but how to set --norc
@@ -1397,6 +2428,10 @@ class Revision:
         this.parentID = None
         this.grade = None
 
+        # (count, total size) of the files of this revision as recorded in
+        # the archive, set by header-only loads, which do not load contents
+        this.file_stats = None
+
         if parentRev is None:
             return
 
@@ -1409,9 +2444,13 @@ class Revision:
                 parent = "/".join(path.split("/")[:-1])
                 name = path.split("/")[-1]
 
-            this.contents[path] = FileData(
-                this, parent, name, parentRev.contents[path].get_data()
-            )
+            # lazily loaded files stay lazy in the child
+            fdata = parentRev.contents[path]
+            data = None
+            if fdata.data is not None:
+                data = fdata.get_data()
+
+            this.contents[path] = FileData(this, parent, name, data, fdata.source)
 
     def __str__(this):
         if this.parentID is None:
@@ -1495,23 +2534,39 @@ class FileData:
     This object abstracts a single file in a single revision. Note that the
     contents are always stored as a file-like. If contents are not file-like
     when passed to the constructor, they are stored in a SpooledTemporaryFile.
+
+    Files loaded from an archive record the member they were loaded from as
+    their source. When saving, a file whose contents still match its source
+    member (by size and CRC) is copied without being compressed again. Files
+    may also be lazily loaded, in which case the contents are None, and are
+    read from the source member each time they are requested.
     """
 
-    def __init__(this, revision: Revision, parent: pathlib.PurePath, name: str, data):
+    def __init__(
+        this, revision: Revision, parent: pathlib.PurePath, name: str, data, source=None
+    ):
         """__init__
 
         :param this:
         :param revision: parent revision
         :param parent: parent folder
         :param name: file name
-        :param data: bytes or file-like
+        :param data: bytes or file-like, or None to lazily load from source
+        :param source: (archive path, member name) tuple for the archive
+        member the data was loaded from, if any
         """
 
         this.revision = revision
         this.parent = pathlib.PurePath(parent)
         this.name = str(name)
+        this.source = source
 
-        if isinstance(data, io.IOBase):
+        if data is None:
+            if source is None:
+                raise ValueError("lazily loaded FileData requires a source")
+            this.data = None
+
+        elif isinstance(data, io.IOBase):
             this.data = data
         else:
             if isinstance(data, str):
@@ -1526,12 +2581,44 @@ class FileData:
         return "<FileData '{}' in {}>".format(this.get_path(), str(this.revision))
 
     def get_data(this):
+        if this.data is None:
+            archive_path, member = this.source
+            with zipfile.ZipFile(str(archive_path), "r") as f:
+                return f.read(member)
+
         this.data.seek(0, 0)
         return this.data.read()
 
     def get_path(this):
         return pathlib.Path(this.parent) / this.name
 
+    def get_size(this):
+        """get_size
+
+        Return the size of the contents of this file in bytes. Lazily loaded
+        files have no contents in memory, and so return None.
+
+        :param this:
+        """
+
+        if this.data is None:
+            return None
+
+        return this.data.seek(0, io.SEEK_END)
+
+    def matches(this, info):
+        """matches
+
+        Check if the contents of this file are the same as those of a zip
+        archive member, by comparing their size and CRC.
+
+        :param this:
+        :param info: ZipInfo of the archive member
+        """
+
+        data = this.get_data()
+        return len(data) == info.file_size and zlib.crc32(data) == info.CRC
+
 
 class PSFInvalid(Exception):
     """PSFInvalid
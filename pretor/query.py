@@ -1,12 +1,24 @@
+import collections
+import functools
+import json
 import logging
+import os
+import re
+import signal
+import socket
+import socketserver
 import sqlite3
+import sys
+import threading
 import argparse
 import pathlib
 import tabulate
 import csv
 import tempfile
+import zipfile
 
 from . import constants
+from . import exceptions
 from . import util
 from . import psf
 
@@ -62,14 +74,67 @@ A tool for querying collections of PSFs using SQL.
         help="Print output as comma-separated values",
     )
 
+    parser.add_argument(
+        "--catalog",
+        "-C",
+        default=":memory:",
+        help="Persist the query database to the specified file. When an "
+        + "existing catalog is given, only PSFs which have been added, "
+        + "modified, or removed since it was last built are re-loaded. "
+        + "(default: build the database in memory)",
+    )
+
+    parser.add_argument(
+        "--fts",
+        "-F",
+        default=False,
+        action="store_true",
+        help="Maintain a full-text index of the submission and canonical "
+        + "grade revisions of each PSF in the table "
+        + "psf_text(uuid, path, rev, file, content). For example: "
+        + "SELECT path, file FROM psf_text WHERE content LIKE '%%gets(%%'",
+    )
+
+    parser.add_argument(
+        "--connect",
+        "-s",
+        default=None,
+        help="Send --query to a server started with --serve listening on "
+        + "the specified socket, rather than building the database locally.",
+    )
+
+    parser.add_argument(
+        "--interval",
+        "-n",
+        default=60,
+        type=float,
+        help="When used with --serve, re-scan the library every INTERVAL "
+        + "seconds. (default: 60)",
+    )
+
     action = parser.add_mutually_exclusive_group(required=True)
 
+    action.add_argument(
+        "--serve",
+        "-S",
+        default=None,
+        help="Listen for queries on the specified Unix socket, keeping the "
+        + "catalog and open archives in memory between queries. Queries "
+        + "can be sent with --connect.",
+    )
+
     action.add_argument(
         "--query",
         "-q",
         default=None,
         help="Specify an SQL query to run. Note that all data is "
-        + "stored in a table named 'psf'",
+        + "stored in a table named 'psf', and the marks for each rubric "
+        + "category of the canonical grade in the table 'category'. The "
+        + "reports grade_distribution, ungraded_counts and category_means "
+        + "are kept up to date in the catalog. The functions psf_file(path, "
+        + "rev, file), psf_file_size(path, rev, file), psf_grep(path, rev, "
+        + "pattern) and psf_scorecard(path) may be used to read archive "
+        + "contents on demand.",
     )
 
     args = None
@@ -83,17 +148,33 @@ A tool for querying collections of PSFs using SQL.
     else:
         util.setup_logging()
 
-    db = build_database(args.glob)
+    if args.serve is not None:
+        server = QueryServer(args.serve, args.glob, args.catalog, args.fts)
+        server.serve(args.interval)
+        return
+
     rows = []
     cols = []
-    with db:
-        cursor = db.cursor()
+    if args.connect is not None:
         try:
-            cursor.execute(args.query)
-            rows = cursor.fetchall()
-            cols = [x[0] for x in cursor.description]
+            cols, rows = query_server(args.connect, args.query)
         except Exception as e:
             util.log_exception(e)
+            sys.exit(1)
+
+    else:
+        pool = ArchivePool()
+        db = build_database(args.glob, args.catalog, args.fts)
+        register_functions(db, pool)
+        with db:
+            cursor = db.cursor()
+            try:
+                cursor.execute(args.query)
+                rows = cursor.fetchall()
+                cols = [x[0] for x in cursor.description]
+            except Exception as e:
+                util.log_exception(e)
+        pool.close()
 
     if args.pretty:
         print(tabulate.tabulate(rows, cols, tablefmt="fancy_grid"))
@@ -118,18 +199,386 @@ A tool for querying collections of PSFs using SQL.
         print(tabulate.tabulate(rows, tablefmt="plain"))
 
 
-def build_database(glob):
-    """build_database
+def query_server(socket_path, query):
+    """query_server
 
-    Build a sqlite database from a library of PSFs specified by the given glob.
+    Run a query against a server started with pretor-query --serve, and
+    return a tuple (cols, rows) of the results.
 
-    :param glob:
+    :param socket_path: path to the server's Unix socket
+    :param query: SQL query string
     """
 
-    db = sqlite3.connect("memory")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        sock.sendall(json.dumps({"query": query}).encode("utf-8") + b"\n")
+
+        with sock.makefile("rb") as f:
+            response = json.loads(f.readline().decode("utf-8"))
+
+    if "error" in response:
+        raise exceptions.StateError("query failed: {}".format(response["error"]))
+
+    return response["columns"], [tuple(r) for r in response["rows"]]
+
+
+class QueryServer:
+    """QueryServer
+
+    Long-running query server, used by pretor-query --serve. The catalog and
+    the pool of open archive handles are kept in memory between requests,
+    and the library is re-scanned in the background every few seconds so the
+    catalog stays current.
+
+    Clients connect to a Unix socket and send one JSON object per line of the
+    form {"query": "SQL"}. Each request is answered with a single line
+    containing either {"columns": [...], "rows": [[...], ...]} or
+    {"error": "message"}.
+
+    The socket is only accessible to the user running the server, and
+    client queries may only read from the catalog.
+    """
+
+    def __init__(this, socket_path, glob, catalog=":memory:", fts=False):
+        """__init__
+
+        :param this:
+        :param socket_path: path to create the Unix socket at
+        :param glob: glob pattern selecting the library
+        :param catalog: see build_database()
+        :param fts: see build_database()
+        """
+
+        this.socket_path = pathlib.Path(socket_path)
+        this.glob = glob
+        this.lock = threading.Lock()
+        this.stopped = threading.Event()
+        this.pool = ArchivePool()
+
+        this.db = sqlite3.connect(str(catalog), check_same_thread=False)
+        open_catalog(this.db)
+        this.fts = enable_fts(this.db, create=fts)
+        refresh_catalog(this.db, this.glob, this.fts)
+        register_functions(this.db, this.pool)
+
+    def query(this, sql):
+        """query
+
+        Execute a query and return a response object for it.
 
-    schema = """
-CREATE TABLE psf(
+        :param this:
+        :param sql:
+        """
+
+        with this.lock:
+            this.db.set_authorizer(read_only_authorizer)
+            try:
+                cursor = this.db.execute(sql)
+                rows = cursor.fetchall()
+                cols = []
+                if cursor.description is not None:
+                    cols = [x[0] for x in cursor.description]
+            except Exception as e:
+                util.log_exception(e)
+                return {"error": str(e)}
+            finally:
+                # set_authorizer(None) only removes the authorizer since 3.11
+                this.db.set_authorizer(allow_all_authorizer)
+                if this.db.in_transaction:
+                    this.db.rollback()
+
+        return {"columns": cols, "rows": rows}
+
+    def refresh(this, interval):
+        """refresh
+
+        Re-scan the library every interval seconds until the server is
+        stopped.
+
+        :param this:
+        :param interval:
+        """
+
+        while not this.stopped.wait(interval):
+            try:
+                # the library is scanned without holding the lock, so that
+                # queries are only blocked while the changes are written
+                with this.lock:
+                    known = read_catalog_files(this.db)
+                scan = scan_library(known, this.glob, this.fts)
+                with this.lock:
+                    apply_scan(this.db, scan, this.fts)
+            except Exception as e:
+                util.log_exception(e)
+                logging.warning("failed to refresh catalog")
+
+    def create_server(this):
+        """create_server
+
+        Create the socket server, bound to the socket path, which must not
+        exist.
+
+        :param this:
+        """
+
+        outer = this
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(this):
+                for line in this.rfile:
+                    try:
+                        request = json.loads(line.decode("utf-8"))
+                        response = outer.query(request["query"])
+                    except Exception as e:
+                        response = {"error": "malformed request: {}".format(e)}
+
+                    response = json.dumps(response, default=str)
+                    this.wfile.write(response.encode("utf-8") + b"\n")
+                    this.wfile.flush()
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        server = Server(str(this.socket_path), Handler)
+        os.chmod(str(this.socket_path), 0o600)
+        return server
+
+    def serve(this, interval=60):
+        """serve
+
+        Listen for requests until interrupted.
+
+        :param this:
+        :param interval: seconds between background re-scans of the library
+        """
+
+        if this.socket_path.exists():
+            this.socket_path.unlink()
+
+        refresher = threading.Thread(target=this.refresh, args=(interval,))
+        refresher.daemon = True
+        refresher.start()
+
+        # make sure the socket is cleaned up when we are asked to stop
+        signal.signal(signal.SIGTERM, lambda sig, frame: sys.exit(0))
+
+        logging.info("serving queries on '{}'".format(this.socket_path))
+        try:
+            server = this.create_server()
+            try:
+                server.serve_forever()
+            finally:
+                server.server_close()
+        except KeyboardInterrupt:
+            logging.info("shutting down")
+        finally:
+            this.stopped.set()
+            if this.socket_path.exists():
+                this.socket_path.unlink()
+            this.pool.close()
+            this.db.close()
+
+
+# authorizer actions permitted for queries from QueryServer clients
+READ_ONLY_ACTIONS = set(
+    [sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION]
+    + [getattr(sqlite3, "SQLITE_RECURSIVE", 33)]
+)
+
+
+def read_only_authorizer(action, arg1, arg2, dbname, source):
+    """read_only_authorizer
+
+    sqlite3 authorizer which only permits reading, so that clients of
+    QueryServer can neither modify the catalog nor attach other databases.
+    """
+
+    if action in READ_ONLY_ACTIONS:
+        return sqlite3.SQLITE_OK
+
+    return sqlite3.SQLITE_DENY
+
+
+def allow_all_authorizer(action, arg1, arg2, dbname, source):
+    """allow_all_authorizer
+
+    sqlite3 authorizer which permits everything, used to lift
+    read_only_authorizer() once a client query has been executed.
+    """
+
+    return sqlite3.SQLITE_OK
+
+
+class ArchivePool:
+    """ArchivePool
+
+    Least-recently-used pool of open ZipFile handles, so that repeated reads
+    from the same archive do not need to re-open it. Handles are keyed by the
+    path, modification time and size of the archive, so an archive which is
+    rewritten on disk is transparently re-opened.
+    """
+
+    def __init__(this, size=64):
+        """__init__
+
+        :param this:
+        :param size: maximum number of handles to keep open at once
+        """
+
+        this.size = size
+        this.handles = collections.OrderedDict()
+
+    def get(this, path):
+        """get
+
+        Return an open ZipFile for the given path, opening it if needed.
+
+        :param this:
+        :param path:
+        """
+
+        path = str(path)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+
+        if key in this.handles:
+            this.handles.move_to_end(key)
+            return this.handles[key]
+
+        logging.debug("opening archive '{}'".format(path))
+        handle = zipfile.ZipFile(path, "r")
+        this.handles[key] = handle
+
+        while len(this.handles) > this.size:
+            old_key, old = this.handles.popitem(last=False)
+            logging.debug("closing archive '{}'".format(old_key[0]))
+            old.close()
+
+        return handle
+
+    def close(this):
+        """close
+
+        Close every handle in the pool.
+
+        :param this:
+        """
+
+        while len(this.handles) > 0:
+            this.handles.popitem()[1].close()
+
+
+@functools.lru_cache(maxsize=128)
+def compile_pattern(pattern):
+    """compile_pattern
+
+    Compile a regular expression, caching the result across calls, so that
+    psf_grep() compiles its pattern once per query rather than once per row.
+
+    Raises ValueError if the pattern is not a valid regular expression.
+
+    :param pattern:
+    """
+
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise ValueError("invalid regular expression '{}': {}".format(pattern, e))
+
+
+def register_functions(db, pool):
+    """register_functions
+
+    Register the psf_* SQL functions on the given database connection. Each of
+    these functions takes the path of a PSF (as stored in psf.path) as its
+    first argument, and reads only the archive members it needs via pool.
+
+    psf_file(path, rev, file) - contents of file in revision rev as text
+
+    psf_file_size(path, rev, file) - uncompressed size of the file in bytes
+
+    psf_grep(path, rev, pattern) - newline-delimited "file:line:text" for each
+    line in revision rev matching the regular expression pattern, or NULL if
+    there are no matches
+
+    psf_scorecard(path) - the scorecard for the canonical grade, or NULL if
+    the PSF has not been graded
+
+    All functions return NULL if the archive, revision, or file does not
+    exist, or the archive is not a valid zip file. psf_grep() raises
+    ValueError if pattern is not a valid regular expression.
+
+    :param db: sqlite3 connection
+    :param pool: ArchivePool to read archives through
+    """
+
+    def member_name(rev, name):
+        return "revisions/{}/contents/{}".format(rev, name)
+
+    def psf_file(path, rev, name):
+        try:
+            data = pool.get(path).read(member_name(rev, name))
+        except (KeyError, OSError, zipfile.BadZipFile) as e:
+            logging.debug("psf_file: {}".format(e))
+            return None
+
+        return data.decode("utf-8", errors="replace")
+
+    def psf_file_size(path, rev, name):
+        try:
+            return pool.get(path).getinfo(member_name(rev, name)).file_size
+        except (KeyError, OSError, zipfile.BadZipFile) as e:
+            logging.debug("psf_file_size: {}".format(e))
+            return None
+
+    def psf_grep(path, rev, pattern):
+        regex = compile_pattern(pattern)
+        prefix = member_name(rev, "")
+        matches = []
+        try:
+            handle = pool.get(path)
+            for info in handle.infolist():
+                if not info.filename.startswith(prefix):
+                    continue
+
+                name = info.filename[len(prefix) :]
+                text = handle.read(info).decode("utf-8", errors="replace")
+                for lineno, line in enumerate(text.split("\n"), 1):
+                    if regex.search(line):
+                        matches.append("{}:{}:{}".format(name, lineno, line))
+
+        except (KeyError, OSError, zipfile.BadZipFile) as e:
+            logging.debug("psf_grep: {}".format(e))
+            return None
+
+        if len(matches) == 0:
+            return None
+
+        return "\n".join(matches)
+
+    def psf_scorecard(path):
+        thepsf = psf.PSF()
+        try:
+            thepsf.load_from_zipfile(pool.get(path), path, header_only=True)
+        except Exception as e:
+            util.log_exception(e)
+            return None
+
+        if not thepsf.is_graded():
+            return None
+
+        return thepsf.get_grade_rev().grade.generate_scorecard()
+
+    db.create_function("psf_file", 3, psf_file)
+    db.create_function("psf_file_size", 3, psf_file_size)
+    db.create_function("psf_grep", 3, psf_grep)
+    db.create_function("psf_scorecard", 1, psf_scorecard)
+
+
+CATALOG_VERSION = 3
+
+PSF_SCHEMA = """
+CREATE TABLE IF NOT EXISTS psf(
     uuid TEXT,
     filename TEXT,
     path TEXT,
@@ -152,119 +601,726 @@ CREATE TABLE psf(
     forensic_source_dir TEXT,
     forensic_pretor_version TEXT
 );
+"""
+
+CATEGORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS category(
+    uuid TEXT,
+    path TEXT,
+    category TEXT,
+    marks INTEGER,
+    max_marks INTEGER
+);
+CREATE INDEX IF NOT EXISTS category_path ON category(path);
+"""
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalog_files(
+    path TEXT PRIMARY KEY,
+    display_path TEXT,
+    mtime_ns INTEGER,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS psf_path ON psf(path);
+"""
+
+
+class ReportView:
+    """ReportView
+
+    A named report which is materialized in the catalog as the table
+    report_<name>, and exposed to queries as the view <name>.
+
+    The materialized table contains the key columns, plus a set of counter
+    columns which are sums over every cataloged PSF. Because sums can be
+    adjusted one PSF at a time, the table is kept up to date by adding each
+    PSF's contribution when it is cataloged and subtracting it again when it
+    is removed or modified, rather than by recomputing it from the psf table.
+    Derived columns such as means are computed by the view.
+    """
+
+    def __init__(this, name, keys, counters, contribute, columns=None):
+        """__init__
+
+        :param this:
+        :param name: report name
+        :param keys: list of key column names
+        :param counters: list of counter column names
+        :param contribute: function taking a psf row (as a dict) and a list
+        of (category, marks, max_marks) tuples for the PSF, and returning a
+        list of (key, counts) tuples, where key and counts are tuples
+        matching keys and counters.
+        :param columns: SQL select list used for the view, by default all of
+        the key and counter columns.
+        """
+
+        this.name = name
+        this.keys = keys
+        this.counters = counters
+        this.contribute = contribute
+        this.columns = columns
+        if this.columns is None:
+            this.columns = ", ".join(keys + counters)
+
+    def table(this):
+        """table
+
+        Return the name of the materialized table for this report.
+
+        :param this:
+        """
+
+        return "report_{}".format(this.name)
+
+    def schema(this):
+        """schema
+
+        Return the SQL needed to create this report's table and view.
+
+        :param this:
+        """
+
+        return """
+CREATE TABLE IF NOT EXISTS {table}(
+    {keys},
+    {counters},
+    PRIMARY KEY ({keylist})
+);
+CREATE VIEW IF NOT EXISTS {name} AS SELECT {columns} FROM {table};
+""".format(
+            table=this.table(),
+            name=this.name,
+            keys=",\n    ".join(this.keys),
+            counters=",\n    ".join("{} NUMERIC".format(c) for c in this.counters),
+            keylist=", ".join(this.keys),
+            columns=this.columns,
+        )
+
+    def apply(this, cursor, row, categories, sign):
+        """apply
+
+        Add (sign = 1) or subtract (sign = -1) the contribution of one PSF to
+        this report. Groups whose first counter drops to zero are deleted.
+
+        :param this:
+        :param cursor:
+        :param row: psf row as a dict
+        :param categories: list of (category, marks, max_marks) tuples
+        :param sign:
+        """
+
+        keymatch = " AND ".join("{} IS ?".format(k) for k in this.keys)
+
+        for key, counts in this.contribute(row, categories):
+            counts = [sign * c for c in counts]
+
+            cursor.execute(
+                "UPDATE {} SET {} WHERE {}".format(
+                    this.table(),
+                    ", ".join("{0} = {0} + ?".format(c) for c in this.counters),
+                    keymatch,
+                ),
+                list(counts) + list(key),
+            )
+
+            if cursor.rowcount == 0:
+                cursor.execute(
+                    "INSERT INTO {} VALUES ({})".format(
+                        this.table(),
+                        ", ".join("?" for _ in this.keys + this.counters),
+                    ),
+                    list(key) + list(counts),
+                )
+
+            cursor.execute(
+                "DELETE FROM {} WHERE {} AND {} <= 0".format(
+                    this.table(), keymatch, this.counters[0]
+                ),
+                list(key),
+            )
+
+
+def grade_bucket(score):
+    """grade_bucket
+
+    Return the lower bound of the 10 percentage point bucket a score in 0..1
+    falls into, i.e. 0.87 is in bucket 80. Scores above 100% are in bucket 100,
+    and negative scores are in bucket 0.
+
+    :param score:
+    """
+
+    return max(0, min(int(score * 10), 10)) * 10
+
+
+REPORT_VIEWS = [
+    ReportView(
+        "grade_distribution",
+        ["course", "semester", "section", "assignment", "bucket"],
+        ["count"],
+        lambda row, cats: (
+            [
+                (
+                    (
+                        row["course"],
+                        row["semester"],
+                        row["section"],
+                        row["assignment"],
+                        grade_bucket(row["grade"]),
+                    ),
+                    (1,),
+                )
+            ]
+            if row["graded"]
+            else []
+        ),
+    ),
+    ReportView(
+        "ungraded_counts",
+        ["course", "semester", "section", "assignment"],
+        ["total", "ungraded"],
+        lambda row, cats: [
+            (
+                (row["course"], row["semester"], row["section"], row["assignment"]),
+                (1, 0 if row["graded"] else 1),
+            )
+        ],
+    ),
+    ReportView(
+        "category_means",
+        ["course", "semester", "assignment", "category"],
+        ["count", "marks", "max_marks"],
+        lambda row, cats: [
+            (
+                (row["course"], row["semester"], row["assignment"], name),
+                (1, marks, max_marks),
+            )
+            for name, marks, max_marks in cats
+        ],
+        "course, semester, assignment, category, count, "
+        + "CAST(marks AS REAL) / count AS mean_marks, "
+        + "CAST(max_marks AS REAL) / count AS max_marks, "
+        + "CAST(marks AS REAL) / NULLIF(max_marks, 0) AS mean_percent",
+    ),
+]
+
+
+def build_database(glob, catalog=":memory:", fts=False):
+    """build_database
+
+    Build a sqlite database from a library of PSFs specified by the given glob.
+
+    If catalog is the path to a file, the database is persisted there, and
+    later calls only re-load those PSFs which have been added, modified, or
+    removed since the catalog was last built.
+
+    If fts is True, the text files in the submission and canonical grade
+    revisions of each PSF are indexed in the FTS5 table psf_text(uuid, path,
+    rev, file, content).
+
+    :param glob:
+    :param catalog: path to the catalog database, or ":memory:"
+    :param fts: maintain the full-text index
     """
+
+    db = sqlite3.connect(str(catalog))
+    open_catalog(db)
+
+    # an existing index is kept up to date even when it was not asked for
+    fts = enable_fts(db, create=fts)
+
+    refresh_catalog(db, glob, fts)
+
+    return db
+
+
+def open_catalog(db):
+    """open_catalog
+
+    Create the catalog tables if they do not exist. A catalog written by a
+    different version of this module is discarded and rebuilt from scratch.
+
+    :param db:
+    """
+
     with db:
         cursor = db.cursor()
-        cursor.execute("DROP TABLE IF EXISTS psf")
-        cursor.execute(schema)
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS catalog_info(key TEXT PRIMARY KEY, value TEXT)"
+        )
+        cursor.execute("SELECT value FROM catalog_info WHERE key = 'version'")
+        row = cursor.fetchone()
+
+        if row is None or row[0] != str(CATALOG_VERSION):
+            logging.debug("initializing catalog version {}".format(CATALOG_VERSION))
+            for (name,) in cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'view'"
+            ).fetchall():
+                cursor.execute('DROP VIEW IF EXISTS "{}"'.format(name))
+
+            for (name,) in cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' "
+                + "AND name != 'catalog_info' AND name NOT LIKE 'psf_text_%' "
+                + "AND name NOT LIKE 'sqlite_%'"
+            ).fetchall():
+                cursor.execute('DROP TABLE IF EXISTS "{}"'.format(name))
+
+        cursor.executescript(PSF_SCHEMA + CATEGORY_SCHEMA + CATALOG_SCHEMA)
+        for view in REPORT_VIEWS:
+            cursor.executescript(view.schema())
+        cursor.execute(
+            "INSERT OR REPLACE INTO catalog_info VALUES ('version', ?)",
+            (str(CATALOG_VERSION),),
+        )
+
+
+def enable_fts(db, create=True):
+    """enable_fts
+
+    Create the psf_text full-text index if it does not already exist. If it
+    had to be created, every PSF is removed from the catalog so that it is
+    re-loaded and indexed on the next refresh.
 
-        for path in pathlib.Path().glob(glob):
-            thepsf = psf.PSF()
+    Returns True if the catalog has a full-text index which should be
+    maintained, or False if it does not or if this build of sqlite does not
+    support FTS5.
+
+    :param db:
+    :param create: if False, only check whether the index exists
+    """
+
+    with db:
+        cursor = db.cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'psf_text'")
+        if cursor.fetchone() is not None:
+            return True
+
+        if not create:
+            return False
+
+        # the trigram tokenizer allows substring searches such as
+        # content LIKE '%gets(%' to use the index, but requires sqlite 3.34
+        for tokenizer in [", tokenize='trigram'", ""]:
             try:
-                thepsf.load_from_archive(path)
-            except Exception as e:
-                logging.warning("could not load '{}', skipping".format(path))
-                util.log_exception(e)
+                cursor.execute(
+                    "CREATE VIRTUAL TABLE psf_text USING fts5("
+                    + "uuid UNINDEXED, path UNINDEXED, rev UNINDEXED, "
+                    + "file, content{})".format(tokenizer)
+                )
+                break
+            except sqlite3.OperationalError as e:
+                logging.debug("could not create psf_text: {}".format(e))
+        else:
+            logging.warning("sqlite FTS5 is not available, not indexing text")
+            return False
+
+        # drop every cataloged PSF, so that all of them are loaded again
+        for (display,) in cursor.execute(
+            "SELECT display_path FROM catalog_files"
+        ).fetchall():
+            forget_path(cursor, display)
+        cursor.execute("DELETE FROM catalog_files")
+
+    return True
+
+
+def refresh_catalog(db, glob, fts=False):
+    """refresh_catalog
+
+    Bring the catalog up to date with the PSFs matching glob. PSFs whose
+    modification time and size are unchanged since they were last cataloged
+    are not re-loaded.
+
+    PSFs are identified by their resolved path, so that a catalog refreshed
+    from a different working directory, or through a different glob, still
+    recognizes the PSFs it already contains. The path column of the other
+    tables holds the path as matched by glob, and is updated in place when
+    only that changes.
+
+    This is scan_library() followed by apply_scan(), see QueryServer.refresh()
+    for running the two separately.
+
+    Returns a tuple (added, removed) of lists of paths which were (re-)loaded
+    and which were dropped from the catalog, respectively.
+
+    :param db:
+    :param glob:
+    :param fts: update the full-text index
+    """
+
+    scan = scan_library(read_catalog_files(db), glob, fts)
+    return apply_scan(db, scan, fts)
+
+
+def read_catalog_files(db):
+    """read_catalog_files
+
+    Return a table of the resolved paths of every cataloged PSF to tuples
+    (display_path, mtime_ns, size), for scan_library().
+
+    :param db:
+    """
+
+    return {
+        key: (display, mtime_ns, size)
+        for key, display, mtime_ns, size in db.execute(
+            "SELECT * FROM catalog_files"
+        ).fetchall()
+    }
+
+
+def scan_library(known, glob, fts=False):
+    """scan_library
+
+    Find the changes needed to bring a catalog up to date with the PSFs
+    matching glob, loading every PSF which is new or modified. The catalog
+    itself is not accessed, so this can run while the catalog is in use.
+
+    Returns a table with the keys:
+
+    moved - list of (key, old display path, new display path) tuples for
+    unchanged PSFs matched under a different path
+
+    loaded - list of (key, display path, mtime_ns, size, rows) tuples for new
+    or modified PSFs, where rows is a tuple (psf row, category rows, text
+    rows), or None if the PSF could not be loaded
+
+    removed - list of the keys of cataloged PSFs which no longer exist
+
+    :param known: as returned by read_catalog_files()
+    :param glob:
+    :param fts: also generate rows for the full-text index
+    """
+
+    scan = {"moved": [], "loaded": [], "removed": []}
+
+    seen = set()
+    for path in sorted(pathlib.Path().glob(glob)):
+        if not path.is_file():
+            continue
+
+        key = str(path.resolve())
+        if key in seen:
+            logging.debug("'{}' was already cataloged".format(path))
+            continue
+
+        seen.add(key)
+        display = str(path)
+        stat = path.stat()
+        if key in known and known[key][1:] == (stat.st_mtime_ns, stat.st_size):
+            if known[key][0] != display:
+                scan["moved"].append((key, known[key][0], display))
+            continue
+
+        logging.debug("cataloging '{}'".format(path))
+        thepsf = psf.PSF()
+        try:
+            thepsf.load_from_archive(path, header_only=not fts)
+        except Exception as e:
+            logging.warning("could not load '{}', skipping".format(path))
+            util.log_exception(e)
+            scan["loaded"].append((key, display, stat.st_mtime_ns, stat.st_size, None))
+            continue
 
-            course = None
-            if "course" in thepsf.metadata:
-                course = thepsf.metadata["course"]
-
-            assignment = None
-            if "assignment" in thepsf.metadata:
-                assignment = thepsf.metadata["assignment"]
-
-            group = None
-            if "group" in thepsf.metadata:
-                group = thepsf.metadata["group"]
-
-            semester = None
-            if "semester" in thepsf.metadata:
-                semester = thepsf.metadata["semester"]
-
-            section = None
-            if "section" in thepsf.metadata:
-                section = thepsf.metadata["section"]
-
-            no_meta_check = None
-            if "no_meta_check" in thepsf.metadata:
-                no_meta_check = thepsf.metadata["no_meta_check"]
-
-            allow_no_toml = None
-            if "allow_no_toml" in thepsf.metadata:
-                allow_no_toml = thepsf.metadata["allow_no_toml"]
-
-            disable_version_check = None
-            if "disable_version_check" in thepsf.metadata:
-                disable_version_check = thepsf.metadata["disable_version_check"]
-
-            forensic_no_meta_check = None
-            if "forensic_no_meta_check" in thepsf.forensic:
-                forensic_no_meta_check = thepsf.forensic["no_meta_check"]
-
-            forensic_allow_no_toml = None
-            if "forensic_allow_no_toml" in thepsf.forensic:
-                forensic_allow_no_toml = thepsf.forensic["allow_no_toml"]
-
-            forensic_disable_version_check = None
-            if "forensic_disable_version_check" in thepsf.forensic:
-                forensic_disable_version_check = thepsf.forensic[
-                    "disable_version_check"
-                ]
-
-            forensic_hostname = None
-            if "forensic_hostname" in thepsf.forensic:
-                forensic_hostname = thepsf.forensic["hostname"]
-
-            forensic_user = None
-            if "forensic_user" in thepsf.forensic:
-                forensic_user = thepsf.forensic["user"]
-
-            forensic_timestamp = None
-            if "forensic_timestamp" in thepsf.forensic:
-                forensic_timestamp = thepsf.forensic["timestamp"]
-
-            forensic_source_dir = None
-            if "forensic_source_dir" in thepsf.forensic:
-                forensic_source_dir = thepsf.forensic["source_dir"]
-
-            forensic_pretor_version = None
-            if "forensic_pretor_version" in thepsf.forensic:
-                forensic_pretor_version = thepsf.forensic["pretor_version"]
-
-            grade = None
-            if thepsf.is_graded():
-                grade = thepsf.get_grade_rev().grade.get_score()
-
-            vals = []
-
-            vals.append(thepsf.ID)  # uuid TEXT,
-            vals.append(str(path.name))  # filename TEXT,
-            vals.append(str(path))  # path TEXT,
-            vals.append(course)  # course TEXT,
-            vals.append(semester)  # semester TEXT,
-            vals.append(section)  # section TEXT,
-            vals.append(group)  # group TEXT,
-            vals.append(assignment)  # assignment TEXT,
-            vals.append(thepsf.is_graded())  # graded BOOL,
-            vals.append(grade)  # grade FLOAT,
-            vals.append(no_meta_check)  # no_meta_check BOOL,
-            vals.append(allow_no_toml)  # allow_no_toml BOOL,
-            vals.append(disable_version_check)  # disable_version_check BOOL,
-            vals.append(forensic_no_meta_check)  # forensic_no_meta_check BOOL,
-            vals.append(forensic_allow_no_toml)  # forensic_allow_no_toml BOOL,
-            vals.append(
-                forensic_disable_version_check
-            )  # forensic_disable_version_check BOOL,
-            vals.append(forensic_hostname)  # forensic_hostname TEXT,
-            vals.append(forensic_timestamp)  # forensic_timestamp TEXT,
-            vals.append(forensic_user)  # forensic_user TEXT,
-            vals.append(forensic_source_dir)  # forensic_source_dir TEXT,
-            vals.append(forensic_pretor_version)  # forensic_pretor_version TEXT
+        rows = (
+            psf_row(thepsf, path),
+            list(category_rows(thepsf, path)),
+            list(text_rows(thepsf, path)) if fts else [],
+        )
+        scan["loaded"].append((key, display, stat.st_mtime_ns, stat.st_size, rows))
+
+    scan["removed"] = [key for key in known if key not in seen]
+
+    return scan
+
+
+def apply_scan(db, scan, fts=False):
+    """apply_scan
+
+    Apply the changes found by scan_library() to the catalog, in a single
+    transaction. The catalog must not have been modified since the
+    catalog_files table was read for the scan.
+
+    Returns a tuple (added, removed), see refresh_catalog().
+
+    :param db:
+    :param scan: as returned by scan_library()
+    :param fts: update the full-text index
+    """
+
+    added = []
+    removed = []
+
+    with db:
+        cursor = db.cursor()
+        known = read_catalog_files(db)
+
+        for key, old, new in scan["moved"]:
+            move_path(cursor, old, new, fts)
+            cursor.execute(
+                "UPDATE catalog_files SET display_path = ? WHERE path = ?", (new, key)
+            )
+
+        for key, display, mtime_ns, size, rows in scan["loaded"]:
+            if key in known:
+                forget_path(cursor, known[key][0], fts)
+
+            if rows is None:
+                continue
+
+            psf_values, category_values, text_values = rows
+            cursor.execute(
+                "INSERT INTO psf VALUES "
+                + "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                psf_values,
+            )
+            cursor.executemany(
+                "INSERT INTO category VALUES (?, ?, ?, ?, ?)", category_values
+            )
+
+            update_reports(cursor, display, 1)
+
+            if fts:
+                cursor.executemany(
+                    "INSERT INTO psf_text VALUES (?, ?, ?, ?, ?)", text_values
+                )
 
             cursor.execute(
-                "INSERT INTO psf VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                vals,
+                "INSERT OR REPLACE INTO catalog_files VALUES (?, ?, ?, ?)",
+                (key, display, mtime_ns, size),
             )
+            added.append(display)
+
+        for key in scan["removed"]:
+            logging.debug("dropping '{}' from catalog".format(known[key][0]))
+            forget_path(cursor, known[key][0], fts)
+            cursor.execute("DELETE FROM catalog_files WHERE path = ?", (key,))
+            removed.append(known[key][0])
+
+    logging.debug(
+        "catalog refreshed, {} loaded, {} removed".format(len(added), len(removed))
+    )
+
+    return added, removed
+
+
+def forget_path(cursor, path, fts=False):
+    """forget_path
+
+    Remove every catalog row derived from the PSF at path, and subtract it
+    from the report views.
+
+    :param cursor:
+    :param path:
+    :param fts:
+    """
+
+    update_reports(cursor, path, -1)
+    cursor.execute("DELETE FROM psf WHERE path = ?", (path,))
+    cursor.execute("DELETE FROM category WHERE path = ?", (path,))
+    if fts:
+        cursor.execute("DELETE FROM psf_text WHERE path = ?", (path,))
+
+
+def move_path(cursor, old, new, fts=False):
+    """move_path
+
+    Update every catalog row derived from the PSF at path old to refer to it
+    by path new instead.
+
+    :param cursor:
+    :param old:
+    :param new:
+    :param fts:
+    """
+
+    cursor.execute("UPDATE psf SET path = ? WHERE path = ?", (new, old))
+    cursor.execute("UPDATE category SET path = ? WHERE path = ?", (new, old))
+    if fts:
+        cursor.execute("UPDATE psf_text SET path = ? WHERE path = ?", (new, old))
+
+
+def update_reports(cursor, path, sign):
+    """update_reports
+
+    Add (sign = 1) or subtract (sign = -1) the cataloged PSF at path to or
+    from every report view.
+
+    :param cursor:
+    :param path:
+    :param sign:
+    """
+
+    cursor.execute("SELECT * FROM psf WHERE path = ?", (path,))
+    cols = [x[0] for x in cursor.description]
+    rows = [dict(zip(cols, r)) for r in cursor.fetchall()]
+
+    cursor.execute(
+        "SELECT category, marks, max_marks FROM category WHERE path = ?", (path,)
+    )
+    categories = cursor.fetchall()
+
+    for row in rows:
+        for view in REPORT_VIEWS:
+            view.apply(cursor, row, categories, sign)
+
+
+def category_rows(thepsf, path):
+    """category_rows
+
+    Generate category table rows for each rubric category of the canonical
+    grade of the PSF.
+
+    :param thepsf:
+    :param path:
+    """
+
+    if not thepsf.is_graded():
+        return
+
+    grade_obj = thepsf.get_grade_rev().grade
+    for name in grade_obj.categories:
+        yield (
+            thepsf.ID,
+            str(path),
+            name,
+            grade_obj.categories[name],
+            grade_obj.assignment.categories[name],
+        )
+
+
+def text_rows(thepsf, path):
+    """text_rows
+
+    Generate psf_text rows for each text file in the submission revision and
+    the canonical grade revision of the PSF. Files which are not valid UTF-8
+    or which contain NUL bytes are assumed to be binary and are skipped.
+
+    :param thepsf:
+    :param path:
+    """
+
+    revIDs = ["submission"]
+    if thepsf.is_graded():
+        revIDs.append(thepsf.get_grade_rev().ID)
+
+    for revID in revIDs:
+        if revID not in thepsf.revisions:
+            continue
+
+        rev = thepsf.revisions[revID]
+        for name in rev.contents:
+            data = rev.contents[name].get_data()
+            if b"\0" in data:
+                continue
+
+            try:
+                text = data.decode("utf-8")
+            except UnicodeDecodeError:
+                continue
+
+            yield (thepsf.ID, str(path), revID, name, text)
+
+
+def psf_row(thepsf, path):
+    """psf_row
+
+    Generate the values of a row in the psf table for the given PSF.
+
+    :param thepsf:
+    :param path: the path the PSF was loaded from
+    """
+
+    course = None
+    if "course" in thepsf.metadata:
+        course = thepsf.metadata["course"]
+
+    assignment = None
+    if "assignment" in thepsf.metadata:
+        assignment = thepsf.metadata["assignment"]
+
+    group = None
+    if "group" in thepsf.metadata:
+        group = thepsf.metadata["group"]
+
+    semester = None
+    if "semester" in thepsf.metadata:
+        semester = thepsf.metadata["semester"]
+
+    section = None
+    if "section" in thepsf.metadata:
+        section = thepsf.metadata["section"]
+
+    no_meta_check = None
+    if "no_meta_check" in thepsf.metadata:
+        no_meta_check = thepsf.metadata["no_meta_check"]
+
+    allow_no_toml = None
+    if "allow_no_toml" in thepsf.metadata:
+        allow_no_toml = thepsf.metadata["allow_no_toml"]
+
+    disable_version_check = None
+    if "disable_version_check" in thepsf.metadata:
+        disable_version_check = thepsf.metadata["disable_version_check"]
+
+    forensic_no_meta_check = None
+    if "forensic_no_meta_check" in thepsf.forensic:
+        forensic_no_meta_check = thepsf.forensic["no_meta_check"]
+
+    forensic_allow_no_toml = None
+    if "forensic_allow_no_toml" in thepsf.forensic:
+        forensic_allow_no_toml = thepsf.forensic["allow_no_toml"]
+
+    forensic_disable_version_check = None
+    if "forensic_disable_version_check" in thepsf.forensic:
+        forensic_disable_version_check = thepsf.forensic["disable_version_check"]
+
+    forensic_hostname = None
+    if "forensic_hostname" in thepsf.forensic:
+        forensic_hostname = thepsf.forensic["hostname"]
+
+    forensic_user = None
+    if "forensic_user" in thepsf.forensic:
+        forensic_user = thepsf.forensic["user"]
+
+    forensic_timestamp = None
+    if "forensic_timestamp" in thepsf.forensic:
+        forensic_timestamp = thepsf.forensic["timestamp"]
+
+    forensic_source_dir = None
+    if "forensic_source_dir" in thepsf.forensic:
+        forensic_source_dir = thepsf.forensic["source_dir"]
+
+    forensic_pretor_version = None
+    if "forensic_pretor_version" in thepsf.forensic:
+        forensic_pretor_version = thepsf.forensic["pretor_version"]
+
+    grade = None
+    if thepsf.is_graded():
+        grade = thepsf.get_grade_rev().grade.get_score()
+
+    vals = []
+
+    vals.append(thepsf.ID)  # uuid TEXT,
+    vals.append(str(path.name))  # filename TEXT,
+    vals.append(str(path))  # path TEXT,
+    vals.append(course)  # course TEXT,
+    vals.append(semester)  # semester TEXT,
+    vals.append(section)  # section TEXT,
+    vals.append(group)  # group TEXT,
+    vals.append(assignment)  # assignment TEXT,
+    vals.append(thepsf.is_graded())  # graded BOOL,
+    vals.append(grade)  # grade FLOAT,
+    vals.append(no_meta_check)  # no_meta_check BOOL,
+    vals.append(allow_no_toml)  # allow_no_toml BOOL,
+    vals.append(disable_version_check)  # disable_version_check BOOL,
+    vals.append(forensic_no_meta_check)  # forensic_no_meta_check BOOL,
+    vals.append(forensic_allow_no_toml)  # forensic_allow_no_toml BOOL,
+    vals.append(forensic_disable_version_check)  # forensic_disable_version_check BOOL,
+    vals.append(forensic_hostname)  # forensic_hostname TEXT,
+    vals.append(forensic_timestamp)  # forensic_timestamp TEXT,
+    vals.append(forensic_user)  # forensic_user TEXT,
+    vals.append(forensic_source_dir)  # forensic_source_dir TEXT,
+    vals.append(forensic_pretor_version)  # forensic_pretor_version TEXT
 
-        return db
+    return vals
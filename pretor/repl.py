@@ -87,6 +87,10 @@ class REPL(cmd.Cmd):
         this.symtab["revision"] = ""
         this.symtab["base_revision"] = "submission"
 
+        # course registry for the coursepath, kept between interacts
+        this.courses = None
+        this.courses_path = None
+
     def do_exit(this, arg):
         """exit
 
@@ -296,28 +300,111 @@ Begin an interactive shell session in the current PSF so that it may be graded.
             )
             this.symtab["revision"] = grade_revision.ID
 
-        # load all courses in the coursepath
-        courses = {}
-        for p in this.symtab["coursepath"].split(":"):
-            p = pathlib.Path(p)
-            if p.is_file():
-                try:
-                    c = course.load_course_definition(p)
-                    courses[c.name] = c
-                except Exception as e:
-                    util.log_exception(e)
-                    logging.warning("failed to load course from '{}'".format(p))
-            else:
-                for fp in p.glob("**/*.toml"):
-                    try:
-                        c = course.load_course_definition(fp)
-                        courses[c.name] = c
-                    except Exception as e:
-                        util.log_exception(e)
-                        logging.warning("failed to load course from '{}'".format(fp))
+        courses = this.get_courses()
 
         current.interact(this.symtab["revision"], workdir, courses)
 
+    def do_reload(this, arg):
+        """reload courses
+
+Re-read every course definition in the coursepath. Course definitions are
+otherwise only re-read when they are modified. A warning is displayed for each
+grade in progress which was started against a rubric that has since changed.
+        """
+
+        if not this.check_arg(1):
+            return
+
+        if this.symtab["#argv"][1] != "courses":
+            this.fail("don't know how to reload '{}'".format(this.symtab["#argv"][1]))
+            return
+
+        if this.courses is None or this.courses_path != this.symtab["coursepath"]:
+            this.get_courses()
+            changed = sorted(this.courses)
+        else:
+            changed = this.courses.reload()
+            this.check_rubrics(changed)
+
+        this.symtab["#result"] = "{} courses, changed: {}".format(
+            len(this.courses), ", ".join(changed) if len(changed) > 0 else "none"
+        )
+
+    def get_courses(this):
+        """get_courses
+
+        Return the course registry for the current coursepath. The registry is
+        kept between calls, so that course definitions are only parsed once,
+        and re-read only if their files change, or the coursepath is changed.
+
+        :param this:
+        """
+
+        coursepath = this.symtab["coursepath"]
+        if this.courses is None or this.courses_path != coursepath:
+            logging.debug("indexing courses in '{}'".format(coursepath))
+            this.courses = course.load_courses(coursepath.split(":"))
+            this.courses_path = coursepath
+            return this.courses
+
+        changed = this.courses.refresh()
+        if len(changed) > 0:
+            logging.info("course definitions changed: {}".format(", ".join(changed)))
+            this.check_rubrics(changed)
+
+        return this.courses
+
+    def check_rubrics(this, names):
+        """check_rubrics
+
+        Warn about each grade in progress (that is, on a PSF which has been
+        interacted with but not finalized) on one of the named courses, whose
+        rubric no longer matches the course definition in the registry.
+
+        :param this:
+        :param names: list of course names to check
+        """
+
+        if "#psf" not in this.symtab:
+            return
+
+        for psfno, the_psf in enumerate(this.symtab["#psf"]):
+            if psfno in this.symtab["#finalized"]:
+                continue
+
+            if not hasattr(the_psf, "repl_workdir"):
+                continue
+
+            grade_rev = the_psf.get_grade_rev()
+            if grade_rev is None:
+                continue
+
+            assignment = grade_rev.grade.assignment
+            if assignment.course.name not in names:
+                continue
+
+            current = None
+            try:
+                if assignment.course.name in this.courses:
+                    current = this.courses[assignment.course.name]
+            except Exception as e:
+                util.log_exception(e)
+
+            if (
+                current is None
+                or assignment.name not in current.assignments
+                or current.assignments[assignment.name].categories
+                != assignment.categories
+            ):
+                logging.warning(
+                    (
+                        "PSF {} ({}) is being graded against an old rubric "
+                        + "for {} {}, which has been changed or removed"
+                    ).format(
+                        psfno, the_psf, assignment.course.name, assignment.name
+                    )
+                )
+
     def do_lsrev(this, arg):
         """lsrev
 
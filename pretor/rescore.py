@@ -0,0 +1,399 @@
+# Copyright 2019 Charles A Daniels
+# Distributed under the GNU AGPLv3 License (https://www.gnu.org/licenses/agpl.txt)
+
+import argparse
+import array
+import csv
+import logging
+import math
+import pathlib
+import sys
+import tabulate
+
+from . import constants
+from . import course
+from . import exceptions
+from . import grade
+from . import psf
+from . import util
+
+"""
+This module implements what-if re-scoring of canonical grades, either against
+a modified course definition, or through a curve, or both. Scores are computed
+from header-only PSF summaries, and archives are only rewritten on request.
+"""
+
+curve_steps = {
+    "add": lambda score, x: score + x,
+    "scale": lambda score, x: score * x,
+    "cap": lambda score, x: min(score, x),
+    "floor": lambda score, x: max(score, x),
+    "sqrt": lambda score, x: math.sqrt(max(score, 0.0)),
+}
+
+
+def rescore_cli(argv=None):
+    parser = argparse.ArgumentParser(
+        """
+A tool for re-scoring the canonical grades of a collection of PSFs against a
+modified course definition or a curve. By default, the resulting scores are
+only reported, and no PSF is modified.
+"""
+    )
+
+    parser.add_argument("--version", action="version", version=constants.version)
+
+    parser.add_argument(
+        "--debug",
+        "-d",
+        action="store_true",
+        default=False,
+        help="Log debugging output to the console.",
+    )
+
+    parser.add_argument(
+        "--input",
+        "-i",
+        default="./**/*.psf",
+        help="Specify glob pattern to search for PSF files."
+        + " (default: **/*.psf)",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        default=None,
+        type=int,
+        help="Number of PSFs to load in parallel. (default: one per CPU)",
+    )
+
+    parser.add_argument(
+        "--course",
+        "-c",
+        default=None,
+        type=pathlib.Path,
+        help="Re-score grades for this course against the given course "
+        + "definition, for example with changed category maximums.",
+    )
+
+    parser.add_argument(
+        "--curve",
+        "-k",
+        default=None,
+        help="Apply a curve to each score (in 0..1), given as a comma "
+        + "separated list of steps applied in order. Valid steps are add:X, "
+        + "scale:X, cap:X, floor:X and sqrt, for example 'sqrt,cap:1'.",
+    )
+
+    parser.add_argument(
+        "--apply",
+        "-a",
+        default=False,
+        action="store_true",
+        help="Write the new scores to each PSF whose score changed, as a new "
+        + "grade revision. A curve is stored as a separate adjustment to the "
+        + "score, which replaces the adjustment of any previous curve, so the "
+        + "same curve can be applied again without compounding. Grades with an "
+        + "override are not curved.",
+    )
+
+    parser.add_argument(
+        "--csv",
+        default=False,
+        action="store_true",
+        help="Print output as comma-separated values",
+    )
+
+    args = None
+    if argv is not None:
+        args = parser.parse_args(argv)
+    else:
+        args = parser.parse_args()
+
+    if args.debug:
+        util.setup_logging(logging.DEBUG)
+    else:
+        util.setup_logging()
+
+    try:
+        if args.course is None and args.curve is None:
+            raise exceptions.MissingFile("nothing to do, specify --course or --curve")
+
+        course_obj = None
+        if args.course is not None:
+            course_obj = course.load_course_definition(args.course)
+
+        curve = []
+        if args.curve is not None:
+            curve = parse_curve(args.curve)
+
+        paths = sorted(p for p in pathlib.Path().glob(args.input) if p.is_file())
+        table = ScoreColumns()
+        for summary in psf.load_summaries(paths, args.jobs):
+            table.add_summary(summary, course_obj)
+
+        old = table.old_scores
+        new = table.scores(curve)
+
+        header = ["PATH", "COURSE", "ASSIGNMENT", "GROUP", "OLD", "NEW", "DELTA"]
+        rows = []
+        for i, summary in enumerate(table.summaries):
+            grade = summary["grade"]
+            rows.append(
+                [
+                    summary["path"],
+                    grade["course"],
+                    grade["assignment"],
+                    summary["metadata"].get("group", "UNSPECIFIED"),
+                    old[i] * 100.0,
+                    new[i] * 100.0,
+                    (new[i] - old[i]) * 100.0,
+                ]
+            )
+
+        if args.csv:
+            writer = csv.writer(sys.stdout)
+            writer.writerow(header)
+            writer.writerows(rows)
+        else:
+            sys.stdout.write(tabulate.tabulate(rows, header, tablefmt="plain"))
+            sys.stdout.write("\n")
+
+        changed = table.changed(new)
+        logging.info(
+            "{} of {} grades change when re-scored".format(
+                len(changed), len(table.summaries)
+            )
+        )
+
+        if args.apply:
+            for i in changed:
+                apply_rescore(table.summaries[i]["path"], course_obj, curve)
+
+    except Exception as e:
+        util.log_exception(e)
+        sys.exit(1)
+
+
+def parse_curve(spec):
+    """parse_curve
+
+    Parse a curve specification such as "sqrt,add:0.05,cap:1" into a list of
+    (step name, argument) tuples. Steps which take no argument have an
+    argument of None.
+
+    :param spec:
+    """
+
+    curve = []
+    for item in spec.split(","):
+        name, _, arg = item.strip().partition(":")
+        if name not in curve_steps:
+            raise exceptions.InvalidFile("unknown curve step '{}'".format(item))
+
+        if name == "sqrt":
+            curve.append((name, None))
+            continue
+
+        try:
+            curve.append((name, float(arg)))
+        except ValueError:
+            raise exceptions.InvalidFile(
+                "curve step '{}' needs a numeric argument".format(item)
+            )
+
+    return curve
+
+
+def apply_curve(curve, score):
+    """apply_curve
+
+    Apply each step of a curve, as returned by parse_curve(), to a score.
+
+    :param curve:
+    :param score:
+    """
+
+    for name, arg in curve:
+        score = curve_steps[name](score, arg)
+    return score
+
+
+def rescore_categories(grade, assignment):
+    """rescore_categories
+
+    Map the category marks of a summarized grade onto the categories of a
+    (possibly modified) assignment. Categories which are not in the assignment
+    are dropped, and categories which are new to the assignment are given full
+    marks, matching the convention used when loading grade files. Marks above
+    a (reduced) category maximum are lowered to it.
+
+    :param grade: the "grade" table of a PSF summary
+    :param assignment: course.Assignment
+    """
+
+    return {
+        name: min(
+            grade["categories"].get(name, assignment.categories[name]),
+            assignment.categories[name],
+        )
+        for name in assignment.categories
+    }
+
+
+class ScoreColumns:
+    """ScoreColumns
+
+    Collects the canonical grades of a collection of PSF summaries into one
+    grade.GradeTable per assignment (and rubric), such that the score of
+    every grade can be recomputed at once. Rows are kept in the order the
+    summaries were added.
+    """
+
+    def __init__(this):
+        this.summaries = []
+        this.old_scores = array.array("d")
+        this.tables = {}
+        this.rows = []
+
+    def add_summary(this, summary, course_obj=None):
+        """add_summary
+
+        Add the canonical grade of a summary from psf.load_summary(). Ungraded
+        summaries are ignored.
+
+        :param this:
+        :param summary:
+        :param course_obj: if not None, the categories of grades on
+        assignments of this course are re-scored against it with
+        rescore_categories().
+        """
+
+        grade_data = summary["grade"]
+        if grade_data is None:
+            return
+
+        assignment = None
+        if course_obj is not None and grade_data["course"] == course_obj.name:
+            if grade_data["assignment"] in course_obj.assignments:
+                assignment = course_obj.assignments[grade_data["assignment"]]
+            else:
+                logging.warning(
+                    "{}: assignment '{}' is not in the new course definition".format(
+                        summary["path"], grade_data["assignment"]
+                    )
+                )
+
+        if assignment is None:
+            assignment = course.Assignment(
+                None,
+                grade_data["assignment"],
+                grade_data["weight"],
+                dict(grade_data["max_categories"]),
+            )
+
+        key = (
+            grade_data["course"],
+            assignment.name,
+            tuple(sorted(assignment.categories.items())),
+        )
+        if key not in this.tables:
+            this.tables[key] = grade.GradeTable(assignment)
+
+        table = this.tables[key]
+        # summaries written before curves were stored have no curve_score
+        fields = {name: grade_data.get(name) for name in grade.GradeTable.fields}
+        row = table.add_data(
+            rescore_categories(grade_data, assignment),
+            grade_data["feedback"],
+            **fields
+        )
+
+        this.summaries.append(summary)
+        this.old_scores.append(grade_data["score"])
+        this.rows.append((key, row))
+
+    def scores(this, curve=[]):
+        """scores
+
+        Compute the score of every grade, in the order they were added. If a
+        curve is given, it replaces the curve adjustment of each grade, being
+        applied to its score without that adjustment. Grades with an override
+        are not curved.
+
+        :param this:
+        :param curve: as returned by parse_curve()
+        """
+
+        table_scores = {key: this.tables[key].scores() for key in this.tables}
+
+        scores = array.array("d", bytes(8 * len(this.rows)))
+        for i, (key, row) in enumerate(this.rows):
+            scores[i] = table_scores[key][row]
+
+            columns = this.tables[key].columns
+            if len(curve) > 0 and math.isnan(columns["override"][row]):
+                uncurved = scores[i] - columns["curve_score"][row]
+                scores[i] = apply_curve(curve, uncurved)
+
+        return scores
+
+    def changed(this, scores, tolerance=1e-9):
+        """changed
+
+        Return the indices of the grades whose score differs from the score
+        they were loaded with.
+
+        :param this:
+        :param scores: as returned by scores()
+        :param tolerance:
+        """
+
+        return [
+            i
+            for i in range(len(scores))
+            if abs(scores[i] - this.old_scores[i]) > tolerance
+        ]
+
+
+def apply_rescore(path, course_obj=None, curve=[]):
+    """apply_rescore
+
+    Write a re-scored grade to the PSF at path as a new grade revision.
+
+    :param path:
+    :param course_obj: if not None, and the grade is on an assignment of this
+    course, the new revision is graded against it, with categories mapped by
+    rescore_categories().
+    :param curve: as returned by parse_curve(), if not empty, the curve
+    adjustment of the new revision is replaced by this curve, see
+    ScoreColumns.scores()
+    """
+
+    logging.info("writing re-scored grade to {}".format(path))
+
+    # only the new grade revision is written, so the submitted files are
+    # copied into the saved archive without being decompressed
+    thepsf = psf.PSF()
+    thepsf.load_from_archive(path, lazy=True)
+    rev = thepsf.create_grade_revision()
+    grade_obj = rev.grade
+
+    assignment = grade_obj.assignment
+    if (
+        course_obj is not None
+        and assignment.course.name == course_obj.name
+        and assignment.name in course_obj.assignments
+    ):
+        new_assignment = course_obj.assignments[assignment.name]
+        grade_obj.categories = rescore_categories(
+            {"categories": grade_obj.categories}, new_assignment
+        )
+        grade_obj.assignment = new_assignment
+
+    if len(curve) > 0 and grade_obj.override is None:
+        grade_obj.curve_score = 0.0
+        uncurved = grade_obj.get_score()
+        grade_obj.curve_score = apply_curve(curve, uncurved) - uncurved
+
+    thepsf.save_to_archive(path)
@@ -0,0 +1,275 @@
+# Copyright 2019 Charles A Daniels
+# Distributed under the GNU AGPLv3 License (https://www.gnu.org/licenses/agpl.txt)
+
+import argparse
+import array
+import csv
+import logging
+import math
+import pathlib
+import sys
+import tabulate
+
+from . import constants
+from . import psf
+from . import util
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""
+This module computes summary statistics over collections of grades, grouped by
+assignment, by section, and by rubric category.
+"""
+
+stat_names = ["count", "mean", "std", "min", "p25", "median", "p75", "max"]
+
+
+def stats_cli(argv=None):
+    parser = argparse.ArgumentParser(
+        """
+A tool for computing grade statistics over collections of PSFs.
+"""
+    )
+
+    parser.add_argument("--version", action="version", version=constants.version)
+
+    parser.add_argument(
+        "--debug",
+        "-d",
+        action="store_true",
+        default=False,
+        help="Log debugging output to the console.",
+    )
+
+    parser.add_argument(
+        "--input",
+        "-i",
+        default="./**/*.psf",
+        help="Specify glob pattern to search for PSF files."
+        + " (default: **/*.psf)",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        default=None,
+        type=int,
+        help="Number of PSFs to load in parallel. (default: one per CPU)",
+    )
+
+    parser.add_argument(
+        "--histogram",
+        "-H",
+        default=False,
+        action="store_true",
+        help="Include a histogram of scores in 10 percentage point buckets "
+        + "from 0%% to 100%% (scores outside this range are clamped).",
+    )
+
+    parser.add_argument(
+        "--csv",
+        "-c",
+        default=False,
+        action="store_true",
+        help="Print output as comma-separated values",
+    )
+
+    args = None
+    if argv is not None:
+        args = parser.parse_args(argv)
+    else:
+        args = parser.parse_args()
+
+    if args.debug:
+        util.setup_logging(logging.DEBUG)
+    else:
+        util.setup_logging()
+
+    try:
+        paths = sorted(p for p in pathlib.Path().glob(args.input) if p.is_file())
+        columns = GradeColumns()
+        for summary in psf.load_summaries(paths, args.jobs):
+            columns.add_summary(summary)
+
+        logging.debug("computing statistics with numpy={}".format(numpy is not None))
+
+        header = ["SCOPE", "COURSE", "ASSIGNMENT", "NAME"] + [
+            s.upper() for s in stat_names
+        ]
+        if args.histogram:
+            header.append("HISTOGRAM")
+
+        rows = []
+        for scope, key, values in columns.groups():
+            stats = describe(values)
+            row = [scope] + list(key) + [stats[s] for s in stat_names]
+            if args.histogram:
+                row.append(" ".join(str(c) for c in histogram(values)))
+            rows.append(row)
+
+        if args.csv:
+            writer = csv.writer(sys.stdout)
+            writer.writerow(header)
+            writer.writerows(rows)
+        else:
+            sys.stdout.write(tabulate.tabulate(rows, header, tablefmt="plain"))
+            sys.stdout.write("\n")
+
+    except Exception as e:
+        util.log_exception(e)
+        sys.exit(1)
+
+
+class GradeColumns:
+    """GradeColumns
+
+    Collects the canonical scores of a collection of PSF summaries into
+    columns of floats, one per assignment, per section of each assignment, and
+    per rubric category of each assignment. Scores and category percentages
+    are stored in 0..1.
+    """
+
+    def __init__(this):
+        this.assignments = {}
+        this.sections = {}
+        this.categories = {}
+
+    def add_summary(this, summary):
+        """add_summary
+
+        Add the canonical grade of a summary from psf.load_summary(). Ungraded
+        summaries are ignored.
+
+        :param this:
+        :param summary:
+        """
+
+        grade = summary["grade"]
+        if grade is None:
+            return
+
+        key = (grade["course"], grade["assignment"])
+        section = summary["metadata"].get("section", "UNSPECIFIED")
+
+        column(this.assignments, key + ("",)).append(grade["score"])
+        column(this.sections, key + (section,)).append(grade["score"])
+
+        for name in grade["categories"]:
+            maximum = grade["max_categories"][name]
+            if maximum > 0:
+                column(this.categories, key + (name,)).append(
+                    grade["categories"][name] / maximum
+                )
+
+    def groups(this):
+        """groups
+
+        Generate (scope, key, values) tuples for every column, where scope is
+        one of "assignment", "section" or "category", and key is a tuple of
+        (course, assignment, name), where name is the section or category
+        name, or "" for the assignment scope.
+
+        :param this:
+        """
+
+        for scope, table in [
+            ("assignment", this.assignments),
+            ("section", this.sections),
+            ("category", this.categories),
+        ]:
+            # section metadata may be an integer in some PSFs and a string in
+            # others, which cannot be compared with each other
+            for key in sorted(table, key=lambda k: tuple(str(x) for x in k)):
+                yield scope, key, table[key]
+
+
+def column(table, key):
+    """column
+
+    Return the column for key in table, creating it if needed.
+
+    :param table:
+    :param key:
+    """
+
+    if key not in table:
+        table[key] = array.array("d")
+    return table[key]
+
+
+def describe(values):
+    """describe
+
+    Compute the statistics named in stat_names over a column of values,
+    using NumPy if it is available. Percentiles are linearly interpolated.
+
+    :param values: array or list of floats
+    """
+
+    if len(values) == 0:
+        return {s: None for s in stat_names}
+
+    if numpy is not None:
+        data = numpy.frombuffer(values, dtype=numpy.float64)
+        p25, median, p75 = numpy.percentile(data, [25, 50, 75])
+        return {
+            "count": len(data),
+            "mean": float(data.mean()),
+            "std": float(data.std()),
+            "min": float(data.min()),
+            "p25": float(p25),
+            "median": float(median),
+            "p75": float(p75),
+            "max": float(data.max()),
+        }
+
+    data = sorted(values)
+    count = len(data)
+    mean = math.fsum(data) / count
+    variance = math.fsum((x - mean) ** 2 for x in data) / count
+
+    return {
+        "count": count,
+        "mean": mean,
+        "std": math.sqrt(variance),
+        "min": data[0],
+        "p25": percentile(data, 25),
+        "median": percentile(data, 50),
+        "p75": percentile(data, 75),
+        "max": data[-1],
+    }
+
+
+def percentile(data, q):
+    """percentile
+
+    Linearly interpolated percentile of already sorted data, matching the
+    default behaviour of numpy.percentile().
+
+    :param data: sorted list of floats
+    :param q: percentile in 0..100
+    """
+
+    position = (len(data) - 1) * q / 100.0
+    lower = int(math.floor(position))
+    upper = min(lower + 1, len(data) - 1)
+    return data[lower] + (data[upper] - data[lower]) * (position - lower)
+
+
+def histogram(values, bins=10):
+    """histogram
+
+    Count values in bins equal-width buckets over 0..1. Values outside 0..1
+    are counted in the first or last bucket.
+
+    :param values:
+    :param bins:
+    """
+
+    counts = [0] * bins
+    for x in values:
+        counts[max(0, min(int(x * bins), bins - 1))] += 1
+    return counts
@@ -1,14 +1,24 @@
 # Copyright 2019 Charles A Daniels
 # Distributed under the GNU AGPLv3 License (https://www.gnu.org/licenses/agpl.txt)
 
+import collections
+import concurrent.futures
+import itertools
 import logging
 import os
 import pprint
 import pretor.exceptions
+import struct
 import sys
+import toml
 import traceback
 import zipfile
 
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
 
 def setup_logging(level=logging.INFO):
     logging.basicConfig(
@@ -25,6 +35,30 @@ def log_pretty(logfunc, obj):
     logfunc(pprint.pformat(obj))
 
 
+def toml_loads(data):
+    """toml_loads
+
+    Parse a TOML document, using the standard library tomllib module where it
+    is available (Python 3.11 and later), as it is considerably faster than
+    the toml package. Documents tomllib rejects are parsed again with the
+    toml package, which is more lenient, so that anything toml.dumps() has
+    ever written remains readable.
+
+    :param data: bytes or str
+    """
+
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+
+    if tomllib is not None:
+        try:
+            return tomllib.loads(data)
+        except tomllib.TOMLDecodeError as e:
+            logging.debug("tomllib failed, falling back to toml: {}".format(e))
+
+    return toml.loads(data)
+
+
 def compare_versions(v1, v2):
     """compare_versions
 
@@ -50,3 +84,118 @@ def compare_versions(v1, v2):
             return False
 
     return True
+
+
+def parallel_map(func, iterable, workers=None, processes=True):
+    """parallel_map
+
+    Apply func to each element of iterable using a pool of workers, and
+    yield the results in the same order as the input. Unlike
+    Executor.map(), only a bounded number of elements are submitted ahead of
+    the one currently being yielded, so memory use does not grow with the
+    length of the input.
+
+    If workers is 1, func is applied in the calling process.
+
+    Any exception raised by func is re-raised when the corresponding result
+    is reached.
+
+    :param func: function to apply, must be picklable if processes is True
+    :param iterable: input elements
+    :param workers: number of workers (default: one per CPU)
+    :param processes: use processes rather than threads as workers
+    """
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+
+    executor_type = concurrent.futures.ThreadPoolExecutor
+    if processes:
+        executor_type = concurrent.futures.ProcessPoolExecutor
+
+    iterator = iter(iterable)
+    with executor_type(max_workers=workers) as executor:
+        pending = collections.deque(
+            executor.submit(func, item)
+            for item in itertools.islice(iterator, workers * 4)
+        )
+
+        while len(pending) > 0:
+            result = pending.popleft().result()
+
+            for item in itertools.islice(iterator, 1):
+                pending.append(executor.submit(func, item))
+
+            yield result
+
+
+def copy_zip_member(source, name, dest, arcname):
+    """copy_zip_member
+
+    Copy the member name of the ZipFile source into the ZipFile dest as
+    arcname, without decompressing and recompressing it. The compressed
+    bytes, CRC and sizes are copied as-is, so this costs one read and one
+    write of the compressed data.
+
+    This relies on the internals of the zipfile module, in the same way as
+    ZipFile.writestr(): the local file header is written by ZipInfo, and the
+    new ZipInfo is registered with dest so that it is included in the central
+    directory when dest is closed.
+
+    :param source: ZipFile open for reading
+    :param name: name or ZipInfo of the member to copy
+    :param dest: ZipFile open for writing
+    :param arcname: name to give the member in dest
+    """
+
+    info = name
+    if not isinstance(name, zipfile.ZipInfo):
+        info = source.getinfo(name)
+
+    # skip over the local file header, whose extra field length may differ
+    # from the central directory's
+    source.fp.seek(info.header_offset)
+    header = struct.unpack(
+        zipfile.structFileHeader, source.fp.read(zipfile.sizeFileHeader)
+    )
+    if header[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(
+            "bad local file header for '{}'".format(info.filename)
+        )
+    source.fp.seek(
+        header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH],
+        os.SEEK_CUR,
+    )
+
+    zinfo = zipfile.ZipInfo(arcname, info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.external_attr = info.external_attr
+    zinfo.extract_version = max(zinfo.extract_version, info.extract_version)
+    zinfo.create_version = max(zinfo.create_version, info.create_version)
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+
+    with dest._lock:
+        zinfo.header_offset = dest.fp.tell()
+        dest.fp.write(zinfo.FileHeader())
+
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = source.fp.read(min(remaining, 1 << 20))
+            if len(chunk) == 0:
+                raise zipfile.BadZipFile(
+                    "truncated data for '{}'".format(info.filename)
+                )
+            dest.fp.write(chunk)
+            remaining -= len(chunk)
+
+        dest.filelist.append(zinfo)
+        dest.NameToInfo[zinfo.filename] = zinfo
+        dest.start_dir = dest.fp.tell()
+        dest._didModify = True
@@ -8,6 +8,7 @@ from . import psf
 from . import util
 
 import argparse
+import collections
 import csv
 import logging
 import pathlib
@@ -88,6 +89,14 @@ def xsvimport_cli(argv=None):
         help="Override the base revision (default: submission)",
     )
 
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        default=None,
+        type=int,
+        help="Number of PSFs to save in parallel. (default: one per CPU)",
+    )
+
     args = None
     if argv is not None:
         args = parser.parse_args(argv)
@@ -143,10 +152,11 @@ def xsvimport_cli(argv=None):
     logging.info("loaded {} records from input".format(len(xsv_data)))
 
     logging.debug("loading PSFs... ")
-    psf_collection = psf.load_collection(args.PSFs)
+    # only grade revisions are added, so the submitted files are never read,
+    # and are copied into the saved archives without being decompressed
+    psf_collection = psf.load_collection(args.PSFs, lazy=True)
     logging.info("loaded {} PSFs".format(len(psf_collection)))
 
-    metadata_keys = ["semester", "course", "section", "group", "assignment"]
     schema_keys = [k for k in metadata_keys if k in schema]
     if len(schema_keys) < 1:
         logging.error(
@@ -158,28 +168,27 @@ def xsvimport_cli(argv=None):
 
     logging.debug("loaded courses: {}".format(courses))
 
+    index = index_collection(psf_collection, schema_keys)
+    logging.debug(
+        "indexed PSFs by {} into {} distinct keys".format(schema_keys, len(index))
+    )
+
+    ambiguous = [key for key in index if len(index[key]) > 1]
+    if len(ambiguous) > 0:
+        logging.info(
+            "{} of {} distinct {} values match more than one PSF".format(
+                len(ambiguous), len(index), schema_keys
+            )
+        )
+
+    # group the records by the PSF they apply to, in input order, so that
+    # each PSF gets one grade revision and is written once
+    pending = collections.OrderedDict()
     for rec in xsv_data:
         logging.debug("attempting to apply record {}".format(rec))
 
         # select every PSF which matches this query
-        candidates = []
-        for psf_obj in psf_collection:
-
-            # we will match this PSF unless invalidate is tripped
-            invalidate = False
-            for key in schema_keys:
-
-                # check that it has the key
-                if key not in psf_obj.metadata:
-                    logging.warning("PSF {} missing key {}, ignoring".format(key))
-                    invalidate = True
-
-                #  check if they key matches
-                elif psf_obj.metadata[key] != rec[key]:
-                    invalidate = True
-
-            if not invalidate:
-                candidates.append(psf_obj)
+        candidates = index.get(record_key(rec, schema_keys), [])
 
         if len(candidates) < 1:
             logging.warning("Record '{}' matches no PSF, skipping".format(rec))
@@ -187,82 +196,180 @@ def xsvimport_cli(argv=None):
 
         elif len(candidates) > 1 and not args.force:
             logging.warning(
-                "Record '{}' matches multiple PSFs, refusing to import ambiguous record without --force"
-            ).format(rec)
+                (
+                    "Record '{}' matches {} PSFs, refusing to import "
+                    + "ambiguous record without --force"
+                ).format(rec, len(candidates))
+            )
             continue
 
-        # apply the record
         for psf_obj in candidates:
-            logging.debug("applying record '{}' to PSF '{}'".format(rec, psf_obj))
+            pending.setdefault(id(psf_obj), (psf_obj, []))[1].append(rec)
+
+    touched = []
+    for psf_obj, recs in pending.values():
+        if apply_records(psf_obj, recs, courses, args.baserev):
+            touched.append(psf_obj)
+
+    logging.info("saving {} PSFs".format(len(touched)))
+
+    # note that we get loaded_from from load_collection
+    failed = 0
+    for psf_obj, error in util.parallel_map(
+        save_psf, touched, args.jobs, processes=False
+    ):
+        if error is None:
+            logging.debug("saved {}".format(psf_obj.loaded_from))
+        else:
+            util.log_exception(error)
+            logging.error("failed to save {}".format(psf_obj.loaded_from))
+            failed += 1
+
+    if failed > 0:
+        logging.error("failed to save {} of {} PSFs".format(failed, len(touched)))
+        sys.exit(1)
 
-            course_obj = None
-            rev = None
 
-            # setup the revision
-            if psf_obj.is_graded():
-                rev = psf_obj.create_grade_revision()
-            else:
-                rev = psf_obj.create_revision("graded_0", args.baserev)
-
-            # setup the course so we can instantiate the grade
-            if "course" not in psf_obj.metadata:
-                logging.warning("PSF {} missing course, skipping it".format(psf_obj))
-                continue
-
-            elif psf_obj.metadata["course"] not in courses:
-                logging.warning(
-                    "PSF {} specifies unknown course {}, skipping it".format(
-                        psf_obj, psf_obj.metadata["course"]
-                    )
-                )
-                continue
+score_keys = [
+    "feedback",
+    "override",
+    "bonus_multiplier",
+    "bonus_marks",
+    "bonus_score",
+    "penalty_multiplier",
+    "penalty_marks",
+    "penalty_score",
+]
+
+metadata_keys = ["semester", "course", "section", "group", "assignment"]
+
+
+def apply_records(psf_obj, recs, courses, baserev="submission"):
+    """apply_records
+
+    Apply a list of grade records to a PSF as a single new grade revision.
+    The records are merged in order, so where several records set the same
+    field or category, the last one wins.
+
+    Returns True if the revision was created, or False if the PSF was
+    skipped because its course or assignment is not known.
+
+    :param psf_obj: PSF object
+    :param recs: list of grade records, as tables of schema fields
+    :param courses: table of course names to course.Course objects
+    :param baserev: revision to grade if the PSF is not yet graded
+    """
+
+    logging.debug("applying records {} to PSF '{}'".format(recs, psf_obj))
+
+    # setup the course so we can instantiate the grade
+    if "course" not in psf_obj.metadata:
+        logging.warning("PSF {} missing course, skipping it".format(psf_obj))
+        return False
+
+    elif psf_obj.metadata["course"] not in courses:
+        logging.warning(
+            "PSF {} specifies unknown course {}, skipping it".format(
+                psf_obj, psf_obj.metadata["course"]
+            )
+        )
+        return False
 
+    course_obj = courses[psf_obj.metadata["course"]]
+
+    # setup the assignment so we can instantiate the grade
+    if "assignment" not in psf_obj.metadata:
+        logging.warning("PSF {} missing assignment, skipping it".format(psf_obj))
+        return False
+
+    elif psf_obj.metadata["assignment"] not in course_obj.assignments:
+        logging.warning(
+            "PSF {} specifies unknown assignment '{}' for course '{}', skipping it".format(
+                psf_obj, psf_obj.metadata["assignment"], course_obj
+            )
+        )
+        return False
+
+    # generate data to load into the grade
+    grade_data = {"categories": {}}
+    for rec in recs:
+        for key in rec:
+            if key in score_keys:
+                grade_data[key] = rec[key]
+            elif key in metadata_keys:
+                pass
             else:
-                course_obj = courses[psf_obj.metadata["course"]]
+                grade_data["categories"][key] = rec[key]
 
-            # setup the assignment so we can instantiate the grade
-            if "assignment" not in psf_obj.metadata:
-                logging.warning(
-                    "PSF {} missing assignment, skipping it".format(psf_obj)
-                )
-                continue
+    # create the grade object
+    grade_obj = grade.Grade(course_obj.assignments[psf_obj.metadata["assignment"]])
+    grade_obj.load_data(grade_data)
 
-            elif psf_obj.metadata["assignment"] not in course_obj.assignments:
-                logging.warning(
-                    "PSF {} specifies unknown assignment '{}' for course '{}', skipping it".format(
-                        psf_obj, psf_obj.metadata["assignment"], course_obj
-                    )
-                )
-                continue
+    # setup the revision
+    if psf_obj.is_graded():
+        rev = psf_obj.create_grade_revision()
+    else:
+        rev = psf_obj.create_revision("graded_0", baserev)
+
+    # populate the revision with the grade
+    rev.grade = grade_obj
+
+    return True
+
+
+def save_psf(psf_obj):
+    """save_psf
+
+    Save a PSF back to the archive it was loaded from by load_collection().
+    Returns the tuple (psf_obj, error), where error is the exception raised
+    while saving, or None if the save succeeded, so that one failure does not
+    abort the remaining saves.
+
+    :param psf_obj:
+    """
+
+    try:
+        psf_obj.save_to_archive(psf_obj.loaded_from)
+    except Exception as e:
+        return (psf_obj, e)
+    return (psf_obj, None)
 
-            # create the grade object
-            grade_obj = grade.Grade(
-                course_obj.assignments[psf_obj.metadata["assignment"]]
+
+def record_key(rec, keys):
+    """record_key
+
+    Return the tuple of values of the given metadata keys, as used to index
+    PSFs and grade records against each other. Values are compared as
+    strings, since that is how they are read from the input.
+
+    :param rec: PSF metadata or grade record
+    :param keys: list of metadata keys
+    """
+
+    return tuple(str(rec[k]) for k in keys)
+
+
+def index_collection(psf_collection, keys):
+    """index_collection
+
+    Build a hashtable of record_key() tuples to the list of PSFs with that
+    key, so that each grade record can be matched with a single lookup. PSFs
+    which are missing any of the keys are left out of the index, with a
+    warning.
+
+    :param psf_collection: list of PSF objects
+    :param keys: list of metadata keys
+    """
+
+    index = {}
+    for psf_obj in psf_collection:
+        missing = [k for k in keys if k not in psf_obj.metadata]
+        if len(missing) > 0:
+            logging.warning(
+                "PSF {} missing key(s) {}, ignoring".format(psf_obj, ", ".join(missing))
             )
-            grade_data = {"categories": {}}
-            score_keys = [
-                "feedback",
-                "override",
-                "bonus_multiplier",
-                "bonus_marks",
-                "bonus_score",
-                "penalty_multiplier",
-                "penalty_marks",
-                "penalty_score",
-            ]
-
-            # generate data to load into the grade
-            for key in rec:
-                if key in score_keys:
-                    grade_data[key] = rec[key]
-                elif key in metadata_keys:
-                    pass
-                else:
-                    grade_data["categories"][key] = rec[key]
-            grade_obj.load_data(grade_data)
-
-            # populate the revision with the grade
-            rev.grade = grade_obj
-
-            # note that we get loaded_from from load_collection
-            psf_obj.save_to_archive(psf_obj.loaded_from)
+            continue
+
+        index.setdefault(record_key(psf_obj.metadata, keys), []).append(psf_obj)
+
+    return index
@@ -42,6 +42,8 @@ setup(name="pretor",
            'pretor-export=pretor.export:export_cli',
            'pretor-import=pretor.xsvimport:xsvimport_cli',
            'pretor-query=pretor.query:query_cli',
+           'pretor-stats=pretor.stats:stats_cli',
+           'pretor-rescore=pretor.rescore:rescore_cli',
            ]},
       package_dir={'pretor': 'pretor'},
       platforms=['POSIX'],
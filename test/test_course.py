@@ -0,0 +1,71 @@
+import unittest
+import tempfile
+import shutil
+import os
+import pathlib
+
+from pretor import course
+
+COURSE = """
+[course]
+name = "{}"
+
+[A1]
+name = "A1"
+weight = 1.0
+style = {}
+"""
+
+
+class TestCourse(unittest.TestCase):
+    def setUp(this):
+        this.test_dir = pathlib.Path(tempfile.mkdtemp())
+        (this.test_dir / "sub").mkdir()
+        this.write("abc.toml", "ABC123", 10)
+        this.write("sub/xyz.toml", "XYZ999", 20)
+        this.write("config.toml", None, 0)
+
+    def tearDown(this):
+        shutil.rmtree(str(this.test_dir))
+
+    def write(this, name, course_name, marks, mtime_ns=None):
+        path = this.test_dir / name
+        with open(str(path), "w") as f:
+            if course_name is None:
+                f.write('[settings]\nname = "not a course"\n')
+            else:
+                f.write(COURSE.format(course_name, marks))
+        if mtime_ns is not None:
+            os.utime(str(path), ns=(mtime_ns, mtime_ns))
+
+    def test_registry(this):
+        registry = course.load_courses([this.test_dir])
+        this.assertEqual(sorted(registry), ["ABC123", "XYZ999"])
+        this.assertIn("ABC123", registry)
+        this.assertNotIn("settings", registry)
+
+        abc = registry["ABC123"]
+        this.assertEqual(abc.assignments["A1"].categories, {"style": 10})
+        this.assertIs(registry["ABC123"], abc)
+
+        with this.assertRaises(KeyError):
+            registry["nope"]
+
+    def test_registry_refresh(this):
+        registry = course.CourseRegistry([this.test_dir])
+        this.assertEqual(registry.refresh(), [])
+
+        this.write("abc.toml", "ABC123", 30, mtime_ns=10 ** 18)
+        this.assertEqual(registry["ABC123"].assignments["A1"].categories["style"], 30)
+
+        os.remove(str(this.test_dir / "sub" / "xyz.toml"))
+        this.write("new.toml", "NEW100", 5)
+        this.assertEqual(registry.refresh(), ["NEW100", "XYZ999"])
+        this.assertEqual(sorted(registry), ["ABC123", "NEW100"])
+
+    def test_registry_reload(this):
+        registry = course.CourseRegistry([this.test_dir])
+        before = registry.scanned
+        this.assertEqual(registry.reload(), [])
+        this.assertIsNot(registry.scanned, before)
+        this.assertEqual(registry.scanned, before)
@@ -0,0 +1,209 @@
+import unittest
+import sys
+import tempfile
+import shutil
+import os
+import pathlib
+import json
+import io
+import zipfile
+
+from pretor import course
+from pretor import export
+from pretor import grade
+from pretor import psf
+
+
+def make_summary(section, group, score=None):
+    psf_obj = psf.PSF()
+    psf_obj.ID = group
+    psf_obj.metadata = {
+        "semester": "F19",
+        "course": "ABC123",
+        "section": section,
+        "group": group,
+        "assignment": "A1",
+    }
+    psf_obj.revisions["submission"] = psf.Revision(psf_obj, "submission")
+    if score is not None:
+        course_obj = course.load_course_definition(
+            {
+                "course": {"name": "ABC123"},
+                "A1": {"name": "A1", "weight": 1.0, "c": 100},
+            }
+        )
+        rev = psf_obj.create_revision("graded_0", "submission")
+        rev.grade = grade.Grade(course_obj.assignments["A1"])
+        rev.grade.categories["c"] = round(score * 100)
+        rev.grade.feedback = "ok"
+
+    # read back through the summary block, as psf.load_summary() does
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as f:
+        psf_obj.save_to_zipfile(f)
+    with zipfile.ZipFile(buf) as f:
+        pretor_data = psf.read_member(f, "pretor_data.toml")
+    return psf.summary_from_block(pretor_data, "{}.psf".format(group))
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(this):
+        this.test_dir = pathlib.Path(tempfile.mkdtemp())
+        this.summaries = [
+            make_summary("1", "g1", 0.5),
+            make_summary("2", "g2"),
+            make_summary("1", "g3", 1.0),
+        ]
+
+    def tearDown(this):
+        shutil.rmtree(str(this.test_dir))
+
+    def export(this, *specs):
+        writers = [export.make_writer(s) for s in specs]
+        for summary in this.summaries:
+            for writer in writers:
+                writer.write(summary)
+        for writer in writers:
+            writer.close()
+
+    def test_get_record(this):
+        this.assertEqual(
+            export.get_record(this.summaries[0]),
+            ["F19", "ABC123", "1", "g1", 50.0, "ok"],
+        )
+
+    def test_multiple_writers(this):
+        this.export(
+            "moodle:{}".format(this.test_dir / "all.csv"),
+            "jsonl:{}".format(this.test_dir / "all.jsonl"),
+            "sections:{}".format(this.test_dir / "sections"),
+        )
+
+        with open(str(this.test_dir / "all.csv")) as f:
+            this.assertEqual(len(f.readlines()), 4)  # ungraded has 2 lines
+
+        with open(str(this.test_dir / "all.jsonl")) as f:
+            records = [json.loads(line) for line in f]
+        this.assertEqual([r["group"] for r in records], ["g1", "g2", "g3"])
+
+        this.assertEqual(
+            sorted(os.listdir(str(this.test_dir / "sections"))),
+            ["F19-ABC123-1.csv", "F19-ABC123-2.csv"],
+        )
+        with open(str(this.test_dir / "sections" / "F19-ABC123-1.csv")) as f:
+            this.assertEqual(len(f.readlines()), 2)
+
+    def test_section_file_names(this):
+        this.summaries = [make_summary("../1", "g1", 0.5), make_summary("2 a/b", "g2")]
+        this.export("sections:{}".format(this.test_dir / "sections"))
+
+        this.assertEqual(
+            sorted(os.listdir(str(this.test_dir / "sections"))),
+            ["F19-ABC123-.._1.csv", "F19-ABC123-2_a_b.csv"],
+        )
+        this.assertEqual(sorted(os.listdir(str(this.test_dir))), ["sections"])
+        this.assertEqual(export.safe_name("Fall 2019/ü"), "Fall_2019__")
+
+    def test_unknown_format(this):
+        with this.assertRaises(KeyError):
+            export.make_writer("bogus:-")
+
+    def test_watermark(this):
+        path = this.test_dir / "watermark.toml"
+        this.assertEqual(export.load_watermark(path), {})
+
+        marks = {s["ID"]: export.grade_mark(s) for s in this.summaries}
+        export.save_watermark(path, marks)
+        this.assertEqual(export.load_watermark(path), marks)
+
+        regraded = make_summary("1", "g1", 0.75)
+        this.assertNotEqual(marks["g1"], export.grade_mark(regraded))
+
+    def test_watermark_pruned(this):
+        (this.test_dir / "psfs" / "copy").mkdir(parents=True)
+        (this.test_dir / "src").mkdir()
+        with open(str(this.test_dir / "src" / "foo.c"), "w") as f:
+            f.write("int main() {}\n")
+
+        for group in ["g1", "g2"]:
+            psf_obj = psf.PSF()
+            psf_obj.load_from_dir(str(this.test_dir / "src"), "submission")
+            psf_obj.metadata["group"] = group
+            psf_obj.save_to_archive(this.test_dir / "psfs" / (group + ".psf"))
+        shutil.copy(
+            str(this.test_dir / "psfs" / "g1.psf"),
+            str(this.test_dir / "psfs" / "copy" / "g1.psf"),
+        )
+
+        cwd = os.getcwd()
+        os.chdir(str(this.test_dir))
+        try:
+
+            def run(pattern, output):
+                export.export_cli(
+                    ["--input", pattern, "--output", "jsonl:" + output]
+                    + ["--since", "watermark.toml"]
+                )
+                return sorted(
+                    mark["path"]
+                    for mark in export.load_watermark("watermark.toml").values()
+                )
+
+            # copies of the same PSF are tracked separately
+            everything = sorted(
+                os.path.realpath(p)
+                for p in ["psfs/g1.psf", "psfs/g2.psf", "psfs/copy/g1.psf"]
+            )
+            this.assertEqual(run("psfs/**/*.psf", "all.jsonl"), everything)
+            with open("all.jsonl") as f:
+                this.assertEqual(len(f.readlines()), 3)
+
+            # a narrower export keeps the entries of the other PSFs
+            this.assertEqual(run("psfs/g1.psf", "g1.jsonl"), everything)
+            this.assertFalse(os.path.exists("g1.jsonl"))
+            run("psfs/**/*.psf", "again.jsonl")
+            this.assertFalse(os.path.exists("again.jsonl"))
+
+            # deleted PSFs are dropped, even if they are outside --input
+            os.remove(os.path.join("psfs", "g2.psf"))
+            this.assertEqual(
+                run("psfs/g1.psf", "g1.jsonl"), [everything[0], everything[1]]
+            )
+        finally:
+            os.chdir(cwd)
+
+    def test_roster(this):
+        path = this.test_dir / "roster.csv"
+        with open(str(path), "w") as f:
+            f.write("Student,Semester,Course,Section,Group\n")
+            f.write("alice,F19,ABC123,1,g1\n")
+            f.write("bob,F19,ABC123,1,g1\n")
+            f.write("carol,F19,ABC123,2,g2\n")
+            f.write("dave,F19,ABC123,3,g4\n")
+
+        roster = export.Roster()
+        roster.load(path)
+
+        records = []
+        for summary in this.summaries:
+            records += [export.get_record(r) for r in roster.expand(summary)]
+
+        this.assertEqual(
+            [r[3:6] for r in records],
+            [["g1", "alice", 50.0], ["g1", "bob", 50.0], ["g2", "carol", 0]],
+        )
+        this.assertEqual(
+            roster.unmatched_groups, [(("F19", "ABC123", "1", "g3"), "g3.psf")]
+        )
+        this.assertEqual(
+            roster.unmatched_students(), [(("F19", "ABC123", "3", "g4"), "dave")]
+        )
+
+    def test_roster_missing_column(this):
+        path = this.test_dir / "roster.csv"
+        with open(str(path), "w") as f:
+            f.write("semester,course,group,student\n")
+
+        with this.assertRaises(Exception):
+            export.Roster().load(path)
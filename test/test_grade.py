@@ -92,3 +92,56 @@ class TestGrade(unittest.TestCase):
         grade_obj.override = 123.456
         this.assertEqual(grade_obj.get_score(), 123.456)
 
+
+    def make_grades(this):
+        grades = []
+        for i, field in enumerate(
+            [
+                None,
+                "bonus_multiplier",
+                "bonus_marks",
+                "bonus_score",
+                "penalty_multiplier",
+                "penalty_marks",
+                "penalty_score",
+                "override",
+            ]
+        ):
+            grade_obj = grade.Grade(this.assignment)
+            grade_obj.categories["category1"] = 5 * i
+            grade_obj.feedback = "grade {}".format(i)
+            if field is not None:
+                setattr(grade_obj, field, 10 if field.endswith("marks") else 0.25)
+            grades.append(grade_obj)
+        return grades
+
+    def test_grade_table(this):
+        grades = this.make_grades()
+        table = grade.GradeTable.from_grades(this.assignment, grades)
+        expected = [g.get_score() for g in grades]
+
+        this.assertEqual(len(table), len(grades))
+        for score, e in zip(table.scores(), expected):
+            this.assertAlmostEqual(score, e)
+
+        numpy = grade.numpy
+        grade.numpy = None
+        try:
+            for score, e in zip(table.scores(), expected):
+                this.assertAlmostEqual(score, e)
+        finally:
+            grade.numpy = numpy
+
+        for original, copy in zip(grades, table.to_grades()):
+            this.assertEqual(copy.categories, original.categories)
+            this.assertEqual(copy.feedback, original.feedback)
+            this.assertEqual(copy.override, original.override)
+            this.assertEqual(copy.bonus_marks, original.bonus_marks)
+            this.assertEqual(copy.get_score(), original.get_score())
+
+    def test_grade_table_add_data(this):
+        table = grade.GradeTable(this.assignment)
+        table.add_data({"category1": 25}, penalty_score=0.25, override=None)
+        this.assertEqual(list(table.marks()), [75.0])
+        this.assertEqual(list(table.scores()), [0.5])
+        this.assertEqual(list(grade.GradeTable(this.assignment).scores()), [])
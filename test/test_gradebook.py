@@ -0,0 +1,68 @@
+import unittest
+import io
+import zipfile
+
+from pretor import course
+from pretor import grade
+from pretor import gradebook
+from pretor import psf
+
+
+def make_course():
+    return course.load_course_definition(
+        {
+            "course": {"name": "ABC123"},
+            "a1": {"name": "a1", "weight": 0.25, "c": 10},
+            "a2": {"name": "a2", "weight": 0.75, "c": 10},
+        }
+    )
+
+
+def make_summary(group, assignment=None, score=None):
+    psf_obj = psf.PSF()
+    psf_obj.ID = "{}-{}".format(group, assignment)
+    psf_obj.metadata = {
+        "semester": "F19",
+        "course": "ABC123",
+        "section": "1",
+        "group": group,
+    }
+    psf_obj.revisions["submission"] = psf.Revision(psf_obj, "submission")
+    if assignment is not None:
+        rev = psf_obj.create_revision("graded_0", "submission")
+        rev.grade = grade.Grade(make_course().assignments[assignment])
+        rev.grade.categories["c"] = round(score * 10)
+
+    # read back through the summary block, as psf.load_summary() does
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as f:
+        psf_obj.save_to_zipfile(f)
+    with zipfile.ZipFile(buf) as f:
+        pretor_data = psf.read_member(f, "pretor_data.toml")
+    return psf.summary_from_block(pretor_data, "{}.psf".format(group))
+
+
+class TestGradebook(unittest.TestCase):
+
+    def setUp(this):
+        this.book = gradebook.Gradebook(make_course())
+        this.book.add_summary(make_summary("g1", "a1", 1.0))
+        this.book.add_summary(make_summary("g1", "a2", 0.5))
+        this.book.add_summary(make_summary("g2", "a1", 0.8))
+        this.book.add_summary(make_summary("g3"))
+
+    def test_totals_zero(this):
+        this.assertEqual(list(this.book.totals("zero")), [0.625, 0.2, 0.0])
+
+    def test_totals_drop(this):
+        this.assertEqual(list(this.book.totals("drop")), [0.625, 0.8, 0.0])
+
+    def test_letters(this):
+        cutoffs = gradebook.parse_cutoffs("F=0,B=0.6,A=0.8")
+        this.assertEqual(this.book.letters([0.625, 0.8, 0.0], cutoffs), ["B", "A", "F"])
+
+    def test_other_course_ignored(this):
+        summary = make_summary("g4")
+        summary["metadata"]["course"] = "XYZ999"
+        this.assertFalse(this.book.add_summary(summary))
+        this.assertEqual(len(this.book.students), 3)
@@ -5,11 +5,30 @@ import shutil
 import os
 import pathlib
 import contextlib
+import datetime
 import io
 import logging
+import unittest.mock
+import zipfile
 
+from pretor import course
+from pretor import grade
 from pretor import psf
 
+
+def make_graded_psf(source_dir):
+    course_obj = course.load_embedded_course(
+        '[course]\nname = "ABC123"\n\n[A1]\nname = "A1"\nweight = 1.0\nstyle = 10\n'
+    )
+
+    thePSF = psf.PSF()
+    thePSF.load_from_dir(source_dir, "submission")
+    rev = thePSF.create_revision("graded_0", "submission")
+    rev.grade = grade.Grade(course_obj.assignments["A1"])
+    rev.grade.categories["style"] = 5
+    return thePSF
+
+
 class TestPSF(unittest.TestCase):
 
     def setUp(this):
@@ -35,3 +54,391 @@ class TestPSF(unittest.TestCase):
 
         rev = thePSF.revisions["AAAA"]
         this.assertEqual(rev.get_file("foo").get_data().decode("utf-8"), this.test_str)
+
+    def test_load_summary(this):
+        thePSF = psf.PSF()
+        thePSF.load_from_dir(this.test_dir, "submission")
+        thePSF.metadata["group"] = "E"
+        archive = os.path.join(this.test_out_dir, "test.psf")
+        thePSF.save_to_archive(archive)
+
+        header = psf.PSF()
+        header.load_from_archive(archive, header_only=True)
+        this.assertEqual(len(header.get_revision("submission").contents), 0)
+
+        summary = psf.load_summary(archive)
+        this.assertEqual(summary["ID"], thePSF.ID)
+        this.assertEqual(summary["metadata"]["group"], "E")
+        this.assertEqual(summary["revisions"], {"submission": None})
+        this.assertIsNone(summary["grade"])
+
+    def test_save_replaces_atomically(this):
+        thePSF = psf.PSF()
+        thePSF.load_from_dir(this.test_dir, "submission")
+        archive = os.path.join(this.test_out_dir, "test.psf")
+        thePSF.save_to_archive(archive)
+        os.chmod(archive, 0o640)
+        thePSF.create_revision("second", "submission")
+        thePSF.save_to_archive(archive)
+
+        this.assertEqual(os.listdir(this.test_out_dir), ["test.psf"])
+        this.assertEqual(os.stat(archive).st_mode & 0o777, 0o640)
+
+        collection = psf.load_collection([this.test_out_dir])
+        this.assertEqual(str(collection[0].loaded_from), archive)
+        this.assertIn("second", collection[0].revisions)
+
+    def test_lazy_load(this):
+        thePSF = psf.PSF()
+        thePSF.load_from_dir(this.test_dir, "submission")
+        archive = os.path.join(this.test_out_dir, "test.psf")
+        thePSF.save_to_archive(archive)
+
+        lazy = psf.PSF()
+        lazy.load_from_archive(archive, lazy=True)
+        fdata = lazy.get_revision("submission").get_file("foo")
+        this.assertIsNone(fdata.data)
+        this.assertEqual(fdata.get_data().decode("utf-8"), this.test_str)
+
+        rev = lazy.create_revision("second", "submission")
+        this.assertIsNone(rev.get_file("foo").data)
+        rev.put_file("bar", b"bar")
+        lazy.save_to_archive(archive)
+
+        this.assertEqual(
+            rev.get_file("foo").source,
+            (pathlib.Path(archive), "revisions/second/contents/foo"),
+        )
+
+        loaded = psf.PSF()
+        loaded.load_from_archive(archive)
+        second = loaded.get_revision("second")
+        this.assertEqual(second.get_file("foo").get_data().decode("utf-8"), this.test_str)
+        this.assertEqual(second.get_file("bar").get_data(), b"bar")
+
+    def test_save_copies_unchanged(this):
+        thePSF = psf.PSF()
+        thePSF.load_from_dir(this.test_dir, "submission")
+        thePSF.get_revision("submission").put_file("bar", b"bar")
+        archive = os.path.join(this.test_out_dir, "test.psf")
+        thePSF.save_to_archive(archive)
+
+        loaded = psf.PSF()
+        loaded.load_from_archive(archive)
+        rev = loaded.get_revision("submission")
+        this.assertEqual(
+            rev.get_file("foo").source,
+            (pathlib.Path(archive), "revisions/submission/contents/foo"),
+        )
+
+        # modify one file in place, without replacing its FileData
+        rev.get_file("bar").data.write(b"baz")
+
+        copied = []
+        copy_zip_member = psf.util.copy_zip_member
+
+        def record_copy(source, name, dest, arcname):
+            copied.append(arcname)
+            copy_zip_member(source, name, dest, arcname)
+
+        with unittest.mock.patch.object(psf.util, "copy_zip_member", record_copy):
+            loaded.save_to_archive(archive)
+
+        this.assertEqual(copied, ["revisions/submission/contents/foo"])
+
+        reloaded = psf.PSF()
+        reloaded.load_from_archive(archive)
+        rev = reloaded.get_revision("submission")
+        this.assertEqual(rev.get_file("foo").get_data().decode("utf-8"), this.test_str)
+        this.assertEqual(rev.get_file("bar").get_data(), b"barbaz")
+
+    def test_shared_course(this):
+        thePSF = make_graded_psf(this.test_dir)
+        archive = os.path.join(this.test_out_dir, "test.psf")
+        thePSF.save_to_archive(archive)
+
+        first = psf.PSF()
+        first.load_from_archive(archive, header_only=True)
+        second = psf.PSF()
+        second.load_from_archive(archive, header_only=True)
+        assignment = first.get_grade_rev().grade.assignment
+        this.assertIs(second.get_grade_rev().grade.assignment, assignment)
+
+        regrade = first.create_grade_revision()
+        this.assertIs(regrade.grade.assignment, assignment)
+        regrade.grade.categories["style"] = 10
+        this.assertEqual(first.get_revision("graded_0").grade.categories["style"], 5)
+
+    def test_course_stored_once(this):
+        thePSF = make_graded_psf(this.test_dir)
+        thePSF.create_grade_revision()
+        archive = os.path.join(this.test_out_dir, "test.psf")
+        thePSF.save_to_archive(archive)
+
+        with zipfile.ZipFile(archive) as f:
+            names = f.namelist()
+        course_obj = thePSF.get_grade_rev().grade.assignment.course
+        this.assertIn("courses/{}.toml".format(course_obj.digest()), names)
+        this.assertEqual(len([n for n in names if "course" in n]), 1)
+
+    def test_load_format_0(this):
+        course_data = '[course]\nname = "XYZ0"\n\n[A1]\nname = "A1"\nweight = 1.0\nstyle = 10\n'
+        archive = os.path.join(this.test_out_dir, "old.psf")
+        with zipfile.ZipFile(archive, "w") as f:
+            f.writestr("psf_format_revision", "0")
+            f.writestr(
+                "pretor_data.toml",
+                'ID = "x"\npretor_version = "0.0.4"\nrevisions = ["graded_0"]\n',
+            )
+            f.writestr(
+                "revisions/graded_0/rev_data.toml",
+                'ID = "graded_0"\ncontents = ["foo"]\n',
+            )
+            f.writestr(
+                "revisions/graded_0/grade.toml",
+                'assignment_name = "A1"\n[categories]\nstyle = 5\n',
+            )
+            f.writestr("revisions/graded_0/course.toml", course_data)
+            f.writestr("revisions/graded_0/contents/foo", this.test_str)
+
+        thePSF = psf.PSF()
+        thePSF.load_from_archive(archive)
+        this.assertEqual(thePSF.get_grade_rev().grade.get_score(), 0.5)
+        this.assertEqual(thePSF.get_grade_rev().grade.assignment.course.name, "XYZ0")
+        this.assertIsNone(psf.validate_summary(archive))
+
+    def test_write_scorecards(this):
+        ungraded = psf.PSF()
+        ungraded.load_from_dir(this.test_dir, "submission")
+        ungraded.save_to_archive(os.path.join(this.test_out_dir, "a.psf"))
+        thePSF = make_graded_psf(this.test_dir)
+        thePSF.save_to_archive(os.path.join(this.test_out_dir, "b.psf"))
+
+        paths = psf.expand_inputs(this.test_out_dir)
+        this.assertEqual([p.name for p in paths], ["a.psf", "b.psf"])
+        this.assertEqual(
+            psf.expand_inputs(os.path.join(this.test_out_dir, "b*")), paths[1:]
+        )
+
+        cards = os.path.join(this.test_out_dir, "cards")
+        this.assertEqual(psf.write_scorecards(paths, destination=cards, workers=1), 0)
+        this.assertEqual(os.listdir(cards), ["b.txt"])
+        scorecard = thePSF.get_grade_rev().grade.generate_scorecard()
+        with open(os.path.join(cards, "b.txt")) as f:
+            this.assertEqual(f.read(), scorecard)
+
+        this.assertEqual(
+            psf.write_scorecards(paths, "graded_0", cards, workers=1), 1
+        )
+
+        # PSFs sharing a name are written relative to their common directory
+        same_names = []
+        for d in ["x", "y"]:
+            os.mkdir(os.path.join(this.test_out_dir, d))
+            same_names.append(os.path.join(this.test_out_dir, d, "b.psf"))
+            shutil.copy(str(paths[1]), same_names[-1])
+
+        cards = os.path.join(this.test_out_dir, "same_names")
+        this.assertEqual(psf.write_scorecards(same_names, destination=cards), 0)
+        this.assertEqual(sorted(os.listdir(cards)), ["x", "y"])
+        this.assertEqual(os.listdir(os.path.join(cards, "y")), ["b.txt"])
+
+        with this.assertRaises(ValueError):
+            psf.output_names([paths[1], str(paths[1]).replace(".psf", "")])
+
+    def test_sidecars(this):
+        thePSF = make_graded_psf(this.test_dir)
+        thePSF.metadata["group"] = "E"
+
+        plain = os.path.join(this.test_out_dir, "plain.psf")
+        thePSF.save_to_archive(plain)
+        thePSF.sidecars = True
+        sidecars = os.path.join(this.test_out_dir, "sidecars.psf")
+        thePSF.save_to_archive(sidecars)
+
+        with zipfile.ZipFile(plain) as f:
+            this.assertEqual(f.read("psf_format_revision"), b"1")
+            this.assertNotIn("pretor_data.json", f.namelist())
+        with zipfile.ZipFile(sidecars) as f:
+            this.assertEqual(f.read("psf_format_revision"), b"2")
+            this.assertIn("pretor_data.json", f.namelist())
+            this.assertIn("revisions/graded_0/rev_data.json", f.namelist())
+            this.assertIn("revisions/graded_0/rev_data.toml", f.namelist())
+
+        expected = psf.load_summary(plain)
+        del expected["path"], expected["metadata"]["archive_name"]
+        for archive in [plain, sidecars]:
+            for tomllib in [psf.util.tomllib, None]:
+                with unittest.mock.patch.object(psf.util, "tomllib", tomllib):
+                    summary = psf.load_summary(archive)
+                del summary["path"], summary["metadata"]["archive_name"]
+                this.assertEqual(summary, expected)
+
+        reloaded = psf.PSF()
+        reloaded.load_from_archive(sidecars)
+        this.assertTrue(reloaded.sidecars)
+
+    def test_format_revision(this):
+        thePSF = psf.PSF()
+        thePSF.load_from_dir(this.test_dir, "submission")
+        archive = os.path.join(this.test_out_dir, "test.psf")
+        thePSF.save_to_archive(archive)
+
+        # without course definitions or sidecars, PSFs stay readable by
+        # releases which only know format revision 0
+        with zipfile.ZipFile(archive) as f:
+            this.assertEqual(f.read("psf_format_revision"), b"0")
+
+        reloaded = psf.PSF()
+        reloaded.load_from_archive(archive)
+        this.assertEqual(reloaded.ID, thePSF.ID)
+
+    def test_read_member(this):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as f:
+            f.writestr("x/a.toml", 'a = "toml"\n')
+            f.writestr("x/a.json", '{"a": "json"}')
+
+        # since format revision 2, the sidecar is read in preference to the
+        # TOML member
+        with zipfile.ZipFile(buf) as f:
+            this.assertEqual(psf.read_member(f, "x/a.toml"), {"a": "json"})
+            this.assertEqual(psf.read_member(f, "x/a.toml", 1), {"a": "toml"})
+            with this.assertRaises(KeyError):
+                psf.read_member(f, "x/b.toml")
+
+    def test_sidecar_skipped(this):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as f:
+            psf.write_member(f, "a.toml", {"a": 1}, sidecar=True)
+            psf.write_member(f, "b.toml", {"b": datetime.date(2019, 1, 1)}, True)
+
+        with zipfile.ZipFile(buf) as f:
+            this.assertEqual(f.namelist(), ["a.toml", "a.json", "b.toml"])
+            this.assertEqual(psf.read_member(f, "a.toml"), {"a": 1})
+            this.assertEqual(
+                psf.read_member(f, "b.toml"), {"b": datetime.date(2019, 1, 1)}
+            )
+
+    def test_summary_block(this):
+        thePSF = make_graded_psf(this.test_dir)
+        archive = os.path.join(this.test_out_dir, "test.psf")
+        thePSF.save_to_archive(archive)
+
+        header = psf.PSF()
+        header.load_from_archive(archive, header_only=True)
+        expected = header.summarize()
+        this.assertEqual(
+            expected["files"],
+            {
+                "submission": {"count": 1, "size": len(this.test_str)},
+                "graded_0": {"count": 1, "size": len(this.test_str)},
+            },
+        )
+
+        with unittest.mock.patch.object(psf.PSF, "load_from_zipfile") as load:
+            this.assertEqual(psf.load_summary(archive), expected)
+            load.assert_not_called()
+        this.assertEqual(psf.validate_summary(archive), [])
+
+        # change the grade behind the summary's back
+        tampered = os.path.join(this.test_out_dir, "tampered.psf")
+        with zipfile.ZipFile(archive) as src, zipfile.ZipFile(tampered, "w") as dst:
+            for info in src.infolist():
+                data = src.read(info)
+                if info.filename == "revisions/graded_0/grade.toml":
+                    data = data.replace(b"style = 5", b"style = 10")
+                dst.writestr(info, data)
+
+        this.assertEqual(
+            psf.validate_summary(tampered), ["grade.score", "grade.categories"]
+        )
+
+    def test_run_batch(this):
+        thePSF = psf.PSF()
+        thePSF.load_from_dir(this.test_dir, "submission")
+        first = os.path.join(this.test_out_dir, "a.psf")
+        thePSF.save_to_archive(first)
+        thePSF.create_revision("graded_0", "submission")
+        second = os.path.join(this.test_out_dir, "b.psf")
+        thePSF.save_to_archive(second)
+
+        options = {"revid": "submission", "diff": None, "destination": None}
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            failed = psf.run_batch([first, second], "lsrev", options, workers=2)
+        this.assertEqual(failed, 0)
+        this.assertEqual(
+            out.getvalue(),
+            "==> {} <==\nsubmission\n\n==> {} <==\nsubmission\ngraded_0\n\n".format(
+                first, second
+            ),
+        )
+
+        options["revid"] = "graded_0"
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            failed = psf.run_batch([first, second], "manifest", options, workers=1)
+        this.assertEqual(failed, 1)
+        this.assertEqual(out.getvalue(), "==> {} <==\nfoo\n\n".format(second))
+
+        options["destination"] = os.path.join(this.test_out_dir, "extracted")
+        this.assertEqual(psf.run_batch([second], "extract", options, workers=1), 0)
+        with open(os.path.join(options["destination"], "b", "foo")) as f:
+            this.assertEqual(f.read(), this.test_str)
+
+        # PSFs sharing a name are extracted relative to their common directory
+        same_names = []
+        for d in ["x", "y"]:
+            os.mkdir(os.path.join(this.test_out_dir, d))
+            same_names.append(os.path.join(this.test_out_dir, d, "b.psf"))
+            shutil.copy(second, same_names[-1])
+
+        options["destination"] = os.path.join(this.test_out_dir, "same_names")
+        this.assertEqual(psf.run_batch(same_names, "extract", options, workers=2), 0)
+        for d in ["x", "y"]:
+            with open(os.path.join(options["destination"], d, "b", "foo")) as f:
+                this.assertEqual(f.read(), this.test_str)
+
+    def test_verify_archive(this):
+        thePSF = make_graded_psf(this.test_dir)
+        thePSF.sidecars = True
+        archive = os.path.join(this.test_out_dir, "test.psf")
+        thePSF.save_to_archive(archive)
+
+        report = psf.verify_archive(archive)
+        this.assertEqual(
+            report, {"path": archive, "ok": True, "errors": [], "warnings": []}
+        )
+
+        # rewrite the archive, replacing the contents of some members
+        def tamper(name, replace):
+            path = os.path.join(this.test_out_dir, name)
+            with zipfile.ZipFile(archive) as src, zipfile.ZipFile(path, "w") as dst:
+                for info in src.infolist():
+                    dst.writestr(info, replace.get(info.filename, src.read(info)))
+                dst.writestr("extra", b"")
+                dst.comment = src.comment
+            return psf.verify_archive(path)
+
+        course_obj = thePSF.get_grade_rev().grade.assignment.course
+        course_member = "courses/{}.toml".format(course_obj.digest())
+        sidecar_member = "revisions/graded_0/rev_data.json"
+        with zipfile.ZipFile(archive) as f:
+            sidecar = b'{"x":1,' + f.read(sidecar_member)[1:]
+        report = tamper(
+            "tampered.psf",
+            {course_member: course_obj.dump_string() + "\n", sidecar_member: sidecar},
+        )
+        this.assertFalse(report["ok"])
+        this.assertEqual(len(report["errors"]), 2)
+        this.assertIn(course_member, report["errors"][0])
+        this.assertIn("rev_data.json does not match", report["errors"][1])
+        this.assertEqual(report["warnings"], ["unreferenced member extra"])
+
+        truncated = os.path.join(this.test_out_dir, "truncated.psf")
+        with open(archive, "rb") as src, open(truncated, "wb") as dst:
+            dst.write(src.read(100))
+        report = psf.verify_archive(truncated)
+        this.assertFalse(report["ok"])
+        this.assertIn("BadZipFile", report["errors"][0])
@@ -0,0 +1,304 @@
+import unittest
+import sys
+import tempfile
+import shutil
+import os
+import pathlib
+import sqlite3
+import socket
+import json
+import stat
+import threading
+import unittest.mock
+
+from pretor import course
+from pretor import grade
+from pretor import psf
+from pretor import query
+
+
+class TestQuery(unittest.TestCase):
+
+    def setUp(this):
+        this.test_dir = tempfile.mkdtemp()
+        this.test_out_dir = tempfile.mkdtemp()
+        with open(os.path.join(this.test_dir, "foo.c"), 'w') as f:
+            f.write("int main() {\n\tgets(buf);\n}\n")
+
+        thePSF = psf.PSF()
+        thePSF.load_from_dir(this.test_dir, "submission")
+        this.archive = os.path.join(this.test_out_dir, "test.psf")
+        thePSF.save_to_archive(this.archive)
+
+        this.pool = query.ArchivePool(size=1)
+        this.db = sqlite3.connect(":memory:")
+        query.register_functions(this.db, this.pool)
+
+    def tearDown(this):
+        this.pool.close()
+        this.db.close()
+        shutil.rmtree(this.test_dir)
+        shutil.rmtree(this.test_out_dir)
+
+    def scalar(this, sql, *args):
+        return this.db.execute(sql, args).fetchone()[0]
+
+    def test_psf_file(this):
+        this.assertEqual(
+            this.scalar("SELECT psf_file(?, 'submission', 'foo.c')", this.archive),
+            "int main() {\n\tgets(buf);\n}\n",
+        )
+        this.assertIsNone(
+            this.scalar("SELECT psf_file(?, 'submission', 'bar.c')", this.archive)
+        )
+
+    def test_psf_bad_archive(this):
+        bad = os.path.join(this.test_out_dir, "bad.psf")
+        with open(bad, "w") as f:
+            f.write("not a zip file")
+
+        this.assertIsNone(this.scalar("SELECT psf_file(?, 'submission', 'foo.c')", bad))
+        this.assertIsNone(
+            this.scalar("SELECT psf_file_size(?, 'submission', 'foo.c')", bad)
+        )
+        this.assertIsNone(this.scalar("SELECT psf_grep(?, 'submission', 'x')", bad))
+
+    def test_psf_grep_bad_pattern(this):
+        with this.assertRaises(ValueError):
+            query.compile_pattern("gets(")
+        with this.assertRaises(sqlite3.OperationalError):
+            this.scalar("SELECT psf_grep(?, 'submission', 'gets(')", this.archive)
+
+    def test_psf_file_size(this):
+        this.assertEqual(
+            this.scalar("SELECT psf_file_size(?, 'submission', 'foo.c')", this.archive),
+            27,
+        )
+
+    def test_psf_grep(this):
+        this.assertEqual(
+            this.scalar("SELECT psf_grep(?, 'submission', 'gets\\(')", this.archive),
+            "foo.c:2:\tgets(buf);",
+        )
+        this.assertIsNone(
+            this.scalar("SELECT psf_grep(?, 'submission', 'printf')", this.archive)
+        )
+
+    def test_psf_scorecard_ungraded(this):
+        this.assertIsNone(this.scalar("SELECT psf_scorecard(?)", this.archive))
+
+    def test_pool_reuses_handles(this):
+        first = this.pool.get(this.archive)
+        this.assertIs(this.pool.get(this.archive), first)
+        this.assertEqual(len(this.pool.handles), 1)
+
+    def test_catalog_refresh(this):
+        cwd = os.getcwd()
+        os.chdir(this.test_out_dir)
+        try:
+            db = query.build_database("**/*.psf", "catalog.db", fts=True)
+            db.close()
+
+            db = sqlite3.connect("catalog.db")
+            added, removed = query.refresh_catalog(db, "**/*.psf", fts=True)
+            this.assertEqual((added, removed), ([], []))
+            this.assertEqual(
+                db.execute(
+                    "SELECT file FROM psf_text WHERE content LIKE '%gets(%'"
+                ).fetchall(),
+                [("foo.c",)],
+            )
+
+            # the same PSFs seen from another working directory are not reloaded
+            os.chdir(os.path.dirname(this.test_out_dir))
+            moved = os.path.join(os.path.basename(this.test_out_dir), "test.psf")
+            added, removed = query.refresh_catalog(
+                db, os.path.join(os.path.basename(this.test_out_dir), "*.psf"), fts=True
+            )
+            this.assertEqual((added, removed), ([], []))
+            for table in ["psf", "psf_text", "catalog_files"]:
+                this.assertEqual(
+                    db.execute(
+                        "SELECT DISTINCT {} FROM {}".format(
+                            "display_path" if table == "catalog_files" else "path",
+                            table,
+                        )
+                    ).fetchall(),
+                    [(moved,)],
+                )
+            os.chdir(this.test_out_dir)
+            added, removed = query.refresh_catalog(db, "**/*.psf", fts=True)
+            this.assertEqual((added, removed), ([], []))
+
+            os.remove(this.archive)
+            added, removed = query.refresh_catalog(db, "**/*.psf", fts=True)
+            this.assertEqual((added, removed), ([], ["test.psf"]))
+            this.assertEqual(db.execute("SELECT COUNT(*) FROM psf").fetchone()[0], 0)
+            this.assertEqual(
+                db.execute("SELECT COUNT(*) FROM psf_text").fetchone()[0], 0
+            )
+            db.close()
+        finally:
+            os.chdir(cwd)
+
+    def test_catalog_enable_fts(this):
+        cwd = os.getcwd()
+        os.chdir(this.test_out_dir)
+        try:
+            db = query.build_database("**/*.psf", "catalog.db")
+            db.close()
+
+            db = query.build_database("**/*.psf", "catalog.db", fts=True)
+            for table in ["psf", "psf_text", "catalog_files"]:
+                this.assertEqual(
+                    db.execute("SELECT COUNT(*) FROM {}".format(table)).fetchone()[0],
+                    1,
+                )
+            this.assertEqual(
+                db.execute("SELECT total, ungraded FROM ungraded_counts").fetchall(),
+                [(1, 1)],
+            )
+            db.close()
+        finally:
+            os.chdir(cwd)
+
+    def test_query_server(this):
+        cwd = os.getcwd()
+        os.chdir(this.test_out_dir)
+        try:
+            server = query.QueryServer("query.sock", "**/*.psf")
+            this.assertEqual(
+                server.query("SELECT filename FROM psf"),
+                {"columns": ["filename"], "rows": [("test.psf",)]},
+            )
+            this.assertIn("error", server.query("SELECT bogus"))
+            server.db.close()
+        finally:
+            os.chdir(cwd)
+
+    def test_query_server_refresh(this):
+        cwd = os.getcwd()
+        os.chdir(this.test_out_dir)
+        try:
+            server = query.QueryServer("query.sock", "**/*.psf")
+            shutil.copy("test.psf", "test2.psf")
+
+            # the library is scanned while queries can still be answered
+            scan_library = query.scan_library
+            unlocked = []
+
+            def scan(*args):
+                unlocked.append(server.lock.acquire(blocking=False))
+                if unlocked[-1]:
+                    server.lock.release()
+                server.stopped.set()
+                return scan_library(*args)
+
+            with unittest.mock.patch.object(query, "scan_library", scan):
+                server.refresh(0)
+
+            this.assertEqual(unlocked, [True])
+            this.assertEqual(
+                server.query("SELECT filename FROM psf ORDER BY filename")["rows"],
+                [("test.psf",), ("test2.psf",)],
+            )
+            server.db.close()
+        finally:
+            os.chdir(cwd)
+
+    def test_query_server_socket(this):
+        cwd = os.getcwd()
+        os.chdir(this.test_out_dir)
+        try:
+            server = query.QueryServer("query.sock", "**/*.psf")
+            sockserver = server.create_server()
+            thread = threading.Thread(target=sockserver.serve_forever)
+            thread.start()
+            try:
+                this.assertEqual(stat.S_IMODE(os.stat("query.sock").st_mode), 0o600)
+
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect("query.sock")
+                    stream = sock.makefile("rw")
+                    responses = []
+                    for sql in [
+                        "SELECT filename FROM psf",
+                        "DELETE FROM psf",
+                        "ATTACH DATABASE 'other.db' AS other",
+                    ]:
+                        stream.write(json.dumps({"query": sql}) + "\n")
+                        stream.flush()
+                        responses.append(json.loads(stream.readline()))
+
+                this.assertEqual(
+                    responses[0], {"columns": ["filename"], "rows": [["test.psf"]]}
+                )
+                this.assertIn("error", responses[1])
+                this.assertIn("error", responses[2])
+                this.assertFalse(os.path.exists("other.db"))
+                this.assertEqual(
+                    server.query("SELECT count(*) FROM psf")["rows"], [(1,)]
+                )
+            finally:
+                sockserver.shutdown()
+                sockserver.server_close()
+                thread.join()
+                server.db.close()
+        finally:
+            os.chdir(cwd)
+
+    def test_report_views(this):
+        cwd = os.getcwd()
+        os.chdir(this.test_out_dir)
+        try:
+            shutil.copy("test.psf", "test2.psf")
+            db = query.build_database("**/*.psf")
+            this.assertEqual(
+                db.execute("SELECT total, ungraded FROM ungraded_counts").fetchall(),
+                [(2, 2)],
+            )
+
+            os.remove("test2.psf")
+            query.refresh_catalog(db, "**/*.psf")
+            this.assertEqual(
+                db.execute("SELECT total, ungraded FROM ungraded_counts").fetchall(),
+                [(1, 1)],
+            )
+
+            os.remove("test.psf")
+            query.refresh_catalog(db, "**/*.psf")
+            this.assertEqual(
+                db.execute("SELECT COUNT(*) FROM ungraded_counts").fetchone()[0], 0
+            )
+            db.close()
+        finally:
+            os.chdir(cwd)
+
+    def test_category_means(this):
+        course_obj = course.load_embedded_course(
+            '[course]\nname = "ABC123"\n\n[A1]\nname = "A1"\nweight = 1.0\nstyle = 10\n'
+        )
+
+        cwd = os.getcwd()
+        os.chdir(this.test_out_dir)
+        try:
+            os.remove("test.psf")
+            for name, marks in [("a.psf", 7), ("b.psf", 8)]:
+                thePSF = psf.PSF()
+                thePSF.load_from_dir(this.test_dir, "submission")
+                rev = thePSF.create_revision("graded_0", "submission")
+                rev.grade = grade.Grade(course_obj.assignments["A1"])
+                rev.grade.categories["style"] = marks
+                thePSF.save_to_archive(name)
+
+            db = query.build_database("**/*.psf")
+            this.assertEqual(
+                db.execute(
+                    "SELECT count, mean_marks, max_marks, mean_percent "
+                    + "FROM category_means"
+                ).fetchall(),
+                [(2, 7.5, 10.0, 0.75)],
+            )
+            db.close()
+        finally:
+            os.chdir(cwd)
@@ -0,0 +1,138 @@
+import unittest
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+
+from pretor import course
+from pretor import grade
+from pretor import psf
+from pretor import rescore
+
+
+def make_course(style=30):
+    return course.load_course_definition(
+        {
+            "course": {"name": "ABC123"},
+            "A1": {"name": "A1", "weight": 1.0, "correctness": 70, "style": style},
+        }
+    )
+
+
+def make_summary(group, correctness, style, override=None):
+    psf_obj = psf.PSF()
+    psf_obj.ID = group
+    psf_obj.metadata = {"course": "ABC123", "assignment": "A1", "group": group}
+    psf_obj.revisions["submission"] = psf.Revision(psf_obj, "submission")
+    rev = psf_obj.create_revision("graded_0", "submission")
+    rev.grade = grade.Grade(make_course().assignments["A1"])
+    rev.grade.categories = {"correctness": correctness, "style": style}
+    rev.grade.override = override
+
+    # read back through the summary block, as psf.load_summary() does
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as f:
+        psf_obj.save_to_zipfile(f)
+    with zipfile.ZipFile(buf) as f:
+        pretor_data = psf.read_member(f, "pretor_data.toml")
+    return psf.summary_from_block(pretor_data, "{}.psf".format(group))
+
+
+class TestRescore(unittest.TestCase):
+    def setUp(this):
+        this.course = make_course(style=60)
+        this.summaries = [
+            make_summary("g1", 70, 30),
+            make_summary("g2", 35, 15),
+            make_summary("g3", 0, 0, override=0.9),
+        ]
+
+    def columns(this, course_obj=None):
+        table = rescore.ScoreColumns()
+        for summary in this.summaries:
+            table.add_summary(summary, course_obj)
+        table.add_summary({"path": "g4.psf", "grade": None})
+        return table
+
+    def test_parse_curve(this):
+        this.assertEqual(
+            rescore.parse_curve("sqrt, add:0.05,cap:1"),
+            [("sqrt", None), ("add", 0.05), ("cap", 1.0)],
+        )
+        with this.assertRaises(Exception):
+            rescore.parse_curve("bogus")
+        with this.assertRaises(Exception):
+            rescore.parse_curve("add:x")
+
+    def test_apply_curve(this):
+        curve = rescore.parse_curve("sqrt,add:0.1,cap:1")
+        this.assertAlmostEqual(rescore.apply_curve(curve, 0.64), 0.9)
+        this.assertAlmostEqual(rescore.apply_curve(curve, 0.95), 1.0)
+
+    def test_unchanged(this):
+        table = this.columns()
+        this.assertEqual(list(table.scores()), [1.0, 0.5, 0.9])
+        this.assertEqual(table.changed(table.scores()), [])
+
+    def test_course(this):
+        table = this.columns(this.course)
+        this.assertEqual(list(table.scores()), [100 / 130, 50 / 130, 0.9])
+        this.assertEqual(table.changed(table.scores()), [0, 1])
+
+    def test_curve(this):
+        table = this.columns()
+        scores = table.scores(rescore.parse_curve("scale:0.5"))
+        this.assertEqual(list(scores), [0.5, 0.25, 0.9])
+
+        # a curve replaces the adjustment of a previous curve
+        this.summaries[1]["grade"]["curve_score"] = -0.25
+        this.summaries[1]["grade"]["score"] = 0.25
+        table = this.columns()
+        scores = table.scores(rescore.parse_curve("scale:0.5"))
+        this.assertEqual(list(scores), [0.5, 0.25, 0.9])
+        this.assertEqual(table.changed(scores), [0])
+
+    def test_reduced_maximum(this):
+        assignment = course.Assignment(
+            None, "A1", 1.0, {"correctness": 70, "style": 20}
+        )
+        this.assertEqual(
+            rescore.rescore_categories(this.summaries[0]["grade"], assignment),
+            {"correctness": 70, "style": 20},
+        )
+
+    def test_apply_rescore(this):
+        test_dir = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(test_dir, "foo.c"), "w") as f:
+                f.write("int main() {}\n")
+
+            thePSF = psf.PSF()
+            thePSF.load_from_dir(test_dir, "submission")
+            rev = thePSF.create_revision("graded_0", "submission")
+            rev.grade = grade.Grade(this.course.assignments["A1"])
+            rev.grade.categories = {"correctness": 35, "style": 30}
+            archive = os.path.join(test_dir, "test.psf")
+            thePSF.save_to_archive(archive)
+
+            curve = rescore.parse_curve("add:0.1")
+            for expected_revs in [3, 4]:
+                rescore.apply_rescore(archive, curve=curve)
+                thePSF = psf.PSF()
+                thePSF.load_from_archive(archive)
+                this.assertEqual(len(thePSF.revisions), expected_revs)
+                grade_obj = thePSF.get_grade_rev().grade
+                this.assertIsNone(grade_obj.override)
+                this.assertAlmostEqual(grade_obj.curve_score, 0.1)
+                this.assertAlmostEqual(grade_obj.get_score(), 0.6)
+                this.assertNotIn("OVERRIDDEN", grade_obj.generate_scorecard())
+                this.assertIn(
+                    "CURVE ADJUSTMENT: +10.00%", grade_obj.generate_scorecard()
+                )
+
+            # category regrades still apply to a curved grade
+            grade_obj.categories["style"] = 0
+            this.assertAlmostEqual(grade_obj.get_score(), 35 / 130 + 0.1)
+        finally:
+            shutil.rmtree(test_dir)
@@ -0,0 +1,87 @@
+import unittest
+import array
+import unittest.mock
+
+from pretor import stats
+
+
+class TestStats(unittest.TestCase):
+    def test_describe(this):
+        values = array.array("d", [0.5, 1.0, 0.25, 0.75])
+        result = stats.describe(values)
+        this.assertEqual(result["count"], 4)
+        this.assertAlmostEqual(result["mean"], 0.625)
+        this.assertAlmostEqual(result["min"], 0.25)
+        this.assertAlmostEqual(result["max"], 1.0)
+        this.assertAlmostEqual(result["median"], 0.625)
+        this.assertAlmostEqual(result["p25"], 0.4375)
+        this.assertAlmostEqual(result["p75"], 0.8125)
+        this.assertAlmostEqual(result["std"], 0.2795084971874737)
+
+    def test_describe_without_numpy(this):
+        values = array.array("d", [0.5, 1.0, 0.25, 0.75])
+        with unittest.mock.patch.object(stats, "numpy", None):
+            result = stats.describe(values)
+        for name, value in stats.describe(values).items():
+            this.assertAlmostEqual(result[name], value)
+        this.assertAlmostEqual(result["p25"], 0.4375)
+        this.assertAlmostEqual(result["std"], 0.2795084971874737)
+
+    def test_describe_empty(this):
+        this.assertIsNone(stats.describe(array.array("d"))["mean"])
+
+    def test_percentile(this):
+        data = [1.0, 2.0, 3.0, 4.0, 5.0]
+        this.assertEqual(stats.percentile(data, 0), 1.0)
+        this.assertEqual(stats.percentile(data, 50), 3.0)
+        this.assertEqual(stats.percentile(data, 100), 5.0)
+        this.assertEqual(stats.percentile(data, 10), 1.4)
+
+    def test_histogram(this):
+        this.assertEqual(
+            stats.histogram([-0.5, 0.0, 0.55, 0.99, 1.0, 1.2]),
+            [2, 0, 0, 0, 0, 1, 0, 0, 0, 3],
+        )
+
+    def test_grade_columns(this):
+        columns = stats.GradeColumns()
+        for section, score in [("001", 0.5), ("002", 1.0), ("001", 0.75)]:
+            columns.add_summary(
+                {
+                    "metadata": {"section": section},
+                    "grade": {
+                        "course": "ABC123",
+                        "assignment": "a1",
+                        "score": score,
+                        "categories": {"style": score * 10},
+                        "max_categories": {"style": 10},
+                    },
+                }
+            )
+        columns.add_summary({"metadata": {}, "grade": None})
+        columns.add_summary(
+            {
+                "metadata": {"section": 3},
+                "grade": {
+                    "course": "ABC123",
+                    "assignment": "a1",
+                    "score": 0.25,
+                    "categories": {},
+                    "max_categories": {},
+                },
+            }
+        )
+
+        groups = {(scope, key): list(v) for scope, key, v in columns.groups()}
+        this.assertEqual(
+            groups[("assignment", ("ABC123", "a1", ""))], [0.5, 1.0, 0.75, 0.25]
+        )
+        this.assertEqual(groups[("section", ("ABC123", "a1", "001"))], [0.5, 0.75])
+        this.assertEqual(groups[("section", ("ABC123", "a1", 3))], [0.25])
+        this.assertEqual(
+            [key[2] for scope, key, v in columns.groups() if scope == "section"],
+            ["001", "002", 3],
+        )
+        this.assertEqual(
+            groups[("category", ("ABC123", "a1", "style"))], [0.5, 1.0, 0.75]
+        )
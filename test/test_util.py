@@ -6,6 +6,8 @@ import os
 import pathlib
 import contextlib
 import io
+import unittest.mock
+import zipfile
 
 from pretor import util
 
@@ -21,3 +23,53 @@ class TestUtil(unittest.TestCase):
         this.assertFalse(util.compare_versions("1.0.0", "1.0.1"))
         this.assertTrue(util.compare_versions("2.0.0", "1.0.1"))
 
+
+    def test_parallel_map(this):
+
+        expected = [x * x for x in range(100)]
+        this.assertEqual(list(util.parallel_map(square, range(100), 1)), expected)
+        this.assertEqual(list(util.parallel_map(square, range(100), 4)), expected)
+        this.assertEqual(
+            list(util.parallel_map(square, range(100), 4, processes=False)), expected
+        )
+
+    def test_copy_zip_member(this):
+
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as f:
+            f.writestr("a/b.txt", b"hello " * 100, compress_type=zipfile.ZIP_DEFLATED)
+            f.writestr("c.txt", b"stored")
+
+        out = io.BytesIO()
+        with zipfile.ZipFile(buf, "r") as src, zipfile.ZipFile(out, "w") as dst:
+            dst.writestr("first", b"first")
+            util.copy_zip_member(src, "a/b.txt", dst, "x/b.txt")
+            util.copy_zip_member(src, "c.txt", dst, "c.txt")
+            dst.writestr("last", b"last")
+            original = src.getinfo("a/b.txt")
+
+        with zipfile.ZipFile(out, "r") as f:
+            this.assertIsNone(f.testzip())
+            this.assertEqual(f.read("x/b.txt"), b"hello " * 100)
+            this.assertEqual(f.read("c.txt"), b"stored")
+            this.assertEqual(f.read("last"), b"last")
+            copied = f.getinfo("x/b.txt")
+            this.assertEqual(copied.compress_size, original.compress_size)
+            this.assertEqual(copied.CRC, original.CRC)
+
+    def test_toml_loads(this):
+
+        doc = 'a = 1\nb = ["x", "y"]\n\n[c]\nd = 1.5\n'
+        expected = {"a": 1, "b": ["x", "y"], "c": {"d": 1.5}}
+        this.assertEqual(util.toml_loads(doc), expected)
+        this.assertEqual(util.toml_loads(doc.encode("utf-8")), expected)
+
+        with unittest.mock.patch.object(util, "tomllib", None):
+            this.assertEqual(util.toml_loads(doc), expected)
+
+        # raw control characters are rejected by tomllib, but not by toml
+        this.assertEqual(util.toml_loads('a = "\x01"\n'), {"a": "\x01"})
+
+
+def square(x):
+    return x * x
@@ -0,0 +1,76 @@
+import unittest
+import tempfile
+import shutil
+import os
+
+from pretor import course
+from pretor import psf
+from pretor import xsvimport
+
+
+def make_psf(**metadata):
+    psf_obj = psf.PSF()
+    psf_obj.metadata = metadata
+    return psf_obj
+
+
+class TestXsvImport(unittest.TestCase):
+    def test_index_collection(this):
+        a = make_psf(course="ABC123", section=1, group="g1")
+        b = make_psf(course="ABC123", section=2, group="g1")
+        c = make_psf(course="ABC123", section=2, group="g1")
+        d = make_psf(course="ABC123")
+
+        keys = ["section", "group"]
+        index = xsvimport.index_collection([a, b, c, d], keys)
+
+        this.assertEqual(len(index), 2)
+        rec = {"section": "1", "group": "g1", "style": "10"}
+        this.assertEqual(index[xsvimport.record_key(rec, keys)], [a])
+        rec["section"] = "2"
+        this.assertEqual(index[xsvimport.record_key(rec, keys)], [b, c])
+        rec["section"] = "3"
+        this.assertNotIn(xsvimport.record_key(rec, keys), index)
+
+    def test_apply_records(this):
+        courses = {
+            "ABC123": course.load_course_definition(
+                {
+                    "course": {"name": "ABC123"},
+                    "A1": {"name": "A1", "weight": 1.0, "style": 30, "tests": 70},
+                }
+            )
+        }
+        psf_obj = make_psf(course="ABC123", assignment="A1", group="g1")
+        psf_obj.revisions["submission"] = psf.Revision(psf_obj, "submission")
+
+        recs = [
+            {"group": "g1", "style": "10", "feedback": "first"},
+            {"group": "g1", "tests": "35", "feedback": "second"},
+        ]
+        this.assertTrue(xsvimport.apply_records(psf_obj, recs, courses))
+        this.assertEqual(list(psf_obj.revisions), ["submission", "graded_0"])
+
+        grade_obj = psf_obj.get_grade_rev().grade
+        this.assertEqual(grade_obj.categories, {"style": 10, "tests": 35})
+        this.assertEqual(grade_obj.feedback, "second")
+
+        psf_obj.metadata["course"] = "XYZ999"
+        this.assertFalse(xsvimport.apply_records(psf_obj, recs, courses))
+        this.assertEqual(len(psf_obj.revisions), 2)
+
+    def test_save_psf_error(this):
+        test_dir = tempfile.mkdtemp()
+        try:
+            saved = make_psf(course="ABC123")
+            saved.loaded_from = os.path.join(test_dir, "saved.psf")
+            missing = make_psf(course="ABC123")
+            missing.loaded_from = os.path.join(test_dir, "missing", "missing.psf")
+
+            this.assertEqual(xsvimport.save_psf(saved), (saved, None))
+            psf_obj, error = xsvimport.save_psf(missing)
+            this.assertIs(psf_obj, missing)
+            this.assertIsInstance(error, OSError)
+            this.assertEqual(os.listdir(test_dir), ["saved.psf"])
+        finally:
+            shutil.rmtree(test_dir)